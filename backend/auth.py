@@ -1,12 +1,19 @@
 from datetime import datetime, timedelta
-from typing import Optional, Tuple
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional, Set, Tuple
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from .database import get_db
 from . import models
+from .utils import versions
+import asyncio
 import os
+import threading
+import time
 from dotenv import load_dotenv
 import bcrypt
 
@@ -17,14 +24,133 @@ SECRET_KEY = os.getenv("SECRET_KEY", "09d25e094faa6ca2556c818166b7a9563b93f7099f
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", "60"))
+PRINCIPAL_CACHE_SIZE = int(os.getenv("PRINCIPAL_CACHE_SIZE", "10000"))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", "12"))
+# bcrypt releases the GIL, so a few dedicated threads keep logins from
+# queueing behind (or in front of) other requests in the shared threadpool
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+_password_hash_executor = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash"
+)
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/token")
 
+class Principal:
+    """What request handlers need to know about the authenticated user."""
+    __slots__ = ("id", "username", "is_active", "is_admin")
+
+    def __init__(self, id: int, username: str, is_active: bool, is_admin: bool):
+        self.id = id
+        self.username = username
+        self.is_active = is_active
+        self.is_admin = is_admin
+
+class PrincipalCache:
+    """Bounded LRU of verified access token -> Principal.
+
+    Entries live for at most PRINCIPAL_CACHE_TTL_SECONDS and never past the
+    token's own expiry, and are only used while the users version
+    (utils.versions) is the one they were loaded at. Changes to a user must
+    record a USERS change, which every worker process sees within
+    VERSION_CACHE_SECONDS, and call ``invalidate_user`` for this one.
+    """
+
+    def __init__(self, max_size: int, ttl: int):
+        self.max_size = max_size
+        self.ttl = ttl
+        # token -> (principal, expires at, users version it was loaded at)
+        self._entries: "OrderedDict[str, Tuple[Principal, float, int]]" = OrderedDict()
+        self._tokens_by_user: Dict[int, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, token: str, users_version: Optional[int]) -> Optional[Principal]:
+        """The principal of ``token`` if it was loaded at ``users_version``;
+        None (no version known) always misses."""
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is not None and entry[1] > time.time() and entry[2] == users_version:
+                self._entries.move_to_end(token)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                self._remove(token)
+            self.misses += 1
+            return None
+
+    def put(self, token: str, principal: Principal, token_exp: float, users_version: int):
+        expires_at = min(time.time() + self.ttl, token_exp)
+        with self._lock:
+            if token in self._entries:
+                self._remove(token)
+            self._entries[token] = (principal, expires_at, users_version)
+            self._tokens_by_user.setdefault(principal.id, set()).add(token)
+            while len(self._entries) > self.max_size:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def invalidate_user(self, user_id: int):
+        with self._lock:
+            for token in list(self._tokens_by_user.get(user_id, ())):
+                self._remove(token)
+            self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._tokens_by_user.clear()
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, token: str):
+        principal = self._entries.pop(token)[0]
+        tokens = self._tokens_by_user.get(principal.id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._tokens_by_user[principal.id]
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_SIZE, PRINCIPAL_CACHE_TTL_SECONDS)
+
+def invalidate_user(user_id: int):
+    principal_cache.invalidate_user(user_id)
+
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     return bcrypt.checkpw(plain_password.encode('utf-8'), hashed_password.encode('utf-8'))
 
 def get_password_hash(password: str) -> str:
-    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS)).decode('utf-8')
+
+def password_needs_rehash(hashed_password: str) -> bool:
+    # bcrypt hashes look like $2b$<cost>$<salt and digest>
+    try:
+        return int(hashed_password.split('$')[2]) != BCRYPT_ROUNDS
+    except (IndexError, ValueError):
+        return True
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_hash_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password: str) -> str:
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_password_hash_executor, get_password_hash, password)
 
 def create_tokens(data: dict) -> Tuple[str, str]:
     access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
@@ -45,7 +171,14 @@ def create_token(data: dict, expires_delta: Optional[timedelta] = None) -> str:
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)) -> Principal:
+    # A cached token was verified and its user looked up less than a TTL ago,
+    # and no user has changed since in any process as far as the users
+    # version read less than VERSION_CACHE_SECONDS ago tells
+    principal = principal_cache.get(token, versions.known_version(versions.USERS))
+    if principal is not None:
+        return principal
+
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -62,16 +195,33 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     except JWTError:
         raise credentials_exception
     
-    user = db.query(models.User).filter(models.User.username == username).first()
+    # The users version comes with the user, in the same statement
+    user = await versions.read_with_versions(
+        db,
+        select(models.User.id, models.User.username, models.User.is_active, models.User.is_admin)
+        .where(models.User.username == username),
+        [versions.USERS]
+    )
     if user is None:
         raise credentials_exception
-    return user
 
-async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+    principal = Principal(user.id, user.username, bool(user.is_active), bool(user.is_admin))
+    principal_cache.put(token, principal, token_exp, user[-1])
+    return principal
+
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)) -> Principal:
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
+async def get_current_admin_user(current_user: Principal = Depends(get_current_active_user)) -> Principal:
+    if not current_user.is_admin:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin privileges required"
+        )
+    return current_user
+
 def verify_refresh_token(refresh_token: str) -> dict:
     try:
         payload = jwt.decode(refresh_token, SECRET_KEY, algorithms=[ALGORITHM])
@@ -0,0 +1,61 @@
+import json
+import math
+import os
+import sys
+import tempfile
+from typing import Any, Dict, List, Optional
+
+def use_scratch_database(path: Optional[str] = None) -> str:
+    """Point DATABASE_URL at a throwaway SQLite file.
+
+    Must run before anything under backend is imported, since the engine is
+    created at import time.
+    """
+    if path is None:
+        handle, path = tempfile.mkstemp(prefix="pos_bench_", suffix=".db")
+        os.close(handle)
+        os.remove(path)
+    os.environ["DATABASE_URL"] = f"sqlite:///{path}"
+    return path
+
+def build_app():
+    from fastapi import FastAPI
+    from ..routers import auth, products, customers, sales, invoices, reports
+
+    app = FastAPI(title="POS System API (benchmark)")
+    app.include_router(auth.router, prefix="/auth")
+    app.include_router(products.router, prefix="/products")
+    app.include_router(customers.router, prefix="/customers")
+    app.include_router(sales.router, prefix="/sales")
+    app.include_router(invoices.router, prefix="/invoices")
+    app.include_router(reports.router, prefix="/reports")
+    return app
+
+def percentile(samples: List[float], pct: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, math.ceil(pct / 100 * len(ordered)) - 1)
+    return ordered[index]
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    # Latencies are in seconds; the summary reports milliseconds
+    count = len(latencies) + errors
+    return {
+        "requests": count,
+        "errors": errors,
+        "error_rate": errors / count if count else 0.0,
+        "throughput_rps": count / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 50) * 1000,
+        "p95_ms": percentile(latencies, 95) * 1000,
+        "p99_ms": percentile(latencies, 99) * 1000,
+        "max_ms": max(latencies) * 1000 if latencies else 0.0,
+    }
+
+def write_result(result: Dict[str, Any], output: Optional[str]):
+    text = json.dumps(result, indent=2, sort_keys=True)
+    if output:
+        with open(output, "w") as f:
+            f.write(text + "\n")
+    else:
+        sys.stdout.write(text + "\n")
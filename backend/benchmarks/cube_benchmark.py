@@ -0,0 +1,129 @@
+"""Query latency of the in-memory sales cube.
+
+Fills a cube with synthetic line items generated with NumPy (a year of
+sales, Zipf product popularity, a daily trading curve) without going
+through the database, then times a set of /reports/query style questions
+and reports their latency percentiles as JSON. Run from the repository
+root:
+
+    python -m backend.benchmarks.cube_benchmark --line-items 50000000
+"""
+import argparse
+import contextlib
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict
+
+import numpy as np
+
+from .common import summarize, use_scratch_database, write_result
+
+DAY = 86400
+
+def line_items(rng: np.random.Generator, count: int, first_day: int, days: int,
+               products: int, customers: int, cashiers: int) -> Dict[str, np.ndarray]:
+    """``count`` line items sold over ``days`` days from ``first_day`` (days since the epoch)."""
+    # Mostly trading hours, peaking at lunch and in the evening
+    hours = np.where(rng.random(count) < 0.5, rng.normal(12.5, 1.5, count), rng.normal(18.5, 2, count))
+    ts = (first_day + rng.integers(0, days, count)) * DAY + (np.clip(hours, 0, 23.99) * 3600).astype(np.int64)
+    ts.sort()
+    product_ids = np.minimum(rng.zipf(1.3, count), products).astype(np.int32)
+    customer_ids = np.where(rng.random(count) < 0.6, 0, rng.integers(1, customers + 1, count)).astype(np.int32)
+    quantity = rng.integers(1, 6, count).astype(np.float64)
+    return {
+        "ts": ts,
+        "hour": (ts // 3600 % 24).astype(np.int8),
+        "product_id": product_ids,
+        "customer_id": customer_ids,
+        "user_id": rng.integers(1, cashiers + 1, count).astype(np.int32),
+        "quantity": quantity,
+        "amount": quantity * (1 + product_ids % 50).astype(np.float64),
+        # Three items per sale on average
+        "sale_id": np.arange(count, dtype=np.int64) // 3 + 1,
+        "excluded": np.zeros(count, np.bool_),
+    }
+
+def questions(end: datetime, products: int, cashiers: int) -> Dict[str, Dict[str, Any]]:
+    # Whole days, which the cube answers from its day x product blocks
+    last_month = {"start_date": datetime.combine(end.date() - timedelta(days=30), datetime.min.time()),
+                  "end_date": datetime.combine(end.date(), datetime.max.time()).replace(microsecond=0)}
+    return {
+        "totals_last_30_days": {"start_date": end - timedelta(days=30)},
+        "top_products_all_time": {"group_by": ["product"], "limit": 10},
+        "top_products_last_30_whole_days": {**last_month, "group_by": ["product"], "limit": 10},
+        "product_by_day_last_30_whole_days": {**last_month, "group_by": ["product", "day"], "limit": 1000},
+        "revenue_by_day_all_time": {"group_by": ["day"], "limit": 366},
+        "hourly_for_100_products_90_days": {
+            "start_date": end - timedelta(days=90), "product_ids": list(range(1, min(products, 100) + 1)),
+            "group_by": ["hour"]
+        },
+        "cashier_by_day_for_3_cashiers": {
+            "user_ids": list(range(1, min(cashiers, 3) + 1)), "group_by": ["user", "day"], "limit": 1000
+        },
+        "lunchtime_top_customers_all_time": {"hours": [11, 12, 13], "group_by": ["customer"], "limit": 20},
+        "product_by_customer_last_7_days": {
+            "start_date": end - timedelta(days=7), "group_by": ["product", "customer"], "limit": 50
+        },
+    }
+
+def run(args) -> Dict[str, Any]:
+    from ..database import SessionLocal, init_db
+    from ..utils.sales_cube import SalesCube, epoch_seconds
+
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db()
+    rng = np.random.default_rng(args.seed)
+    end = datetime.utcnow().replace(microsecond=0)
+
+    started = time.perf_counter()
+    cube = SalesCube()
+    db = SessionLocal()
+    try:
+        # The scratch database has no sales, so the cube holds only the synthetic rows
+        cube.load(db)
+        cube.reserve(args.line_items)
+        # One stretch of days per chunk, so chunks arrive in time order as sales would
+        chunks = -(-args.line_items // args.chunk_size)
+        first_day = epoch_seconds(end) // DAY - args.days + 1
+        edges = np.linspace(0, args.days, chunks + 1).astype(int)
+        for chunk in range(chunks):
+            count = min(args.chunk_size, args.line_items - chunk * args.chunk_size)
+            cube.append(line_items(rng, count, first_day + edges[chunk], max(1, edges[chunk + 1] - edges[chunk]),
+                                   args.products, args.customers, args.cashiers))
+        build_seconds = time.perf_counter() - started
+
+        result = {"line_items": len(cube), "day_product_blocks": cube.block_count, "build_seconds": build_seconds,
+                  "queries": {}}
+        for name, question in questions(end, args.products, args.cashiers).items():
+            latencies = []
+            for _ in range(args.repeat):
+                began = time.perf_counter()
+                answer = cube.query(db, **question)
+                latencies.append(time.perf_counter() - began)
+            summary = summarize(latencies, 0, sum(latencies))
+            summary["groups"] = len(answer["groups"])
+            result["queries"][name] = summary
+    finally:
+        db.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Time ad-hoc queries over the in-memory sales cube")
+    parser.add_argument("--line-items", type=int, default=10_000_000)
+    parser.add_argument("--products", type=int, default=100_000)
+    parser.add_argument("--customers", type=int, default=200_000)
+    parser.add_argument("--cashiers", type=int, default=50)
+    parser.add_argument("--days", type=int, default=365)
+    parser.add_argument("--repeat", type=int, default=10, help="runs of each query")
+    parser.add_argument("--chunk-size", type=int, default=5_000_000, help="line items generated per append")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--database", help="SQLite file for the scratch database (default: a scratch file)")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    use_scratch_database(args.database)
+    write_result(run(args), args.output)
+
+if __name__ == "__main__":
+    main()
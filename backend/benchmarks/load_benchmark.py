@@ -0,0 +1,310 @@
+"""End-to-end load benchmark for checkout, catalog, customer lookup and reports.
+
+Seeds a database (see seed.py), then replays a fixed sequence of requests
+drawn from a weighted mix by a pool of concurrent clients: multi-item
+checkouts, catalog polling and search, customer lookups and report reads.
+Reports throughput, latency percentiles and error rates, overall and per
+scenario, as JSON. Run from the repository root:
+
+    python -m backend.benchmarks.load_benchmark --requests 2000 --concurrency 32
+
+Pass --baseline with the JSON of an earlier run to compare against it; the
+exit status is 1 if a scenario regressed by more than --tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+from collections import Counter
+from itertools import accumulate
+from typing import Any, Callable, Dict, List, NamedTuple, Optional
+
+from .common import summarize, use_scratch_database, write_result
+from .seed import SEED_PASSWORD, seed_database
+
+DEFAULT_MIX = "checkout=40,catalog=30,lookup=20,report=10"
+
+class Dataset(NamedTuple):
+    product_ids: List[int]
+    # Cumulative Zipf weights over product_ids, so a few products sell most
+    product_weights: List[float]
+    search_terms: List[str]
+    customer_ids: List[int]
+    lookups: List[str]
+    usernames: List[str]
+
+def load_dataset(rng: random.Random, cashiers: int) -> Dataset:
+    from ..database import SessionLocal
+    from .. import models
+
+    db = SessionLocal()
+    try:
+        product_ids = [row.id for row in db.query(models.Product.id).order_by(models.Product.id)]
+        names = [row.name for row in db.query(models.Product.name).limit(1000)]
+        customers = db.query(models.Customer.id, models.Customer.name, models.Customer.phone).all()
+        usernames = [
+            row.username for row in db.query(models.User.username)
+            .filter(models.User.username.like("cashier%")).order_by(models.User.id).limit(cashiers)
+        ]
+    finally:
+        db.close()
+
+    popularity = product_ids[:]
+    rng.shuffle(popularity)
+    lookups = []
+    for customer in customers[:1000]:
+        lookups.append(customer.name.split()[-1][:3])
+        if customer.phone:
+            lookups.append(customer.phone[-10:-4])
+    return Dataset(
+        product_ids=popularity,
+        product_weights=list(accumulate(1 / rank for rank in range(1, len(popularity) + 1))),
+        search_terms=sorted({word[:4] for name in names for word in name.split() if len(word) >= 4}),
+        customer_ids=[customer.id for customer in customers],
+        lookups=lookups,
+        usernames=usernames,
+    )
+
+def stripe_products(product_ids: List[int], stripes: int):
+    from ..database import SessionLocal
+    from .. import models
+    from ..utils.stock_stripes import set_stripes
+
+    db = SessionLocal()
+    try:
+        for product in db.query(models.Product).filter(models.Product.id.in_(product_ids)):
+            set_stripes(db, product, stripes)
+        db.commit()
+    finally:
+        db.close()
+
+async def checkout(client, headers, rng: random.Random, data: Dataset, max_basket: int):
+    size = min(len(data.product_ids), rng.randint(1, max_basket))
+    basket = set()
+    while len(basket) < size:
+        basket.add(rng.choices(data.product_ids, cum_weights=data.product_weights)[0])
+    sale = {
+        "payment_method": rng.choice(["cash", "card"]),
+        "items": [{"product_id": product_id, "quantity": rng.randint(1, 3)} for product_id in basket],
+    }
+    if data.customer_ids and rng.random() < 0.5:
+        sale["customer_id"] = rng.choice(data.customer_ids)
+    return await client.post("/sales/", json=sale, headers=headers)
+
+async def hot_checkout(client, headers, rng: random.Random, data: Dataset, max_basket: int):
+    # Every register selling the best-seller at once, as in a flash sale
+    sale = {"payment_method": "card", "items": [{"product_id": data.product_ids[0], "quantity": 1}]}
+    return await client.post("/sales/", json=sale, headers=headers)
+
+async def catalog(client, headers, rng: random.Random, data: Dataset, max_basket: int):
+    roll = rng.random()
+    if roll < 0.6:
+        return await client.get("/products/", params={"limit": 50}, headers=headers)
+    if roll < 0.85 or not data.search_terms:
+        product_id = rng.choices(data.product_ids, cum_weights=data.product_weights)[0]
+        return await client.get(f"/products/{product_id}", headers=headers)
+    return await client.get("/products/search", params={"q": rng.choice(data.search_terms)}, headers=headers)
+
+async def lookup(client, headers, rng: random.Random, data: Dataset, max_basket: int):
+    return await client.get("/customers/lookup", params={"q": rng.choice(data.lookups or ["cus"])}, headers=headers)
+
+async def report(client, headers, rng: random.Random, data: Dataset, max_basket: int):
+    roll = rng.random()
+    if roll < 0.4:
+        return await client.get("/reports/weekly", headers=headers)
+    if roll < 0.6:
+        return await client.get("/reports/monthly", headers=headers)
+    return await client.get("/reports/latest/weekly_sales/weekly", headers=headers)
+
+SCENARIOS: Dict[str, Callable] = {
+    "checkout": checkout,
+    "hot_checkout": hot_checkout,
+    "catalog": catalog,
+    "lookup": lookup,
+    "report": report,
+}
+
+def parse_mix(mix: str) -> Dict[str, float]:
+    weights = {}
+    for part in mix.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in SCENARIOS:
+            raise argparse.ArgumentTypeError(f"unknown scenario {name!r}, expected one of {', '.join(SCENARIOS)}")
+        weights[name] = float(weight or 1)
+    return weights
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(result: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> Dict[str, Any]:
+    """Per scenario ratios against a baseline run and the scenarios whose
+    p95 latency or throughput moved the wrong way by more than ``tolerance``,
+    or whose error rate went up."""
+    comparison: Dict[str, Any] = {"baseline_commit": baseline.get("config", {}).get("commit"), "scenarios": {}}
+    regressions = []
+    for name, current in result["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        p95 = current["p95_ms"] / before["p95_ms"] if before["p95_ms"] else None
+        throughput = current["throughput_rps"] / before["throughput_rps"] if before["throughput_rps"] else None
+        comparison["scenarios"][name] = {
+            "p95_ratio": p95,
+            "throughput_ratio": throughput,
+            "error_rate_delta": current["error_rate"] - before["error_rate"],
+        }
+        if (p95 and p95 > 1 + tolerance) or (throughput and throughput < 1 - tolerance) \
+                or current["error_rate"] > before["error_rate"]:
+            regressions.append(name)
+    comparison["regressions"] = regressions
+    return comparison
+
+async def run(args) -> Dict[str, Any]:
+    import httpx
+    from .common import build_app
+
+    rng = random.Random(args.seed)
+    seeded = None
+    if not args.no_seed:
+        seeded = seed_database(args.products, args.customers, args.sales, users=args.cashiers, seed=args.seed)
+    data = load_dataset(rng, args.cashiers)
+    if args.stripes:
+        # The best-sellers are the hot rows checkouts queue on
+        stripe_products(data.product_ids[:args.hot_products], args.stripes)
+
+    weights = args.mix
+    names = list(weights)
+    total = args.warmup + args.requests
+    plan = list(zip(rng.choices(names, weights=[weights[name] for name in names], k=total),
+                    (rng.getrandbits(32) for _ in range(total))))
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=build_app()), base_url="http://bench", timeout=60)
+
+    async with client:
+        tokens = []
+        for username in data.usernames:
+            response = await client.post("/auth/token", data={"username": username, "password": SEED_PASSWORD})
+            response.raise_for_status()
+            tokens.append({"Authorization": f"Bearer {response.json()['access_token']}"})
+        if not tokens:
+            raise RuntimeError("no cashier accounts to log in with; run without --no-seed")
+
+        latencies: Dict[str, List[float]] = {name: [] for name in names}
+        errors: Counter = Counter()
+        statuses: Dict[str, Counter] = {name: Counter() for name in names}
+        position = 0
+
+        async def worker(record: bool, stop: int):
+            nonlocal position
+            while position < stop:
+                index = position
+                position += 1
+                name, request_seed = plan[index]
+                start = time.perf_counter()
+                try:
+                    response = await SCENARIOS[name](
+                        client, tokens[index % len(tokens)], random.Random(request_seed), data, args.max_basket
+                    )
+                    status = response.status_code
+                except httpx.HTTPError as e:
+                    status = type(e).__name__
+                elapsed = time.perf_counter() - start
+                if not record:
+                    continue
+                statuses[name][str(status)] += 1
+                if isinstance(status, int) and status < 400:
+                    latencies[name].append(elapsed)
+                else:
+                    errors[name] += 1
+
+        # Warm the caches so they do not count against the first requests
+        await asyncio.gather(*(worker(False, args.warmup) for _ in range(args.concurrency)))
+        started = time.perf_counter()
+        await asyncio.gather(*(worker(True, total) for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    scenarios = {}
+    for name in names:
+        scenarios[name] = summarize(latencies[name], errors[name], elapsed)
+        scenarios[name]["status_codes"] = dict(statuses[name])
+    return {
+        "benchmark": "load",
+        "config": {
+            "commit": git_commit(),
+            "target": args.url or "in-process",
+            "requests": args.requests,
+            "warmup": args.warmup,
+            "concurrency": args.concurrency,
+            "mix": weights,
+            "max_basket": args.max_basket,
+            "stripes": args.stripes,
+            "seed": args.seed,
+            "dataset": {
+                "products": len(data.product_ids),
+                "customers": len(data.customer_ids),
+                "cashiers": len(tokens),
+            },
+        },
+        "seeding": seeded,
+        "overall": summarize(
+            [latency for samples in latencies.values() for latency in samples], sum(errors.values()), elapsed
+        ),
+        "scenarios": scenarios,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test checkout, catalog, customer lookup and reports")
+    parser.add_argument("--products", type=int, default=1000)
+    parser.add_argument("--customers", type=int, default=1000)
+    parser.add_argument("--sales", type=int, default=10000, help="sales history to seed")
+    parser.add_argument("--cashiers", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--warmup", type=int, default=100)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--mix", type=parse_mix, default=DEFAULT_MIX, help=f"scenario weights (default {DEFAULT_MIX})")
+    parser.add_argument("--max-basket", type=int, default=8, help="most distinct products in one checkout")
+    parser.add_argument("--stripes", type=int, default=0,
+                        help="spread the stock of the best-selling products over this many stripes")
+    parser.add_argument("--hot-products", type=int, default=10, help="how many products --stripes applies to")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--url", help="load a running server instead of an in-process app; it must use "
+                                      "the DATABASE_URL this process seeds")
+    parser.add_argument("--no-seed", action="store_true", help="use the data already in the database")
+    parser.add_argument("--database", help="SQLite file for an in-process run (default: a scratch file)")
+    parser.add_argument("--database-url", help="run in-process against this database, e.g. a PostgreSQL one, "
+                                               "instead of a SQLite file")
+    parser.add_argument("--baseline", help="JSON result of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2,
+                        help="relative p95 or throughput change counted as a regression")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    if args.database_url:
+        os.environ["DATABASE_URL"] = args.database_url
+    elif not args.url:
+        use_scratch_database(args.database)
+    result = asyncio.run(run(args))
+
+    regressed = False
+    if args.baseline:
+        with open(args.baseline) as f:
+            result["comparison"] = compare(result, json.load(f), args.tolerance)
+        regressed = bool(result["comparison"]["regressions"])
+    write_result(result, args.output)
+    sys.exit(1 if regressed else 0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,113 @@
+"""Concurrent login benchmark.
+
+Logs many users in at once, as at shift change, while a probe keeps
+requesting an unrelated authenticated endpoint, and reports login and probe
+latency percentiles as JSON. Run from the repository root:
+
+    python -m backend.benchmarks.login_benchmark --users 50 --logins 500 --concurrency 100
+"""
+import argparse
+import asyncio
+import contextlib
+import sys
+import time
+from typing import List
+
+from .common import build_app, summarize, use_scratch_database, write_result
+
+async def run(args) -> dict:
+    import httpx
+    from ..auth import BCRYPT_ROUNDS, PASSWORD_HASH_WORKERS, get_password_hash_async
+    from ..database import SessionLocal, init_db
+    from .. import models
+
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db()
+    password = "benchmark-password"
+    hashed = await get_password_hash_async(password)
+    db = SessionLocal()
+    try:
+        # One hash is enough to seed: every user gets the same password
+        db.add_all([
+            models.User(username=f"cashier{i}", email=f"cashier{i}@example.com", hashed_password=hashed)
+            for i in range(args.users)
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+    if args.url:
+        client = httpx.AsyncClient(base_url=args.url, timeout=60)
+    else:
+        client = httpx.AsyncClient(transport=httpx.ASGITransport(app=build_app()), base_url="http://bench", timeout=60)
+
+    async with client:
+        response = await client.post("/auth/token", data={"username": "cashier0", "password": password})
+        probe_headers = {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+        semaphore = asyncio.Semaphore(args.concurrency)
+        login_latencies: List[float] = []
+        probe_latencies: List[float] = []
+        errors = {"login": 0, "probe": 0}
+        done = asyncio.Event()
+
+        async def login(i: int):
+            async with semaphore:
+                start = time.perf_counter()
+                response = await client.post(
+                    "/auth/token",
+                    data={"username": f"cashier{i % args.users}", "password": password}
+                )
+                if response.status_code == 200:
+                    login_latencies.append(time.perf_counter() - start)
+                else:
+                    errors["login"] += 1
+
+        async def probe():
+            while not done.is_set():
+                start = time.perf_counter()
+                response = await client.get("/products/?limit=1", headers=probe_headers)
+                if response.status_code == 200:
+                    probe_latencies.append(time.perf_counter() - start)
+                else:
+                    errors["probe"] += 1
+                await asyncio.sleep(args.probe_interval)
+
+        probe_task = asyncio.create_task(probe())
+        start = time.perf_counter()
+        await asyncio.gather(*(login(i) for i in range(args.logins)))
+        elapsed = time.perf_counter() - start
+        done.set()
+        await probe_task
+
+    return {
+        "benchmark": "login",
+        "config": {
+            "users": args.users,
+            "logins": args.logins,
+            "concurrency": args.concurrency,
+            "bcrypt_rounds": BCRYPT_ROUNDS,
+            "hash_workers": PASSWORD_HASH_WORKERS,
+            "target": args.url or "in-process",
+        },
+        "login": summarize(login_latencies, errors["login"], elapsed),
+        "probe": summarize(probe_latencies, errors["probe"], elapsed),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark /auth/token under concurrent load")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--logins", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=100)
+    parser.add_argument("--probe-interval", type=float, default=0.05,
+                        help="seconds between probe requests to /products/")
+    parser.add_argument("--url", help="benchmark a running server instead of an in-process app")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    if not args.url:
+        use_scratch_database()
+    write_result(asyncio.run(run(args)), args.output)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,312 @@
+"""Seed a database with a large synthetic but realistic dataset.
+
+Products, customers, cashiers, sales, sale items and invoices are generated
+with vectorised NumPy from a fixed seed, so two runs with the same
+arguments produce the same data:
+
+- product popularity follows a Zipf law, so a few products sell most
+- sales follow a diurnal curve with lunch and evening peaks and busier
+  weekends, and are numbered in time order
+- basket sizes are geometric around --mean-basket, capped at --max-basket
+- a share of customers come back often, a share of sales are invoiced
+
+Each chunk of sales is written in one transaction with a single
+executemany per table (COPY on PostgreSQL with psycopg2). Invoice lines
+are copied from the sale lines inside the database. Run it offline, from
+the repository root, against DATABASE_URL:
+
+    python -m backend.benchmarks.seed --products 100000 --customers 200000 --sales 2000000
+"""
+import argparse
+import contextlib
+import csv
+import io
+import sys
+import time
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+from sqlalchemy import func, insert, literal, select, text
+
+SEED_CHUNK_SIZE = 100_000
+SEED_STOCK = 1_000_000
+SEED_PASSWORD = "benchmark-password"
+
+WORDS = np.array(["espresso", "latte", "bagel", "muffin", "sandwich", "salad", "juice", "water", "cookie", "tea",
+                  "croissant", "wrap", "soup", "yogurt", "granola", "brownie", "smoothie", "chips", "apple", "banana"])
+FIRST_NAMES = np.array(["James", "Mary", "John", "Linda", "Ahmed", "Fatima", "Wei", "Mei", "Carlos", "Sofia",
+                        "Olga", "Ivan", "Aisha", "Omar", "Priya", "Raj", "Emma", "Noah", "Lucas", "Chloe"])
+LAST_NAMES = np.array(["Smith", "Johnson", "Garcia", "Nguyen", "Khan", "Haddad", "Chen", "Kowalski", "Silva",
+                       "Brown", "Martin", "Lopez", "Ali", "Tanaka", "Muller", "Rossi", "Dubois", "Ivanov",
+                       "Patel", "Cohen"])
+
+# Relative trade per hour of the day and per weekday (Monday first)
+HOURLY_TRADE = np.array([0.1, 0.05, 0.05, 0.05, 0.1, 0.3, 1.0, 2.5, 4.0, 3.0, 2.8, 3.5,
+                         5.5, 5.0, 3.0, 2.5, 3.0, 4.5, 5.0, 3.5, 2.0, 1.2, 0.6, 0.3])
+WEEKDAY_TRADE = np.array([0.9, 0.85, 0.9, 1.0, 1.2, 1.4, 1.1])
+SALE_STATUSES = np.array(["completed", "cancelled", "pending"])
+SALE_STATUS_SHARES = [0.97, 0.02, 0.01]
+INVOICE_STATUSES = np.array(["paid", "pending", "cancelled"])
+INVOICE_STATUS_SHARES = [0.75, 0.2, 0.05]
+PAYMENT_METHODS = np.array(["card", "cash", "mobile"])
+TAX_RATE = 0.08
+
+def zipf_probabilities(count: int, exponent: float) -> np.ndarray:
+    weights = 1.0 / np.arange(1, count + 1) ** exponent
+    return weights / weights.sum()
+
+def sql_timestamps(values: np.ndarray) -> List[str]:
+    # The text form SQLAlchemy stores on SQLite, which PostgreSQL also accepts
+    return np.char.replace(np.datetime_as_string(values, unit="us"), "T", " ").tolist()
+
+def sale_timestamps(rng: np.random.Generator, count: int, end: datetime, days: int) -> np.ndarray:
+    """``count`` sorted timestamps over the ``days`` days before ``end``,
+    drawn from the weekday and hour-of-day trade curves."""
+    start = np.datetime64(end.date(), "s") - np.timedelta64(days, "D")
+    first_weekday = (end.date() - timedelta(days=days)).weekday()
+    day_weights = WEEKDAY_TRADE[(first_weekday + np.arange(days)) % 7]
+    day = rng.choice(days, size=count, p=day_weights / day_weights.sum())
+    hour = rng.choice(24, size=count, p=HOURLY_TRADE / HOURLY_TRADE.sum())
+    seconds = day * 86400 + hour * 3600 + rng.integers(0, 3600, size=count)
+    seconds.sort()
+    return start + seconds.astype("timedelta64[s]")
+
+def bulk_insert(connection, table_name: str, columns: Sequence[str], rows: List[Sequence[Any]]):
+    """Insert ``rows`` (tuples in ``columns`` order) with one round trip,
+    bypassing the ORM and SQLAlchemy's per-row parameter processing."""
+    if not rows:
+        return
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.driver == "psycopg2":
+            buffer = io.StringIO()
+            csv.writer(buffer).writerows(rows)
+            buffer.seek(0)
+            cursor.copy_expert(f"COPY {table_name} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        else:
+            marker = "?" if connection.dialect.paramstyle == "qmark" else "%s"
+            cursor.executemany(
+                f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join([marker] * len(columns))})",
+                rows
+            )
+    finally:
+        cursor.close()
+
+def product_rows(rng: np.random.Generator, count: int, offset: int = 0) -> List[tuple]:
+    first = WORDS[rng.integers(0, len(WORDS), count)]
+    second = WORDS[rng.integers(0, len(WORDS), count)]
+    descriptions = WORDS[rng.integers(0, len(WORDS), (count, 6))]
+    # Most items are cheap, a long tail is not
+    prices = np.round(np.clip(rng.lognormal(1.6, 0.8, count), 0.25, 500), 2)
+    return [
+        (f"{a.title()} {b} {offset + i}", " ".join(words), price, SEED_STOCK)
+        for i, (a, b, words, price) in enumerate(zip(first.tolist(), second.tolist(),
+                                                     descriptions.tolist(), prices.tolist()))
+    ]
+
+def customer_rows(rng: np.random.Generator, count: int, offset: int = 0) -> List[tuple]:
+    first = FIRST_NAMES[rng.integers(0, len(FIRST_NAMES), count)]
+    last = LAST_NAMES[rng.integers(0, len(LAST_NAMES), count)]
+    phones = rng.integers(2_000_000_000, 10_000_000_000, count)
+    return [
+        (f"{a} {b}", f"customer{offset + i}@example.com", f"+1{phone}")
+        for i, (a, b, phone) in enumerate(zip(first.tolist(), last.tolist(), phones.tolist()))
+    ]
+
+def _number_invoices(days: np.ndarray, counters: Dict[Any, int]) -> List[str]:
+    # Continue each day's sequence where the counter table (or the previous
+    # chunk) left it, in time order
+    from ..utils.invoice_numbers import format_invoice_number
+
+    unique_days, inverse, counts = np.unique(days, return_inverse=True, return_counts=True)
+    order = np.argsort(inverse, kind="stable")
+    rank = np.empty(len(days), dtype=np.int64)
+    rank[order] = np.arange(len(days)) - np.repeat(np.cumsum(counts) - counts, counts)
+    calendar_days = unique_days.astype(object)
+    base = np.array([counters.get(day, 0) for day in calendar_days], dtype=np.int64)
+    values = base[inverse] + rank + 1
+    for day, start, count in zip(calendar_days, base.tolist(), counts.tolist()):
+        counters[day] = start + count
+    return [format_invoice_number(day, value) for day, value in zip(calendar_days[inverse], values.tolist())]
+
+def seed_database(products: int, customers: int, sales: int, users: int = 10, days: int = 90,
+                  mean_basket: float = 3.5, max_basket: int = 30, zipf_exponent: float = 1.1,
+                  customer_share: float = 0.6, invoice_share: float = 0.3,
+                  chunk_size: int = SEED_CHUNK_SIZE, seed: int = 42) -> Dict[str, Any]:
+    """Create the schema if needed and add the generated rows, then rebuild
+    the rollups. Returns the number of rows written per table and the time
+    taken. Not safe to run while the API is issuing invoice numbers."""
+    from ..auth import get_password_hash
+    from ..database import SessionLocal, engine, init_db
+    from ..utils import rollups, versions
+    from .. import models
+
+    rng = np.random.default_rng(seed)
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db()
+
+    written = {"users": users, "products": products, "customers": customers, "sales": 0,
+               "sale_items": 0, "invoices": 0, "invoice_items": 0}
+    with engine.begin() as connection:
+        existing_users = connection.scalar(select(func.count()).select_from(models.User))
+        # One hash is enough: every cashier gets the same password
+        hashed = get_password_hash(SEED_PASSWORD)
+        bulk_insert(connection, "users", ["username", "email", "hashed_password", "is_active", "is_admin"], [
+            (f"cashier{existing_users + i}", f"cashier{existing_users + i}@example.com", hashed, True, False)
+            for i in range(users)
+        ])
+        offset = connection.scalar(select(func.count()).select_from(models.Product))
+        for start in range(0, products, chunk_size):
+            bulk_insert(connection, "products", ["name", "description", "price", "stock"],
+                        product_rows(rng, min(chunk_size, products - start), offset + start))
+        offset = connection.scalar(select(func.count()).select_from(models.Customer))
+        for start in range(0, customers, chunk_size):
+            bulk_insert(connection, "customers", ["name", "email", "phone"],
+                        customer_rows(rng, min(chunk_size, customers - start), offset + start))
+
+    with engine.connect() as connection:
+        product_ids, prices = (np.array(column) for column in zip(
+            *connection.execute(select(models.Product.id, models.Product.price).order_by(models.Product.id))
+        ))
+        customer_ids = np.array(connection.scalars(select(models.Customer.id).order_by(models.Customer.id)).all(),
+                                dtype=np.int64)
+        user_ids = np.array(connection.scalars(select(models.User.id).order_by(models.User.id)).all())
+        next_sale = (connection.scalar(select(func.max(models.Sale.id))) or 0) + 1
+        next_invoice = (connection.scalar(select(func.max(models.Invoice.id))) or 0) + 1
+        counters = dict(connection.execute(select(models.InvoiceCounter.day, models.InvoiceCounter.last_value)).all())
+
+    # Popularity ranks are shuffled so the best sellers are not the oldest products
+    product_order = rng.permutation(len(product_ids))
+    product_p = zipf_probabilities(len(product_ids), zipf_exponent)
+    customer_order = rng.permutation(len(customer_ids))
+    customer_p = zipf_probabilities(len(customer_ids), 0.8)
+    timestamps = sale_timestamps(rng, sales, datetime.utcnow(), days)
+
+    for start in range(0, sales, chunk_size):
+        count = min(chunk_size, sales - start)
+        sale_ids = np.arange(next_sale, next_sale + count)
+        created = timestamps[start:start + count]
+        created_text = sql_timestamps(created)
+
+        sizes = np.minimum(rng.geometric(1 / mean_basket, count), max_basket)
+        item_sales = np.repeat(np.arange(count), sizes)
+        item_products = product_order[rng.choice(len(product_ids), size=len(item_sales), p=product_p)]
+        quantities = 1 + rng.poisson(0.3, len(item_sales))
+        item_prices = prices[item_products]
+        totals = np.round(np.add.reduceat(item_prices * quantities, np.cumsum(sizes) - sizes), 2)
+
+        customer_column: List[Any] = [None] * count
+        if len(customer_ids):
+            regulars = customer_ids[customer_order[rng.choice(len(customer_ids), size=count, p=customer_p)]]
+            has_customer = rng.random(count) < customer_share
+            customer_column = [c if has else None for c, has in zip(regulars.tolist(), has_customer.tolist())]
+        cashiers = user_ids[rng.integers(0, len(user_ids), count)]
+        statuses = SALE_STATUSES[rng.choice(len(SALE_STATUSES), size=count, p=SALE_STATUS_SHARES)]
+
+        invoiced = np.flatnonzero((rng.random(count) < invoice_share) & (statuses != "cancelled"))
+        invoice_created = created[invoiced] + rng.integers(0, 600, len(invoiced)).astype("timedelta64[s]")
+        invoice_numbers = _number_invoices(invoice_created.astype("datetime64[D]"), counters)
+        invoice_ids = np.arange(next_invoice, next_invoice + len(invoiced))
+        taxes = np.round(totals[invoiced] * TAX_RATE, 2)
+        invoice_statuses = INVOICE_STATUSES[
+            rng.choice(len(INVOICE_STATUSES), size=len(invoiced), p=INVOICE_STATUS_SHARES)
+        ]
+        payments = PAYMENT_METHODS[rng.integers(0, len(PAYMENT_METHODS), len(invoiced))]
+
+        with engine.begin() as connection:
+            bulk_insert(connection, "sales", ["id", "customer_id", "user_id", "total_amount", "status", "created_at"],
+                        list(zip(sale_ids.tolist(), customer_column, cashiers.tolist(), totals.tolist(),
+                                 statuses.tolist(), created_text)))
+            bulk_insert(connection, "sale_items", ["sale_id", "product_id", "quantity", "price", "created_at"],
+                        list(zip(sale_ids[item_sales].tolist(), product_ids[item_products].tolist(),
+                                 quantities.tolist(), item_prices.tolist(),
+                                 [created_text[i] for i in item_sales.tolist()])))
+            bulk_insert(connection, "invoices", [
+                "id", "invoice_number", "sale_id", "customer_id", "user_id", "total_amount",
+                "tax_amount", "discount_amount", "status", "payment_method", "created_at"
+            ], list(zip(invoice_ids.tolist(), invoice_numbers, sale_ids[invoiced].tolist(),
+                        [customer_column[i] for i in invoiced.tolist()], cashiers[invoiced].tolist(),
+                        (totals[invoiced] + taxes).tolist(), taxes.tolist(), [0.0] * len(invoiced),
+                        invoice_statuses.tolist(), payments.tolist(), sql_timestamps(invoice_created))))
+            if len(invoiced):
+                result = connection.execute(
+                    insert(models.InvoiceItem.__table__).from_select(
+                        ["invoice_id", "product_id", "quantity", "unit_price", "discount", "created_at"],
+                        select(
+                            models.Invoice.id,
+                            models.SaleItem.product_id,
+                            models.SaleItem.quantity,
+                            models.SaleItem.price,
+                            literal(0.0),
+                            models.Invoice.created_at
+                        )
+                        .join(models.Invoice, models.Invoice.sale_id == models.SaleItem.sale_id)
+                        .where(models.Invoice.id.between(int(invoice_ids[0]), int(invoice_ids[-1])))
+                    )
+                )
+                written["invoice_items"] += result.rowcount
+
+        next_sale += count
+        next_invoice += len(invoiced)
+        written["sales"] += count
+        written["sale_items"] += len(item_sales)
+        written["invoices"] += len(invoiced)
+        print(f"{written['sales']}/{sales} sales", file=sys.stderr)
+
+    with engine.begin() as connection:
+        counter = models.InvoiceCounter.__table__
+        if counters:
+            connection.execute(counter.delete().where(counter.c.day.in_(list(counters))))
+            connection.execute(insert(counter), [{"day": day, "last_value": value} for day, value in counters.items()])
+        if connection.dialect.name == "postgresql":
+            # Ids were given explicitly, so move the sequences past them
+            for table in ("sales", "invoices"):
+                connection.execute(text(
+                    f"SELECT setval(pg_get_serial_sequence('{table}', 'id'), (SELECT max(id) FROM {table}))"
+                ))
+
+    db = SessionLocal()
+    try:
+        rollups.rebuild_rollups(db)
+        # Running API processes drop their cached catalog and customer index
+        versions.record_change(db, versions.CATALOG)
+        versions.record_change(db, versions.STOCK)
+        versions.record_change(db, versions.CUSTOMERS)
+        db.commit()
+    finally:
+        db.close()
+    with engine.begin() as connection:
+        # Fresh statistics, so the planner knows how large the tables now are
+        connection.execute(text("ANALYZE"))
+
+    written["seconds"] = time.perf_counter() - started
+    return written
+
+def main():
+    parser = argparse.ArgumentParser(description="Seed the configured database with synthetic data")
+    parser.add_argument("--products", type=int, default=10_000)
+    parser.add_argument("--customers", type=int, default=20_000)
+    parser.add_argument("--sales", type=int, default=100_000)
+    parser.add_argument("--users", type=int, default=10, help="cashier accounts to create")
+    parser.add_argument("--days", type=int, default=90, help="spread the sales over this many days")
+    parser.add_argument("--mean-basket", type=float, default=3.5, help="mean number of lines per sale")
+    parser.add_argument("--max-basket", type=int, default=30)
+    parser.add_argument("--zipf", type=float, default=1.1, help="exponent of the product popularity law")
+    parser.add_argument("--customer-share", type=float, default=0.6, help="share of sales with a customer")
+    parser.add_argument("--invoice-share", type=float, default=0.3, help="share of sales that are invoiced")
+    parser.add_argument("--chunk-size", type=int, default=SEED_CHUNK_SIZE, help="sales per transaction")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    result = seed_database(
+        args.products, args.customers, args.sales, args.users, args.days, args.mean_basket, args.max_basket,
+        args.zipf, args.customer_share, args.invoice_share, args.chunk_size, args.seed
+    )
+    rows = sum(value for key, value in result.items() if key != "seconds")
+    print(f"Wrote {rows} rows in {result['seconds']:.1f}s ({rows / result['seconds']:.0f} rows/s): "
+          + ", ".join(f"{value} {key}" for key, value in result.items() if key != "seconds"))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""Checkout throughput on one hot product with and without stock stripes.
+
+Threads check out one unit of the same product as fast as they can, first
+with its stock in products.stock, then spread over each --stripes count,
+and the checkouts per second are reported as JSON. --latency-ms adds a
+sleep before every statement and commit to stand in for the network round
+trips between an application server and its database, during which a
+checkout holds the row lock it took. Needs a database with concurrent
+writers; run from the repository root against a scratch PostgreSQL one:
+
+    python -m backend.benchmarks.stripes_benchmark --database-url postgresql://pos@localhost/pos_bench \\
+        --latency-ms 5 --threads 32
+"""
+import argparse
+import contextlib
+import os
+import sys
+import threading
+import time
+from typing import Any, Dict, List
+
+from .common import write_result
+
+def run(args) -> Dict[str, Any]:
+    from sqlalchemy import event
+    from ..database import SessionLocal, engine, init_db
+    from .. import models, schemas
+    from ..utils import checkout, stock_stripes
+
+    with contextlib.redirect_stdout(sys.stderr):
+        init_db()
+    latency = args.latency_ms / 1000
+
+    def round_trip(*_):
+        time.sleep(latency)
+
+    if latency:
+        event.listen(engine, "before_cursor_execute", round_trip)
+        event.listen(engine, "commit", round_trip)
+
+    db = SessionLocal()
+    try:
+        user_id = db.query(models.User.id).filter(models.User.username == "admin").scalar()
+        result: Dict[str, Any] = {
+            "benchmark": "stripes",
+            "config": {"latency_ms": args.latency_ms, "threads": args.threads, "seconds": args.seconds},
+            "stripes": {},
+        }
+        for stripes in args.stripes:
+            product = models.Product(name=f"Hot product ({stripes} stripes)", price=1.0, stock=10 ** 9)
+            db.add(product)
+            db.commit()
+            stock_stripes.set_stripes(db, product, stripes)
+            db.commit()
+            sale = schemas.SaleCreate(items=[{"product_id": product.id, "quantity": 1}])
+            done: List[int] = [0] * args.threads
+            errors: List[int] = [0] * args.threads
+            stop = time.perf_counter() + args.seconds
+
+            def work(index: int):
+                while time.perf_counter() < stop:
+                    session = SessionLocal()
+                    try:
+                        checkout.create_sale(session, sale, user_id)
+                        session.commit()
+                        done[index] += 1
+                    except Exception:
+                        session.rollback()
+                        errors[index] += 1
+                    finally:
+                        session.close()
+
+            threads = [threading.Thread(target=work, args=(index,)) for index in range(args.threads)]
+            started = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - started
+            result["stripes"][str(stripes)] = {
+                "checkouts": sum(done),
+                "errors": sum(errors),
+                "checkouts_per_second": sum(done) / elapsed,
+            }
+    finally:
+        db.close()
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Checkout throughput on one hot product by stripe count")
+    parser.add_argument("--database-url", required=True,
+                        help="database to run against, e.g. a scratch PostgreSQL one; the benchmark adds products")
+    parser.add_argument("--stripes", type=lambda text: [int(part) for part in text.split(",")],
+                        default=[0, 1, 4, 8], help="comma separated stripe counts (default 0,1,4,8)")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--latency-ms", type=float, default=0, help="simulated round trip per statement")
+    parser.add_argument("--output", help="write the JSON result to this file instead of stdout")
+    args = parser.parse_args()
+
+    os.environ["DATABASE_URL"] = args.database_url
+    os.environ["QUERY_BUDGET_MODE"] = "off"
+    # A connection per thread, so threads wait on row locks and not on the pool
+    os.environ.setdefault("DB_POOL_SIZE", str(args.threads))
+    write_result(run(args), args.output)
+
+if __name__ == "__main__":
+    main()
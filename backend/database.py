@@ -1,7 +1,10 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
-from typing import Generator
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from typing import Any, AsyncGenerator, Dict
 import os
 from dotenv import load_dotenv
 from sqlalchemy import inspect
@@ -10,19 +13,109 @@ load_dotenv()
 
 SQLALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./pos_system.db")
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
-)
+# Async drivers used by the API for each backend; ASYNC_DATABASE_URL overrides the choice
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+def to_async_url(url: str) -> str:
+    parsed = make_url(url)
+    driver = ASYNC_DRIVERS.get(parsed.get_backend_name())
+    if driver is None:
+        return url
+    return parsed.set(drivername=driver).render_as_string(hide_password=False)
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or to_async_url(SQLALCHEMY_DATABASE_URL)
+
+# SQLite: WAL lets readers run alongside the writer, and synchronous=NORMAL only
+# fsyncs at checkpoints, which WAL keeps safe against corruption
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    # Negative sizes are in KiB
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+}
+
+# Server databases: a fixed pool sized for the workers, with stale connections
+# detected before use and recycled before the server or a proxy drops them
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "1800"))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "true").lower() in ("1", "true", "yes")
+
+def is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+def engine_options(url: str) -> Dict[str, Any]:
+    if is_sqlite(url):
+        parsed = make_url(url)
+        if parsed.get_driver_name() == "pysqlite":
+            # Sessions are handed between threads by FastAPI and the report refresher
+            return {"connect_args": {"check_same_thread": False}}
+        if parsed.database and parsed.database != ":memory:":
+            # aiosqlite defaults to opening a connection (and running the pragmas) per checkout
+            return {"poolclass": AsyncAdaptedQueuePool}
+        return {}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": DB_POOL_PRE_PING,
+    }
+
+def _set_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+def configure_engine(engine: Engine) -> Engine:
+    if engine.dialect.name == "sqlite":
+        event.listen(engine, "connect", _set_sqlite_pragmas)
+    return engine
+
+# The synchronous engine serves startup, command line tools and background threads
+engine = configure_engine(create_engine(SQLALCHEMY_DATABASE_URL, **engine_options(SQLALCHEMY_DATABASE_URL)))
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Request handlers use the async engine, so waiting on the database does not hold a worker thread.
+# There is deliberately no setting to go back to sync sessions in the handlers: every route and
+# the helpers they await are written against AsyncSession, and a switch would mean keeping a
+# second copy of each. The sync engine below is what the threadpool and the tools use.
+async_engine = create_async_engine(ASYNC_DATABASE_URL, **engine_options(ASYNC_DATABASE_URL))
+configure_engine(async_engine.sync_engine)
+# Objects stay loaded after commit: lazy loads cannot run once a handler has returned
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
-def get_db() -> Generator:
-    db = SessionLocal()
-    try:
+async def get_db() -> AsyncGenerator[AsyncSession, None]:
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def _pool_stats(engine: Engine) -> Dict[str, Any]:
+    pool = engine.pool
+    stats = {"pool": type(pool).__name__}
+    # Only queue pools keep counters; SQLite memory databases use a static pool
+    for name in ("size", "checkedin", "checkedout", "overflow"):
+        counter = getattr(pool, name, None)
+        if callable(counter):
+            stats[name] = counter()
+    return stats
+
+def pool_status() -> Dict[str, Any]:
+    return {
+        "backend": engine.dialect.name,
+        "sync": _pool_stats(engine),
+        "async": _pool_stats(async_engine.sync_engine),
+    }
 
 def create_tables():
     Base.metadata.create_all(bind=engine)
@@ -48,14 +141,31 @@ def create_initial_user():
         db.close()
 
 def init_db():
+    # Register every table on Base.metadata even when no router imported them yet
+    from . import models  # noqa: F401
     db = SessionLocal()
     try:
         # Check if tables exist by trying to reflect one
         inspector = inspect(engine)
+        backfill_rollups = inspector.has_table("sales") and not inspector.has_table("daily_sales_rollups")
         if not inspector.has_table("users"):
             print("Creating database tables...")
             Base.metadata.create_all(bind=engine)
             print("Tables created.")
+        else:
+            # Older databases may be missing tables added since they were created
+            Base.metadata.create_all(bind=engine)
+
+        from .utils.product_search import install_search_index
+        with engine.begin() as connection:
+            install_search_index(connection)
+
+        if backfill_rollups:
+            print("Backfilling sales rollups...")
+            from .utils.rollups import rebuild_rollups
+            rebuild_rollups(db)
+            db.commit()
+            print("Sales rollups backfilled.")
 
         # Create admin user if it doesn't exist
         from .models import User
@@ -1,12 +1,15 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, FileResponse
+from fastapi.responses import JSONResponse, FileResponse, PlainTextResponse
 from typing import Dict
 from fastapi.exceptions import RequestValidationError
 from starlette.exceptions import HTTPException
-from database import init_db
+from database import async_engine, engine, init_db, pool_status
 from routers import auth, products, customers, sales, invoices, reports
+from utils import analytics_pool, inventory, metrics, query_budget, rollups, sales_cube, scheduler, versions
 from fastapi.staticfiles import StaticFiles
+from fastapi.concurrency import run_in_threadpool
+import asyncio
 import os
 
 app = FastAPI(
@@ -22,8 +25,17 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Link"],
 )
 
+# Per-route latency, status and SQL statement metrics, served at /metrics,
+# and the per-route query budgets declared in the routers
+for bind in (engine, async_engine.sync_engine):
+    metrics.instrument_engine(bind)
+    query_budget.instrument_engine(bind)
+app.add_middleware(metrics.MetricsMiddleware)
+app.add_middleware(query_budget.QueryBudgetMiddleware)
+
 # Error handling middleware
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request: Request, exc: HTTPException):
@@ -56,16 +68,13 @@ app.mount(
     name="static"
 )
 
-@app.get("/{full_path:path}")
-async def serve_react_app(full_path: str):
-    index_path = os.path.join(STATIC_FILES_DIR, "index.html")
-    if os.path.exists(index_path):
-        return FileResponse(index_path)
-    return {"message": "Frontend not built. Run `npm run build` in the frontend directory."}
-
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy"}
+    return {"status": "healthy", "database": pool_status()}
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics_endpoint():
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
 
 @app.get("/")
 async def root():
@@ -75,10 +84,35 @@ async def root():
         "redoc_url": "/redoc"
     }
 
+# Registered last so it does not shadow the API routes above
+@app.get("/{full_path:path}")
+async def serve_react_app(full_path: str):
+    index_path = os.path.join(STATIC_FILES_DIR, "index.html")
+    if os.path.exists(index_path):
+        return FileResponse(index_path)
+    return {"message": "Frontend not built. Run `npm run build` in the frontend directory."}
+
 # Initialize database on startup
 @app.on_event("startup")
 async def startup_event():
     init_db()
+    await run_in_threadpool(inventory.compact_on_startup)
+    if inventory.ledger_enabled():
+        asyncio.create_task(inventory.compact_periodically())
+    await run_in_threadpool(rollups.run_fold)
+    asyncio.create_task(rollups.fold_periodically())
+    asyncio.create_task(versions.fold_periodically())
+    # Reports are precomputed off the request path from here on
+    await run_in_threadpool(analytics_pool.start)
+    scheduler.start()
+    if sales_cube.SALES_CUBE_PRELOAD:
+        # Load the cube in the background; /reports/query waits for it if it comes first
+        asyncio.create_task(run_in_threadpool(sales_cube.load))
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    await scheduler.stop()
+    analytics_pool.shutdown()
 
 if __name__ == "__main__":
     import uvicorn
@@ -0,0 +1,57 @@
+"""Indexes for the sales and invoice hot paths
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+# Databases created by init_db after this revision already have these
+# indexes (they are declared on the models), so each one is only created
+# where it is missing
+INDEXES = [
+    ("ix_sales_created_at_id", "sales", ["created_at", "id"]),
+    ("ix_sales_customer_id_id", "sales", ["customer_id", "id"]),
+    ("ix_sales_user_id", "sales", ["user_id"]),
+    ("ix_sale_items_sale_id", "sale_items", ["sale_id"]),
+    ("ix_sale_items_product_id_sale_id", "sale_items", ["product_id", "sale_id"]),
+    ("ix_invoices_created_at_id", "invoices", ["created_at", "id"]),
+    ("ix_invoices_status", "invoices", ["status"]),
+    ("ix_invoices_sale_id", "invoices", ["sale_id"]),
+    ("ix_invoice_items_invoice_id", "invoice_items", ["invoice_id"]),
+]
+
+def _existing_indexes():
+    inspector = sa.inspect(op.get_bind())
+    tables = set(inspector.get_table_names())
+    existing = set()
+    for table in tables:
+        existing.update((table, index["name"]) for index in inspector.get_indexes(table))
+    return tables, existing
+
+def upgrade():
+    tables, existing = _existing_indexes()
+    missing = [
+        (name, table, columns) for name, table, columns in INDEXES
+        if table in tables and (table, name) not in existing
+    ]
+    if op.get_bind().dialect.name == "postgresql":
+        # Build without blocking writes to tables that are in use
+        with op.get_context().autocommit_block():
+            for name, table, columns in missing:
+                op.create_index(name, table, columns, postgresql_concurrently=True)
+    else:
+        for name, table, columns in missing:
+            op.create_index(name, table, columns)
+
+def downgrade():
+    tables, existing = _existing_indexes()
+    for name, table, columns in reversed(INDEXES):
+        if (table, name) in existing:
+            op.drop_index(name, table_name=table)
@@ -0,0 +1,25 @@
+"""Counter table for block-allocated invoice numbers
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # init_db creates missing tables on startup, so it may already be there
+    if not sa.inspect(op.get_bind()).has_table("invoice_counters"):
+        op.create_table(
+            "invoice_counters",
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("last_value", sa.Integer(), nullable=False),
+        )
+
+def downgrade():
+    op.drop_table("invoice_counters")
@@ -0,0 +1,41 @@
+"""Append-only stock ledger and per-product stock snapshots
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # init_db creates missing tables on startup, so they may already be there
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("stock_movements"):
+        op.create_table(
+            "stock_movements",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), nullable=False),
+            sa.Column("quantity", sa.Integer(), nullable=False),
+            sa.Column("kind", sa.String(), nullable=False),
+            sa.Column("sale_id", sa.Integer()),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+        )
+        op.create_index("ix_stock_movements_id", "stock_movements", ["id"])
+        op.create_index("ix_stock_movements_product_id_id", "stock_movements", ["product_id", "id"])
+    if not inspector.has_table("stock_snapshots"):
+        op.create_table(
+            "stock_snapshots",
+            sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+            sa.Column("quantity", sa.Integer(), nullable=False),
+            sa.Column("last_movement_id", sa.Integer(), nullable=False),
+            sa.Column("taken_at", sa.DateTime(), nullable=False),
+        )
+
+def downgrade():
+    op.drop_table("stock_snapshots")
+    op.drop_table("stock_movements")
@@ -0,0 +1,40 @@
+"""Striped stock for hot products
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # init_db creates missing tables on startup, but not missing columns
+    inspector = sa.inspect(op.get_bind())
+    if "stock_stripes" not in {column["name"] for column in inspector.get_columns("products")}:
+        op.add_column(
+            "products",
+            sa.Column("stock_stripes", sa.Integer(), nullable=False, server_default="0")
+        )
+    if not inspector.has_table("product_stock_stripes"):
+        op.create_table(
+            "product_stock_stripes",
+            sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+            sa.Column("stripe", sa.Integer(), primary_key=True),
+            sa.Column("stock", sa.Integer(), nullable=False),
+        )
+
+def downgrade():
+    # Gather striped stock back into products.stock before the stripes go
+    op.execute(
+        "UPDATE products SET stock = COALESCE(stock, 0) + COALESCE(("
+        "SELECT SUM(stock) FROM product_stock_stripes WHERE product_stock_stripes.product_id = products.id"
+        "), 0)"
+    )
+    op.drop_table("product_stock_stripes")
+    with op.batch_alter_table("products") as batch_op:
+        batch_op.drop_column("stock_stripes")
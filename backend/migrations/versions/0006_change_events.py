@@ -0,0 +1,34 @@
+"""Change events behind the shared cache versions
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # init_db creates missing tables on startup, so they may already be there
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("change_events"):
+        op.create_table(
+            "change_events",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("topic", sa.String(), nullable=False),
+        )
+        op.create_index("ix_change_events_topic", "change_events", ["topic"])
+    if not inspector.has_table("change_counters"):
+        op.create_table(
+            "change_counters",
+            sa.Column("topic", sa.String(), primary_key=True),
+            sa.Column("folded", sa.Integer(), nullable=False),
+        )
+
+def downgrade():
+    op.drop_table("change_counters")
+    op.drop_table("change_events")
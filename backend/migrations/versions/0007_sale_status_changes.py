@@ -0,0 +1,28 @@
+"""Sale status change log read by the sales cube
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # init_db creates missing tables on startup, so it may already be there
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("sale_status_changes"):
+        op.create_table(
+            "sale_status_changes",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("sale_id", sa.Integer(), nullable=False),
+            sa.Column("status", sa.String()),
+            sa.Column("created_at", sa.DateTime(), nullable=False),
+        )
+
+def downgrade():
+    op.drop_table("sale_status_changes")
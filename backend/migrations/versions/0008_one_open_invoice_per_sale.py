@@ -0,0 +1,25 @@
+"""One open invoice per sale
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0008"
+down_revision = "0007"
+branch_labels = None
+depends_on = None
+
+OPEN = sa.text("status != 'cancelled'")
+
+def upgrade():
+    # Fails if a sale already has two open invoices; cancel the extra ones first
+    op.create_index(
+        "ux_invoices_open_sale_id", "invoices", ["sale_id"], unique=True,
+        sqlite_where=OPEN, postgresql_where=OPEN
+    )
+
+def downgrade():
+    op.drop_index("ux_invoices_open_sale_id", table_name="invoices")
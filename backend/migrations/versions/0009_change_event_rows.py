@@ -0,0 +1,31 @@
+"""Row ids on change events
+
+Revision ID: 0009
+Revises: 0008
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0009"
+down_revision = "0008"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    bind = op.get_bind()
+    # init_db creates missing tables on startup, so it may already have the column
+    if "row_id" in {column["name"] for column in sa.inspect(bind).get_columns("change_events")}:
+        return
+    if bind.dialect.name == "sqlite":
+        # Copied into a table with AUTOINCREMENT, so the ids of events folded
+        # away are not handed out again
+        with op.batch_alter_table("change_events", recreate="always",
+                                  table_kwargs={"sqlite_autoincrement": True}) as batch:
+            batch.add_column(sa.Column("row_id", sa.Integer()))
+    else:
+        op.add_column("change_events", sa.Column("row_id", sa.Integer()))
+
+def downgrade():
+    with op.batch_alter_table("change_events") as batch:
+        batch.drop_column("row_id")
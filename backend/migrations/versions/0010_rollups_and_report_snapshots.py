@@ -0,0 +1,50 @@
+"""Daily sales rollups and report snapshots
+
+Revision ID: 0010
+Revises: 0009
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0010"
+down_revision = "0009"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    # init_db creates missing tables on startup, so they may already be there.
+    # Rollups created here start empty: rebuild them from the sales tables
+    # afterwards (python -m backend.utils.rollups)
+    inspector = sa.inspect(op.get_bind())
+    if not inspector.has_table("daily_sales_rollups"):
+        op.create_table(
+            "daily_sales_rollups",
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("total_amount", sa.Float(), nullable=False),
+            sa.Column("num_transactions", sa.Integer(), nullable=False),
+        )
+    if not inspector.has_table("daily_product_sales_rollups"):
+        op.create_table(
+            "daily_product_sales_rollups",
+            sa.Column("day", sa.Date(), primary_key=True),
+            sa.Column("product_id", sa.Integer(), sa.ForeignKey("products.id"), primary_key=True),
+            sa.Column("quantity", sa.Integer(), nullable=False),
+            sa.Column("revenue", sa.Float(), nullable=False),
+        )
+    if not inspector.has_table("report_snapshots"):
+        op.create_table(
+            "report_snapshots",
+            sa.Column("id", sa.Integer(), primary_key=True),
+            sa.Column("report_type", sa.String(), nullable=False),
+            sa.Column("period", sa.String(), nullable=False),
+            sa.Column("generated_at", sa.DateTime(), nullable=False),
+            sa.Column("data", sa.Text(), nullable=False),
+        )
+        op.create_index("ix_report_snapshots_id", "report_snapshots", ["id"])
+        op.create_index("ix_report_snapshots_lookup", "report_snapshots", ["report_type", "period", "generated_at"])
+
+def downgrade():
+    op.drop_table("report_snapshots")
+    op.drop_table("daily_product_sales_rollups")
+    op.drop_table("daily_sales_rollups")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, ForeignKey, DateTime, Boolean, Table
+from sqlalchemy import Column, Integer, String, Float, ForeignKey, Date, DateTime, Boolean, Table, Text, Index, text
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from .database import Base
@@ -26,6 +26,8 @@ class Product(Base):
     description = Column(String)
     price = Column(Float, nullable=False)
     stock = Column(Integer, default=0)
+    # When above zero, most of the stock is spread over this many ProductStockStripe rows
+    stock_stripes = Column(Integer, nullable=False, default=0, server_default="0")
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(DateTime(timezone=True), onupdate=func.now())
 
@@ -65,6 +67,14 @@ class Sale(Base):
     items = relationship("SaleItem", back_populates="sale", cascade="all, delete-orphan")
     invoices = relationship("Invoice", back_populates="sale")
 
+    __table_args__ = (
+        # Date range filters and report scans, with id for keyset paging
+        Index("ix_sales_created_at_id", "created_at", "id"),
+        # Customer filter paging and the "has sales" probe
+        Index("ix_sales_customer_id_id", "customer_id", "id"),
+        Index("ix_sales_user_id", "user_id"),
+    )
+
 class SaleItem(Base):
     __tablename__ = "sale_items"
 
@@ -79,6 +89,12 @@ class SaleItem(Base):
     sale = relationship("Sale", back_populates="items")
     product = relationship("Product", back_populates="sale_items")
 
+    __table_args__ = (
+        Index("ix_sale_items_sale_id", "sale_id"),
+        # Covers the product filter on sales and the "has been sold" probe
+        Index("ix_sale_items_product_id_sale_id", "product_id", "sale_id"),
+    )
+
 class Invoice(Base):
     __tablename__ = "invoices"
 
@@ -102,6 +118,15 @@ class Invoice(Base):
     user = relationship("User", back_populates="invoices")
     items = relationship("InvoiceItem", back_populates="invoice", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_invoices_created_at_id", "created_at", "id"),
+        Index("ix_invoices_status", "status"),
+        Index("ix_invoices_sale_id", "sale_id"),
+        # One open invoice per sale; a cancelled one can be issued again
+        Index("ux_invoices_open_sale_id", "sale_id", unique=True,
+              sqlite_where=text("status != 'cancelled'"), postgresql_where=text("status != 'cancelled'")),
+    )
+
 class InvoiceItem(Base):
     __tablename__ = "invoice_items"
 
@@ -115,4 +140,132 @@ class InvoiceItem(Base):
 
     # Relationships
     invoice = relationship("Invoice", back_populates="items")
-    product = relationship("Product", back_populates="invoice_items") 
\ No newline at end of file
+    product = relationship("Product", back_populates="invoice_items")
+
+    __table_args__ = (
+        Index("ix_invoice_items_invoice_id", "invoice_id"),
+    )
+
+class InvoiceCounter(Base):
+    __tablename__ = "invoice_counters"
+
+    # Last invoice number handed out for the day; workers reserve blocks from it
+    day = Column(Date, primary_key=True)
+    last_value = Column(Integer, nullable=False, default=0)
+
+class StockMovement(Base):
+    __tablename__ = "stock_movements"
+
+    # Append-only; written instead of updating products.stock when INVENTORY_MODE=ledger
+    id = Column(Integer, primary_key=True, index=True)
+    product_id = Column(Integer, ForeignKey("products.id"), nullable=False)
+    quantity = Column(Integer, nullable=False)  # signed: negative takes stock out
+    kind = Column(String, nullable=False)  # sale, void, receipt, adjustment
+    # Not a foreign key, so the movements of a deleted sale stay on record
+    sale_id = Column(Integer)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Summing the tail of a product after its snapshot
+        Index("ix_stock_movements_product_id_id", "product_id", "id"),
+    )
+
+class StockSnapshot(Base):
+    __tablename__ = "stock_snapshots"
+
+    # products.stock as of last_movement_id, written by utils.inventory.compact_ledger
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Integer, nullable=False)
+    last_movement_id = Column(Integer, nullable=False)
+    taken_at = Column(DateTime, nullable=False)
+
+class ProductStockStripe(Base):
+    __tablename__ = "product_stock_stripes"
+
+    # A slice of a striped product's stock; checkouts decrement a random one
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    stripe = Column(Integer, primary_key=True)
+    stock = Column(Integer, nullable=False, default=0)
+
+class DailySalesRollup(Base):
+    __tablename__ = "daily_sales_rollups"
+
+    # Folded in from SalesRollupDelta by utils.rollups; reads add the deltas not folded yet
+    day = Column(Date, primary_key=True)
+    total_amount = Column(Float, nullable=False, default=0)
+    num_transactions = Column(Integer, nullable=False, default=0)
+
+class DailyProductSalesRollup(Base):
+    __tablename__ = "daily_product_sales_rollups"
+
+    day = Column(Date, primary_key=True)
+    product_id = Column(Integer, ForeignKey("products.id"), primary_key=True)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+    product = relationship("Product")
+
+class SalesRollupDelta(Base):
+    __tablename__ = "sales_rollup_deltas"
+
+    # Rollup changes appended in the same transaction as the sales they
+    # summarise, so checkouts never wait on a shared rollup row
+    id = Column(Integer, primary_key=True)
+    day = Column(Date, nullable=False)
+    # None on the day's totals, else the product of a per-product line
+    product_id = Column(Integer)
+    total_amount = Column(Float, nullable=False, default=0)
+    num_transactions = Column(Integer, nullable=False, default=0)
+    quantity = Column(Integer, nullable=False, default=0)
+    revenue = Column(Float, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_sales_rollup_deltas_day", "day"),
+    )
+
+class SaleStatusChange(Base):
+    __tablename__ = "sale_status_changes"
+
+    # Append-only; read by every process's sales cube (utils.sales_cube) to
+    # pick up cancellations and deletions made through the other processes
+    id = Column(Integer, primary_key=True)
+    # Not a foreign key, so the deletion of a sale can be recorded
+    sale_id = Column(Integer, nullable=False)
+    status = Column(String)  # None when the sale was deleted
+    created_at = Column(DateTime, nullable=False)
+
+class ChangeEvent(Base):
+    __tablename__ = "change_events"
+
+    # One row per committed change to a cached topic, appended in the
+    # writer's transaction; see utils.versions
+    id = Column(Integer, primary_key=True)
+    topic = Column(String, nullable=False)
+    # The row changed, for readers applying a topic's changes row by row
+    row_id = Column(Integer)
+
+    __table_args__ = (
+        Index("ix_change_events_topic", "topic"),
+        # Ids are never reused, even once the fold has emptied the table
+        {"sqlite_autoincrement": True},
+    )
+
+class ChangeCounter(Base):
+    __tablename__ = "change_counters"
+
+    topic = Column(String, primary_key=True)
+    # Change events folded in so far
+    folded = Column(Integer, nullable=False, default=0)
+
+class ReportSnapshot(Base):
+    __tablename__ = "report_snapshots"
+
+    id = Column(Integer, primary_key=True, index=True)
+    report_type = Column(String, nullable=False)
+    period = Column(String, nullable=False)
+    generated_at = Column(DateTime, nullable=False)
+    data = Column(Text, nullable=False)
+
+    __table_args__ = (
+        Index("ix_report_snapshots_lookup", "report_type", "period", "generated_at"),
+    )
@@ -1,6 +1,7 @@
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from datetime import timedelta
 from typing import Any
 from pydantic import BaseModel
@@ -8,13 +9,19 @@ from pydantic import BaseModel
 from ..database import get_db
 from .. import models
 from .. import schemas
+from ..utils import versions
 from ..auth import (
-    verify_password,
-    get_password_hash,
+    verify_password_async,
+    get_password_hash_async,
+    password_needs_rehash,
     create_tokens,
     ACCESS_TOKEN_EXPIRE_MINUTES,
     get_current_active_user,
-    verify_refresh_token
+    get_current_admin_user,
+    invalidate_user,
+    principal_cache,
+    verify_refresh_token,
+    Principal
 )
 
 router = APIRouter()
@@ -22,46 +29,57 @@ router = APIRouter()
 class TokenRefresh(BaseModel):
     refresh_token: str
 
+async def _find_user(db: AsyncSession, *criteria) -> Any:
+    result = await db.execute(select(models.User).where(*criteria))
+    return result.scalars().first()
+
+# bcrypt runs on its own executor (see auth.py), so awaiting it here does
+# not hold a worker thread that other requests need.
 @router.post("/register", response_model=schemas.User)
-def register_user(user: schemas.UserCreate, db: Session = Depends(get_db)) -> Any:
-    db_user = db.query(models.User).filter(models.User.email == user.email).first()
+async def register_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)) -> Any:
+    db_user = await _find_user(db, models.User.email == user.email)
     if db_user:
         raise HTTPException(
             status_code=400,
             detail="Email already registered"
         )
-    
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+
+    db_user = await _find_user(db, models.User.username == user.username)
     if db_user:
         raise HTTPException(
             status_code=400,
             detail="Username already taken"
         )
-    
-    hashed_password = get_password_hash(user.password)
+
+    hashed_password = await get_password_hash_async(user.password)
     db_user = models.User(
         email=user.email,
         username=user.username,
         hashed_password=hashed_password
     )
     db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    await db.commit()
+    await db.refresh(db_user)
     return db_user
 
 @router.post("/token", response_model=schemas.Token)
-def login_for_access_token(
+async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> Any:
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not verify_password(form_data.password, user.hashed_password):
+    user = await _find_user(db, models.User.username == form_data.username)
+    if not user or not await verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    
+
+    # Upgrade hashes made with a different cost while we have the plain password
+    if password_needs_rehash(user.hashed_password):
+        user.hashed_password = await get_password_hash_async(form_data.password)
+        await db.commit()
+
     access_token, refresh_token = create_tokens(data={"sub": user.username})
     return {
         "access_token": access_token,
@@ -70,9 +88,9 @@ def login_for_access_token(
     }
 
 @router.post("/refresh", response_model=schemas.Token)
-def refresh_token(
+async def refresh_token(
     token_data: TokenRefresh,
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_db)
 ) -> Any:
     try:
         payload = verify_refresh_token(token_data.refresh_token)
@@ -82,14 +100,14 @@ def refresh_token(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Invalid refresh token"
             )
-        
-        user = db.query(models.User).filter(models.User.username == username).first()
+
+        user = await _find_user(db, models.User.username == username)
         if user is None:
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="User not found"
             )
-        
+
         access_token, refresh_token = create_tokens(data={"sub": user.username})
         return {
             "access_token": access_token,
@@ -103,5 +121,60 @@ def refresh_token(
         )
 
 @router.get("/users/me", response_model=schemas.User)
-def read_users_me(current_user: models.User = Depends(get_current_active_user)) -> Any:
-    return current_user 
\ No newline at end of file
+async def read_users_me(
+    current_user: Principal = Depends(get_current_active_user),
+    db: AsyncSession = Depends(get_db)
+) -> Any:
+    return await db.get(models.User, current_user.id)
+
+@router.put("/users/{user_id}", response_model=schemas.User)
+async def update_user(
+    user_id: int,
+    user: schemas.UserAdminUpdate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_admin_user)
+) -> Any:
+    db_user = await db.get(models.User, user_id)
+    if db_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    for key, value in user.model_dump(exclude_unset=True).items():
+        setattr(db_user, key, value)
+    # Principals cached by every process still carry the old flags
+    await db.run_sync(versions.record_change, versions.USERS)
+    await db.commit()
+    invalidate_user(user_id)
+    await db.refresh(db_user)
+    return db_user
+
+@router.delete("/users/{user_id}", status_code=status.HTTP_204_NO_CONTENT)
+async def delete_user(
+    user_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_admin_user)
+):
+    db_user = await db.get(models.User, user_id)
+    if db_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="User not found"
+        )
+
+    result = await db.execute(select(models.Sale.id).where(models.Sale.user_id == user_id).limit(1))
+    if result.first():
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Cannot delete user with existing sales"
+        )
+
+    await db.delete(db_user)
+    await db.run_sync(versions.record_change, versions.USERS)
+    await db.commit()
+    invalidate_user(user_id)
+
+@router.get("/principal-cache")
+async def read_principal_cache_stats(current_user: Principal = Depends(get_current_admin_user)) -> Any:
+    return principal_cache.stats()
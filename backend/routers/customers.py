@@ -1,14 +1,26 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Any, Optional
 from ..database import get_db
 from .. import models
 from .. import schemas
-from ..auth import get_current_active_user
+from ..auth import get_current_active_user, Principal
+from ..utils import versions
+from ..utils.customer_index import CustomerEntry, LOOKUP_LIMIT_MAX, customer_index
+from ..utils.pagination import paginate, set_link_header
+from ..utils.query_budget import query_budget
+import asyncio
 import re
 
 router = APIRouter()
 
+# One update of the customer index at a time; requests arriving meanwhile wait for it
+_index_lock = asyncio.Lock()
+# More changed customers than this are read with all the others
+INDEX_APPLY_MAX = 1000
+
 def validate_email(email: str) -> bool:
     pattern = r'^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$'
     return bool(re.match(pattern, email))
@@ -17,11 +29,38 @@ def validate_phone(phone: str) -> bool:
     pattern = r'^\+?1?\d{9,15}$'
     return bool(re.match(pattern, phone))
 
-@router.post("/", response_model=schemas.Customer)
-def create_customer(
+_ENTRY_COLUMNS = (models.Customer.id, models.Customer.name, models.Customer.email, models.Customer.phone)
+
+async def _ensure_index_current(db: AsyncSession):
+    # Updated whenever a customer changed, in this worker process or another:
+    # only the customers named by the change events since the index was, or
+    # all of them when those events do not account for every change
+    version = versions.known_version(versions.CUSTOMERS)
+    if version is not None and customer_index.version is not None and customer_index.version >= version:
+        return
+    async with _index_lock:
+        changes = await versions.changes_since(db, versions.CUSTOMERS, customer_index.last_event_id)
+        if customer_index.version is not None and customer_index.version >= changes.version:
+            return
+        changed = set(changes.row_ids)
+        if (customer_index.version is not None
+                and changes.version - customer_index.version == len(changes.row_ids)
+                and None not in changed and len(changed) <= INDEX_APPLY_MAX):
+            rows = (await db.execute(select(*_ENTRY_COLUMNS).where(models.Customer.id.in_(changed)))).all()
+            # Those not found were deleted
+            entries = dict.fromkeys(changed)
+            entries.update((row.id, CustomerEntry(*row)) for row in rows)
+            customer_index.apply(entries, changes.version, changes.last_event_id)
+            return
+        rows = (await db.execute(select(*_ENTRY_COLUMNS))).all()
+        await run_in_threadpool(customer_index.load, [CustomerEntry(*row) for row in rows], changes.version,
+                                changes.last_event_id)
+
+@router.post("/", response_model=schemas.Customer, dependencies=[query_budget(5)])
+async def create_customer(
     customer: schemas.CustomerCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ) -> Any:
     try:
         # Validate email if provided
@@ -40,53 +79,79 @@ def create_customer(
 
         # Check if email already exists
         if customer.email:
-            existing_customer = db.query(models.Customer).filter(
-                models.Customer.email == customer.email
-            ).first()
+            existing_customer = (await db.execute(
+                select(models.Customer.id).where(models.Customer.email == customer.email).limit(1)
+            )).first()
             if existing_customer:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Email already registered"
                 )
 
-        db_customer = models.Customer(**customer.dict())
+        db_customer = models.Customer(**customer.model_dump())
         db.add(db_customer)
-        db.commit()
-        db.refresh(db_customer)
+        await db.flush()
+        await db.run_sync(versions.record_change, versions.CUSTOMERS, db_customer.id)
+        await db.commit()
+        await db.refresh(db_customer)
         return db_customer
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error creating customer"
         )
 
-@router.get("/", response_model=List[schemas.Customer])
-def read_customers(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+@router.get("/", response_model=List[schemas.Customer], dependencies=[query_budget(2)])
+async def read_customers(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    skip: int = Query(0, ge=0, deprecated=True),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ) -> Any:
     try:
-        customers = db.query(models.Customer).offset(skip).limit(limit).all()
+        customers, next_cursor, prev_cursor = await paginate(
+            db, select(models.Customer), models.Customer.id, cursor, limit, skip
+        )
+        set_link_header(request, response, next_cursor, prev_cursor)
         return customers
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving customers"
         )
 
-@router.get("/{customer_id}", response_model=schemas.Customer)
-def read_customer(
+@router.get("/lookup", response_model=List[schemas.CustomerLookup], dependencies=[query_budget(3)])
+async def lookup_customers(
+    q: str = Query(..., min_length=1),
+    limit: int = Query(10, ge=1, le=LOOKUP_LIMIT_MAX),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+) -> Any:
+    try:
+        await _ensure_index_current(db)
+        return customer_index.lookup(q, limit)
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error looking up customers"
+        )
+
+@router.get("/{customer_id}", response_model=schemas.Customer, dependencies=[query_budget(2)])
+async def read_customer(
     customer_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ) -> Any:
     try:
-        db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
+        db_customer = await db.get(models.Customer, customer_id)
         if db_customer is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -101,15 +166,15 @@ def read_customer(
             detail="Error retrieving customer"
         )
 
-@router.put("/{customer_id}", response_model=schemas.Customer)
-def update_customer(
+@router.put("/{customer_id}", response_model=schemas.Customer, dependencies=[query_budget(5)])
+async def update_customer(
     customer_id: int,
     customer: schemas.CustomerCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ) -> Any:
     try:
-        db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
+        db_customer = await db.get(models.Customer, customer_id)
         if db_customer is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -132,38 +197,39 @@ def update_customer(
 
         # Check if new email already exists for another customer
         if customer.email and customer.email != db_customer.email:
-            existing_customer = db.query(models.Customer).filter(
-                models.Customer.email == customer.email
-            ).first()
+            existing_customer = (await db.execute(
+                select(models.Customer.id).where(models.Customer.email == customer.email).limit(1)
+            )).first()
             if existing_customer:
                 raise HTTPException(
                     status_code=status.HTTP_400_BAD_REQUEST,
                     detail="Email already registered"
                 )
 
-        for key, value in customer.dict().items():
+        for key, value in customer.model_dump().items():
             setattr(db_customer, key, value)
         
-        db.commit()
-        db.refresh(db_customer)
+        await db.run_sync(versions.record_change, versions.CUSTOMERS, customer_id)
+        await db.commit()
+        await db.refresh(db_customer)
         return db_customer
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error updating customer"
         )
 
-@router.delete("/{customer_id}", response_model=schemas.Customer)
-def delete_customer(
+@router.delete("/{customer_id}", response_model=schemas.Customer, dependencies=[query_budget(7)])
+async def delete_customer(
     customer_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ) -> Any:
     try:
-        db_customer = db.query(models.Customer).filter(models.Customer.id == customer_id).first()
+        db_customer = await db.get(models.Customer, customer_id)
         if db_customer is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -171,20 +237,23 @@ def delete_customer(
             )
         
         # Check if customer has any sales
-        sales = db.query(models.Sale).filter(models.Sale.customer_id == customer_id).first()
-        if sales:
+        sales = await db.execute(
+            select(models.Sale.id).where(models.Sale.customer_id == customer_id).limit(1)
+        )
+        if sales.first():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cannot delete customer with existing sales"
             )
 
-        db.delete(db_customer)
-        db.commit()
+        await db.delete(db_customer)
+        await db.run_sync(versions.record_change, versions.CUSTOMERS, customer_id)
+        await db.commit()
         return db_customer
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error deleting customer"
@@ -1,48 +1,69 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session, joinedload
-from typing import List, Any
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
+from typing import List, Any, Optional
 from ..database import get_db
 from .. import models
 from .. import schemas
-from ..auth import get_current_active_user
+from ..auth import get_current_active_user, Principal
+from ..utils.invoicing import ALREADY_INVOICED, create_invoice_from_sale, create_invoices_batch, generate_invoice_number
+from ..utils.pagination import paginate, set_link_header
+from ..utils.query_budget import query_budget
 from decimal import Decimal
-import uuid
-from datetime import datetime
 
 router = APIRouter()
 
-def generate_invoice_number():
-    return f"INV-{datetime.now().strftime('%Y%m%d')}-{str(uuid.uuid4())[:8]}"
+def _already_invoiced() -> HTTPException:
+    # The only unique index an invoice insert or reopening can hit, as the
+    # numbers come from reserved blocks: another request invoiced the sale
+    return HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=ALREADY_INVOICED)
 
-@router.get("/", response_model=List[schemas.Invoice])
-def get_invoices(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+def _invoice_with_details():
+    return select(models.Invoice).options(
+        selectinload(models.Invoice.items).joinedload(models.InvoiceItem.product),
+        joinedload(models.Invoice.customer),
+        joinedload(models.Invoice.user)
+    )
+
+async def _get_invoice(db: AsyncSession, invoice_id: int) -> Optional[models.Invoice]:
+    result = await db.execute(_invoice_with_details().where(models.Invoice.id == invoice_id))
+    return result.scalars().first()
+
+@router.get("/", response_model=List[schemas.Invoice], dependencies=[query_budget(3)])
+async def get_invoices(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    skip: int = Query(0, ge=0, deprecated=True),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        invoices = db.query(models.Invoice).options(
-            joinedload(models.Invoice.items).joinedload(models.InvoiceItem.product),
-            joinedload(models.Invoice.customer),
-            joinedload(models.Invoice.user)
-        ).offset(skip).limit(limit).all()
+        invoices, next_cursor, prev_cursor = await paginate(
+            db, _invoice_with_details(), models.Invoice.id, cursor, limit, skip
+        )
+        set_link_header(request, response, next_cursor, prev_cursor)
         return invoices
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving invoices"
         )
 
-@router.post("/", response_model=schemas.Invoice, status_code=status.HTTP_201_CREATED)
-def create_invoice(
+@router.post("/", response_model=schemas.Invoice, status_code=status.HTTP_201_CREATED, dependencies=[query_budget(10)])
+async def create_invoice(
     invoice: schemas.InvoiceCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
         # Validate sale exists
-        sale = db.query(models.Sale).filter(models.Sale.id == invoice.sale_id).first()
+        sale = await db.get(models.Sale, invoice.sale_id)
         if not sale:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -51,7 +72,7 @@ def create_invoice(
 
         # Validate customer if provided
         if invoice.customer_id:
-            customer = db.query(models.Customer).filter(models.Customer.id == invoice.customer_id).first()
+            customer = await db.get(models.Customer, invoice.customer_id)
             if not customer:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
@@ -59,10 +80,15 @@ def create_invoice(
                 )
 
         # Calculate total amount
+        product_ids = {item.product_id for item in invoice.items}
+        found = set()
+        if product_ids:
+            found = set(await db.scalars(
+                select(models.Product.id).where(models.Product.id.in_(product_ids))
+            ))
         total_amount = Decimal('0')
         for item in invoice.items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            if not product:
+            if item.product_id not in found:
                 raise HTTPException(
                     status_code=status.HTTP_404_NOT_FOUND,
                     detail=f"Product with id {item.product_id} not found"
@@ -78,7 +104,7 @@ def create_invoice(
 
         # Create invoice
         db_invoice = models.Invoice(
-            invoice_number=generate_invoice_number(),
+            invoice_number=await generate_invoice_number(),
             sale_id=invoice.sale_id,
             customer_id=invoice.customer_id,
             user_id=current_user.id,
@@ -90,50 +116,104 @@ def create_invoice(
             status="pending"
         )
         db.add(db_invoice)
-        db.flush()
+        await db.flush()
 
-        # Create invoice items
-        for item in invoice.items:
-            invoice_item = models.InvoiceItem(
-                invoice_id=db_invoice.id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                unit_price=float(item.unit_price),
-                discount=float(item.discount)
+        # Create invoice items in one executemany
+        if invoice.items:
+            await db.execute(
+                insert(models.InvoiceItem),
+                [
+                    {
+                        "invoice_id": db_invoice.id,
+                        "product_id": item.product_id,
+                        "quantity": item.quantity,
+                        "unit_price": float(item.unit_price),
+                        "discount": float(item.discount)
+                    }
+                    for item in invoice.items
+                ]
             )
-            db.add(invoice_item)
 
-        db.commit()
+        await db.commit()
         
         # Reload the invoice with all related data
-        db_invoice = db.query(models.Invoice).options(
-            joinedload(models.Invoice.items).joinedload(models.InvoiceItem.product),
-            joinedload(models.Invoice.customer),
-            joinedload(models.Invoice.user)
-        ).filter(models.Invoice.id == db_invoice.id).first()
-        
-        return db_invoice
+        return await _get_invoice(db, db_invoice.id)
     except HTTPException:
         raise
+    except IntegrityError:
+        await db.rollback()
+        raise _already_invoiced()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error creating invoice"
         )
 
-@router.get("/{invoice_id}", response_model=schemas.Invoice)
-def get_invoice(
+@router.post("/from-sale/{sale_id}", response_model=schemas.Invoice, status_code=status.HTTP_201_CREATED, dependencies=[query_budget(10)])
+async def create_invoice_for_sale(
+    sale_id: int,
+    invoice: Optional[schemas.InvoiceFromSale] = None,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    try:
+        invoice_id = await create_invoice_from_sale(
+            db, sale_id, current_user.id, invoice or schemas.InvoiceFromSale()
+        )
+        await db.commit()
+        return await _get_invoice(db, invoice_id)
+    except HTTPException:
+        await db.rollback()
+        raise
+    except IntegrityError:
+        await db.rollback()
+        raise _already_invoiced()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error creating invoice"
+        )
+
+@router.post("/batch", response_model=schemas.InvoiceBatchResult)
+async def create_invoice_batch(
+    batch: schemas.InvoiceBatchCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    try:
+        try:
+            results = await create_invoices_batch(db, batch, current_user.id)
+        except IntegrityError:
+            # A concurrent request invoiced some of these sales after the
+            # check; checking again reports them per sale
+            await db.rollback()
+            results = await create_invoices_batch(db, batch, current_user.id)
+    except IntegrityError:
+        await db.rollback()
+        raise _already_invoiced()
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error creating invoices"
+        )
+    created = sum(1 for result in results if result.success)
+    return schemas.InvoiceBatchResult(
+        created=created,
+        failed=len(results) - created,
+        results=results
+    )
+
+@router.get("/{invoice_id}", response_model=schemas.Invoice, dependencies=[query_budget(3)])
+async def get_invoice(
     invoice_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        invoice = db.query(models.Invoice).options(
-            joinedload(models.Invoice.items).joinedload(models.InvoiceItem.product),
-            joinedload(models.Invoice.customer),
-            joinedload(models.Invoice.user)
-        ).filter(models.Invoice.id == invoice_id).first()
+        invoice = await _get_invoice(db, invoice_id)
         
         if invoice is None:
             raise HTTPException(
@@ -149,15 +229,15 @@ def get_invoice(
             detail="Error retrieving invoice"
         )
 
-@router.put("/{invoice_id}/status", response_model=schemas.Invoice)
-def update_invoice_status(
+@router.put("/{invoice_id}/status", response_model=schemas.Invoice, dependencies=[query_budget(5)])
+async def update_invoice_status(
     invoice_id: int,
     status: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        invoice = db.query(models.Invoice).filter(models.Invoice.id == invoice_id).first()
+        invoice = await _get_invoice(db, invoice_id)
         if invoice is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -171,13 +251,17 @@ def update_invoice_status(
             )
         
         invoice.status = status
-        db.commit()
-        db.refresh(invoice)
+        await db.commit()
+        await db.refresh(invoice, ["updated_at"])
         return invoice
     except HTTPException:
         raise
+    except IntegrityError:
+        # Reopening a cancelled invoice of a sale invoiced again since
+        await db.rollback()
+        raise _already_invoiced()
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error updating invoice status"
@@ -1,34 +1,88 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy import delete, select
+from sqlalchemy.orm.attributes import set_committed_value
+from sqlalchemy.ext.asyncio import AsyncSession
+from pydantic import TypeAdapter
+from typing import Hashable, List, Optional
+from datetime import datetime
 from ..database import get_db
 from .. import models
 from .. import schemas
-from ..auth import get_current_active_user
+from ..auth import get_current_active_user, get_current_admin_user, Principal
+from ..utils import catalog_cache, inventory, stock_stripes, versions
+from ..utils.product_search import SEARCH_LIMIT_MAX, find_products, search_terms
+from ..utils.pagination import paginate, set_link_header
+from ..utils.query_budget import query_budget
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.Product])
-def get_products(
-    skip: int = 0,
-    limit: int = 100,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+_product_list = TypeAdapter(List[schemas.Product])
+
+# Product responses show stock, so their pages change with either
+CATALOG_TOPICS = (versions.CATALOG, versions.STOCK)
+
+def _not_modified(request: Request, version: catalog_cache.CatalogVersion, key: Hashable) -> Optional[Response]:
+    # Answered from the versions alone, without reading any product
+    etag = catalog_cache.etag_for(version, key)
+    if catalog_cache.etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    return None
+
+def _cached_response(request: Request, page: catalog_cache.CachedPage) -> Response:
+    response = Response(content=page.body, media_type="application/json", headers={"ETag": page.etag})
+    set_link_header(request, response, page.next_cursor, page.prev_cursor)
+    return response
+
+async def _with_current_stock(db: AsyncSession, products: List[models.Product]) -> List[models.Product]:
+    # products.stock leaves out the stock stripes, and in ledger mode the
+    # movements not compacted yet
+    if products:
+        await db.run_sync(inventory.apply_current_stock, products)
+    return products
+
+@router.get("/", response_model=List[schemas.Product], dependencies=[query_budget(4)])
+async def get_products(
+    request: Request,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    skip: int = Query(0, ge=0, deprecated=True),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        products = db.query(models.Product).offset(skip).limit(limit).all()
-        return products
+        key = ("list", cursor, limit, skip)
+        version = await versions.current_versions(db, CATALOG_TOPICS)
+        not_modified = _not_modified(request, version, key)
+        if not_modified is not None:
+            return not_modified
+
+        page = catalog_cache.get(version, key)
+        if page is None:
+            products, next_cursor, prev_cursor = await paginate(
+                db, select(models.Product), models.Product.id, cursor, limit, skip
+            )
+            await _with_current_stock(db, products)
+            page = catalog_cache.CachedPage(
+                etag=catalog_cache.etag_for(version, key),
+                body=_product_list.dump_json(_product_list.validate_python(products, from_attributes=True)),
+                next_cursor=next_cursor,
+                prev_cursor=prev_cursor
+            )
+            catalog_cache.put(version, key, page)
+        return _cached_response(request, page)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving products"
         )
 
-@router.post("/", response_model=schemas.Product, status_code=status.HTTP_201_CREATED)
-def create_product(
+@router.post("/", response_model=schemas.Product, status_code=status.HTTP_201_CREATED, dependencies=[query_budget(5)])
+async def create_product(
     product: schemas.ProductCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
         # Validate price is positive
@@ -45,34 +99,94 @@ def create_product(
                 detail="Stock cannot be negative"
             )
 
-        db_product = models.Product(**product.dict())
+        db_product = models.Product(**product.model_dump())
+        received = 0
+        if inventory.ledger_enabled():
+            # The opening stock is received through the ledger, like any later delivery
+            received, db_product.stock = db_product.stock, 0
         db.add(db_product)
-        db.commit()
-        db.refresh(db_product)
+        if received:
+            await db.flush()
+            await db.run_sync(inventory.record_movements, [
+                inventory.movement(db_product.id, received, inventory.RECEIPT, datetime.utcnow())
+            ])
+        await db.run_sync(versions.record_change, versions.CATALOG)
+        await db.commit()
+        await db.refresh(db_product)
+        if received:
+            set_committed_value(db_product, "stock", received)
         return db_product
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error creating product"
         )
 
-@router.get("/{product_id}", response_model=schemas.Product)
-def get_product(
+@router.get("/search", response_model=List[schemas.Product], dependencies=[query_budget(5)])
+async def search_products(
+    request: Request,
+    q: str = Query(..., min_length=2),
+    limit: int = Query(20, ge=1, le=SEARCH_LIMIT_MAX),
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    try:
+        # Type-ahead repeats the same prefixes, so results share the catalog cache
+        key = ("search", tuple(search_terms(q)), limit)
+        version = await versions.current_versions(db, CATALOG_TOPICS)
+        not_modified = _not_modified(request, version, key)
+        if not_modified is not None:
+            return not_modified
+
+        page = catalog_cache.get(version, key)
+        if page is None:
+            products = await _with_current_stock(db, await find_products(db, q, limit))
+            page = catalog_cache.CachedPage(
+                etag=catalog_cache.etag_for(version, key),
+                body=_product_list.dump_json(_product_list.validate_python(products, from_attributes=True))
+            )
+            catalog_cache.put(version, key, page)
+        return _cached_response(request, page)
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error searching products"
+        )
+
+@router.get("/{product_id}", response_model=schemas.Product, dependencies=[query_budget(4)])
+async def get_product(
+    request: Request,
     product_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        product = db.query(models.Product).filter(models.Product.id == product_id).first()
-        if product is None:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Product not found"
+        key = ("item", product_id)
+        version = await versions.current_versions(db, CATALOG_TOPICS)
+        not_modified = _not_modified(request, version, key)
+        if not_modified is not None:
+            return not_modified
+
+        page = catalog_cache.get(version, key)
+        if page is None:
+            product = await db.get(models.Product, product_id)
+            if product is None:
+                raise HTTPException(
+                    status_code=status.HTTP_404_NOT_FOUND,
+                    detail="Product not found"
+                )
+            await _with_current_stock(db, [product])
+            page = catalog_cache.CachedPage(
+                etag=catalog_cache.etag_for(version, key),
+                body=schemas.Product.model_validate(product).model_dump_json().encode("utf-8")
             )
-        return product
+            catalog_cache.put(version, key, page)
+        return _cached_response(request, page)
     except HTTPException:
         raise
     except Exception as e:
@@ -81,15 +195,15 @@ def get_product(
             detail="Error retrieving product"
         )
 
-@router.put("/{product_id}", response_model=schemas.Product)
-def update_product(
+@router.put("/{product_id}", response_model=schemas.Product, dependencies=[query_budget(8)])
+async def update_product(
     product_id: int,
     product: schemas.ProductUpdate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+        db_product = await db.get(models.Product, product_id)
         if db_product is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -110,30 +224,77 @@ def update_product(
                 detail="Stock cannot be negative"
             )
 
-        update_data = product.dict(exclude_unset=True)
+        update_data = product.model_dump(exclude_unset=True)
+        ledger = inventory.ledger_enabled()
+        stock = update_data.pop("stock", None) if ledger or db_product.stock_stripes else None
         for key, value in update_data.items():
             setattr(db_product, key, value)
+        if stock is not None and not ledger:
+            await db.run_sync(stock_stripes.spread_stock, db_product, stock, db_product.stock_stripes)
+        elif stock is not None:
+            # Setting the stock records the difference from the current level
+            levels = await db.run_sync(inventory.stock_levels, [product_id])
+            if stock != levels[product_id]:
+                await db.run_sync(inventory.record_movements, [
+                    inventory.movement(product_id, stock - levels[product_id], inventory.ADJUSTMENT, datetime.utcnow())
+                ])
 
-        db.commit()
-        db.refresh(db_product)
+        await db.run_sync(versions.record_change, versions.CATALOG)
+        await db.commit()
+        await db.refresh(db_product)
+        if stock is not None:
+            set_committed_value(db_product, "stock", stock)
+        else:
+            await _with_current_stock(db, [db_product])
         return db_product
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error updating product"
         )
 
-@router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_product(
+@router.put("/{product_id}/stock-stripes", response_model=schemas.Product, dependencies=[query_budget(10)])
+async def set_product_stock_stripes(
     product_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    stripes: schemas.ProductStockStripes,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_admin_user)
 ):
+    """Spread a hot product's stock over several rows so concurrent checkouts
+    of it do not queue on one row lock; 0 gathers it back."""
     try:
-        db_product = db.query(models.Product).filter(models.Product.id == product_id).first()
+        db_product = await db.get(models.Product, product_id)
+        if db_product is None:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Product not found"
+            )
+
+        await db.run_sync(stock_stripes.set_stripes, db_product, stripes.stripes)
+        await db.run_sync(versions.record_change, versions.CATALOG)
+        await db.commit()
+        await db.refresh(db_product)
+        return (await _with_current_stock(db, [db_product]))[0]
+    except HTTPException:
+        raise
+    except Exception as e:
+        await db.rollback()
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="Error updating product stock stripes"
+        )
+
+@router.delete("/{product_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[query_budget(7)])
+async def delete_product(
+    product_id: int,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    try:
+        db_product = await db.get(models.Product, product_id)
         if db_product is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -141,19 +302,34 @@ def delete_product(
             )
 
         # Check if product is used in any sales
-        sale_items = db.query(models.SaleItem).filter(models.SaleItem.product_id == product_id).first()
-        if sale_items:
+        sale_items = await db.execute(
+            select(models.SaleItem.id).where(models.SaleItem.product_id == product_id).limit(1)
+        )
+        if sale_items.first():
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Cannot delete product that has been sold"
             )
 
-        db.delete(db_product)
-        db.commit()
+        # The ledger keeps every change of stock on record
+        movements = await db.execute(
+            select(models.StockMovement.id).where(models.StockMovement.product_id == product_id).limit(1)
+        )
+        if movements.first():
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Cannot delete product with stock movements"
+            )
+
+        await db.execute(delete(models.ProductStockStripe).where(models.ProductStockStripe.product_id == product_id))
+        # Not through the session, which would first load the sale and invoice items to unlink
+        await db.execute(delete(models.Product).where(models.Product.id == product_id))
+        await db.run_sync(versions.record_change, versions.CATALOG)
+        await db.commit()
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error deleting product"
@@ -1,62 +1,175 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
+from datetime import datetime
+from typing import List, Optional
 from ..database import get_db
-from ..auth import get_current_active_user
-from .. import models
-from ..utils.reports import generate_weekly_report, generate_monthly_report, get_latest_report
-from datetime import datetime, timedelta
+from ..auth import get_current_active_user, Principal
+from .. import schemas
+from ..utils.reports import is_stale, REPORT_GENERATORS
+from ..utils import report_store, sales_cube, scheduler
+from ..utils.query_budget import extend_budget, query_budget
 from fastapi.responses import JSONResponse
-import json
 
 router = APIRouter()
 
-@router.get("/weekly")
-def get_weekly_report(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
-):
+def _job_response(job: scheduler.Job) -> JSONResponse:
+    return JSONResponse(
+        status_code=status.HTTP_202_ACCEPTED,
+        content=schemas.ReportJob.model_validate(job).model_dump(mode="json"),
+        headers={"Location": f"/reports/jobs/{job.id}"}
+    )
+
+async def _latest_report(db: AsyncSession, report_type: str, period: str) -> JSONResponse:
+    snapshot = await db.run_sync(report_store.latest_snapshot, report_type, period)
+    regenerable = (report_type, period) in REPORT_GENERATORS
+    if snapshot is None and regenerable:
+        # Nothing precomputed yet (just after startup), so wait for the job
+        job = scheduler.enqueue(report_type, period)
+        await job.done.wait()
+        if job.status != "succeeded":
+            raise HTTPException(
+                status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+                detail=f"Error generating {period} report"
+            )
+        snapshot = await db.run_sync(report_store.latest_snapshot, report_type, period)
+
+    if snapshot is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"No {period} {report_type} report found"
+        )
+
+    stale = is_stale(snapshot, scheduler.max_age(report_type, period))
+    if stale and regenerable:
+        # Serve what we have; the scheduler regenerates it
+        scheduler.enqueue(report_type, period)
+    return JSONResponse(
+        content=snapshot.data,
+        headers={
+            "X-Report-Generated-At": snapshot.generated_at.isoformat(),
+            "X-Report-Stale": "true" if stale else "false"
+        }
+    )
+
+async def _report_endpoint(db: AsyncSession, report_type: str, period: str, refresh: bool) -> JSONResponse:
     try:
-        report_data = generate_weekly_report(db)
-        return JSONResponse(content=report_data)
+        if refresh:
+            return _job_response(scheduler.enqueue(report_type, period))
+        return await _latest_report(db, report_type, period)
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error generating weekly report"
+            detail=f"Error retrieving {period} report"
         )
 
-@router.get("/monthly")
-def get_monthly_report(
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+@router.get("/daily", dependencies=[query_budget(3)])
+async def get_daily_report(
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    return await _report_endpoint(db, "daily_sales", "daily", refresh)
+
+@router.get("/weekly", dependencies=[query_budget(3)])
+async def get_weekly_report(
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    return await _report_endpoint(db, "weekly_sales", "weekly", refresh)
+
+@router.get("/monthly", dependencies=[query_budget(3)])
+async def get_monthly_report(
+    refresh: bool = False,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
+    return await _report_endpoint(db, "monthly_sales", "monthly", refresh)
+
+@router.get("/query", response_model=schemas.SalesQueryResult, dependencies=[query_budget(3)])
+async def query_sales(
+    start_date: Optional[datetime] = None,
+    end_date: Optional[datetime] = None,
+    product_id: List[int] = Query([]),
+    customer_id: List[int] = Query([], description="0 matches sales without a customer"),
+    user_id: List[int] = Query([]),
+    hour: List[int] = Query([], description="hours of the day, UTC"),
+    group_by: List[str] = Query([], description="any of product, customer, user, day, hour"),
+    order_by: str = "revenue",
+    limit: int = Query(100, ge=1, le=1000),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    if any(dimension not in sales_cube.DIMENSIONS for dimension in group_by) or len(set(group_by)) < len(group_by):
+        raise HTTPException(status_code=400, detail="Invalid group_by")
+    if order_by not in sales_cube.ORDERINGS:
+        raise HTTPException(status_code=400, detail="Invalid order_by")
+    if any(not 0 <= value < 24 for value in hour):
+        raise HTTPException(status_code=400, detail="Invalid hour")
     try:
-        report_data = generate_monthly_report(db)
-        return JSONResponse(content=report_data)
+        result, extra_reads = await run_in_threadpool(
+            sales_cube.query,
+            start_date=start_date,
+            end_date=end_date,
+            product_ids=product_id,
+            customer_ids=customer_id,
+            user_ids=user_id,
+            hours=hour,
+            group_by=group_by,
+            order_by=order_by,
+            limit=limit
+        )
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
-            detail="Error generating monthly report"
+            detail="Error querying sales"
+        )
+    # A burst of sales or status changes is caught up a chunk per read
+    extend_budget(extra_reads)
+    return result
+
+@router.get("/jobs/{job_id}", response_model=schemas.ReportJob)
+async def get_report_job(
+    job_id: str,
+    current_user: Principal = Depends(get_current_active_user)
+):
+    job = scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report job not found"
         )
+    return job
 
-@router.get("/latest/{report_type}/{period}")
-def get_latest_report_endpoint(
+@router.delete("/jobs/{job_id}", response_model=schemas.ReportJob)
+async def cancel_report_job(
+    job_id: str,
+    current_user: Principal = Depends(get_current_active_user)
+):
+    job = scheduler.get_job(job_id)
+    if job is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Report job not found"
+        )
+    scheduler.cancel(job)
+    return job
+
+@router.get("/latest/{report_type}/{period}", dependencies=[query_budget(3)])
+async def get_latest_report_endpoint(
     report_type: str,
     period: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        report_data = get_latest_report(report_type, period)
-        if not report_data:
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail=f"No {period} {report_type} report found"
-            )
-        return JSONResponse(content=report_data)
+        return await _latest_report(db, report_type, period)
     except HTTPException:
         raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving report"
-        ) 
\ No newline at end of file
+        )
@@ -1,137 +1,140 @@
-from fastapi import APIRouter, Depends, HTTPException, status, Query
-from sqlalchemy.orm import Session, joinedload
+from fastapi import APIRouter, Depends, HTTPException, status, Query, Request, Response
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import joinedload, selectinload
 from typing import List, Any, Optional
 from ..database import get_db
 from .. import models
 from .. import schemas
-from ..auth import get_current_active_user
-from decimal import Decimal
-from ..utils.export import export_sales_to_csv
+from ..auth import get_current_active_user, Principal
+from ..utils.export import aiter_sales_csv, sales_id_range_statement
+from ..utils import analytics_pool, checkout, rollups, stock_stripes
+from ..utils.pagination import paginate, set_link_header
+from ..utils.query_budget import allow_repeats, extend_budget, query_budget, repeats_ok
 from datetime import datetime
+import math
 from fastapi.responses import StreamingResponse
-from io import StringIO
 
 router = APIRouter()
 
-@router.get("/", response_model=List[schemas.Sale])
-def get_sales(
-    skip: int = 0,
-    limit: int = 100,
+def _sale_with_items():
+    # Everything schemas.Sale serialises, loaded up front since async sessions cannot lazy load
+    return select(models.Sale).options(
+        selectinload(models.Sale.items).joinedload(models.SaleItem.product)
+    )
+
+# Statements each slower stock path adds to a checkout: a striped take reads
+# the full stock and runs its UPDATE in a savepoint, a rebalance locks the
+# product and its stripes and rewrites them, and drawing on products.stock
+# spreads the stock again
+SLOW_PATH_STATEMENTS = {
+    stock_stripes.STRIPED_TAKES: 4,
+    stock_stripes.REBALANCES: 3,
+    stock_stripes.RESPREADS: 2,
+}
+
+def _allow_slow_paths(db: AsyncSession):
+    # Counted by stock_stripes in the session's info while the request ran
+    extend_budget(sum(statements * db.info.pop(path, 0) for path, statements in SLOW_PATH_STATEMENTS.items()))
+
+async def _get_sale(db: AsyncSession, sale_id: int) -> Optional[models.Sale]:
+    result = await db.execute(_sale_with_items().where(models.Sale.id == sale_id))
+    return result.scalars().first()
+
+@router.get("/", response_model=List[schemas.Sale], dependencies=[query_budget(3)])
+async def get_sales(
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(100, ge=1),
+    skip: int = Query(0, ge=0, deprecated=True),
     filters: schemas.SalesFilterParams = Depends(),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        query = db.query(models.Sale).options(
-            joinedload(models.Sale.items).joinedload(models.SaleItem.product)
-        )
+        stmt = _sale_with_items()
 
         if filters.start_date:
-            query = query.filter(models.Sale.created_at >= filters.start_date)
+            stmt = stmt.where(models.Sale.created_at >= filters.start_date)
         if filters.end_date:
-            query = query.filter(models.Sale.created_at <= filters.end_date)
+            stmt = stmt.where(models.Sale.created_at <= filters.end_date)
         if filters.customer_id:
-            query = query.filter(models.Sale.customer_id == filters.customer_id)
+            stmt = stmt.where(models.Sale.customer_id == filters.customer_id)
         if filters.product_id:
-            query = query.join(models.Sale.items).filter(models.SaleItem.product_id == filters.product_id)
+            stmt = stmt.where(models.Sale.items.any(models.SaleItem.product_id == filters.product_id))
 
-        sales = query.offset(skip).limit(limit).all()
+        sales, next_cursor, prev_cursor = await paginate(db, stmt, models.Sale.id, cursor, limit, skip)
+        set_link_header(request, response, next_cursor, prev_cursor)
         return sales
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error retrieving sales"
         )
 
-@router.post("/", response_model=schemas.Sale, status_code=status.HTTP_201_CREATED)
-def create_sale(
+@router.post("/", response_model=schemas.Sale, status_code=status.HTTP_201_CREATED, dependencies=[query_budget(12)])
+async def create_sale(
     sale: schemas.SaleCreate,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        # Validate customer exists if provided
-        if sale.customer_id:
-            customer = db.query(models.Customer).filter(models.Customer.id == sale.customer_id).first()
-            if not customer:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail="Customer not found"
-                )
-
-        # Validate items
-        if not sale.items:
-            raise HTTPException(
-                status_code=status.HTTP_400_BAD_REQUEST,
-                detail="Sale must have at least one item"
-            )
-
-        # Calculate total and validate products
-        total_amount = Decimal('0')
-        for item in sale.items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            if not product:
-                raise HTTPException(
-                    status_code=status.HTTP_404_NOT_FOUND,
-                    detail=f"Product with id {item.product_id} not found"
-                )
-            
-            if product.stock < item.quantity:
-                raise HTTPException(
-                    status_code=status.HTTP_400_BAD_REQUEST,
-                    detail=f"Insufficient stock for product {product.name}"
-                )
-            
-            total_amount += Decimal(str(product.price)) * item.quantity
-
-        # Create sale
-        db_sale = models.Sale(
-            customer_id=sale.customer_id,
-            user_id=current_user.id,
-            total_amount=float(total_amount)
-        )
-        db.add(db_sale)
-        db.flush()  # Get the sale ID
-
-        # Create sale items and update stock
-        for item in sale.items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            sale_item = models.SaleItem(
-                sale_id=db_sale.id,
-                product_id=item.product_id,
-                quantity=item.quantity,
-                price=product.price
-            )
-            db.add(sale_item)
-            
-            # Update product stock
-            product.stock -= item.quantity
-
-        db.commit()
-        
-        # Reload the sale with all related data
-        db_sale = db.query(models.Sale).options(
-            joinedload(models.Sale.items).joinedload(models.SaleItem.product)
-        ).filter(models.Sale.id == db_sale.id).first()
-        
-        return db_sale
+        db_sale = await db.run_sync(checkout.create_sale, sale, current_user.id)
+        # Serialise before committing so the response is built from the objects
+        # already in memory instead of being reloaded after commit
+        response = schemas.Sale.model_validate(db_sale)
+        await db.commit()
+        return response
     except HTTPException:
+        await db.rollback()
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error creating sale"
         )
-
-@router.get("/{sale_id}", response_model=schemas.Sale)
-def get_sale(
+    finally:
+        _allow_slow_paths(db)
+
+# A batch chunk runs at most this many statements (in ledger mode on
+# PostgreSQL, which locks the chunk's products first), and a sale replayed
+# on its own runs a checkout in a savepoint; either runs no statement more
+# than twice
+BATCH_CHUNK_STATEMENTS = 11
+REPLAYED_SALE_STATEMENTS = 13
+
+@router.post("/batch", response_model=schemas.SaleBatchResult, dependencies=[query_budget(1)])
+async def create_sales_batch(
+    batch: schemas.SaleBatchCreate,
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
+):
+    chunk_size = checkout.BATCH_CHUNK_SIZE
+    results = await db.run_sync(checkout.create_sales_batch, batch.sales, current_user.id, chunk_size)
+    chunks = math.ceil(len(batch.sales) / chunk_size)
+    replayed = db.info.pop(checkout.REPLAYED_SALES, 0)
+    _allow_slow_paths(db)
+    extend_budget(chunks * BATCH_CHUNK_STATEMENTS + replayed * REPLAYED_SALE_STATEMENTS)
+    allow_repeats(2 * (chunks + replayed))
+    created = sum(1 for result in results if result.success)
+    return schemas.SaleBatchResult(
+        created=created,
+        failed=len(results) - created,
+        results=results
+    )
+
+@router.get("/{sale_id}", response_model=schemas.Sale, dependencies=[query_budget(3)])
+async def get_sale(
     sale_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        sale = db.query(models.Sale).filter(models.Sale.id == sale_id).first()
+        sale = await _get_sale(db, sale_id)
         if sale is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -146,68 +149,72 @@ def get_sale(
             detail="Error retrieving sale"
         )
 
-@router.delete("/{sale_id}", status_code=status.HTTP_204_NO_CONTENT)
-def delete_sale(
+@router.delete("/{sale_id}", status_code=status.HTTP_204_NO_CONTENT, dependencies=[query_budget(11)])
+async def delete_sale(
     sale_id: int,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
     try:
-        sale = db.query(models.Sale).filter(models.Sale.id == sale_id).first()
+        sale = await db.run_sync(checkout.delete_sale, sale_id)
         if sale is None:
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="Sale not found"
             )
-
-        # Restore product stock
-        for item in sale.items:
-            product = db.query(models.Product).filter(models.Product.id == item.product_id).first()
-            if product:
-                product.stock += item.quantity
-
-        db.delete(sale)
-        db.commit()
+        await db.commit()
     except HTTPException:
         raise
     except Exception as e:
-        db.rollback()
+        await db.rollback()
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="Error deleting sale"
         )
 
-@router.put("/{sale_id}/status", response_model=schemas.Sale)
-def update_sale_status(
+@router.put("/{sale_id}/status", response_model=schemas.Sale, dependencies=[query_budget(8)])
+async def update_sale_status(
     sale_id: int,
     status: str,
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ) -> Any:
-    db_sale = db.query(models.Sale).filter(models.Sale.id == sale_id).first()
+    db_sale = await _get_sale(db, sale_id)
     if db_sale is None:
         raise HTTPException(status_code=404, detail="Sale not found")
     
     if status not in ["completed", "pending", "cancelled"]:
         raise HTTPException(status_code=400, detail="Invalid status")
     
+    await db.run_sync(rollups.record_status_change, db_sale, status)
+    await db.run_sync(checkout.record_status_change, sale_id, status, datetime.utcnow())
     db_sale.status = status
-    db.commit()
-    db.refresh(db_sale)
+    await db.commit()
+    # updated_at is set by the database, so read it back
+    await db.refresh(db_sale, ["updated_at"])
     return db_sale
 
-@router.get("/export/csv")
-def export_sales_csv(
+@router.get("/export/csv", dependencies=[repeats_ok()])
+async def export_sales_csv(
     filters: schemas.SalesFilterParams = Depends(),
-    db: Session = Depends(get_db),
-    current_user: models.User = Depends(get_current_active_user)
+    db: AsyncSession = Depends(get_db),
+    current_user: Principal = Depends(get_current_active_user)
 ):
+    filter_args = (filters.start_date, filters.end_date, filters.customer_id, filters.product_id)
     try:
-        csv_data = export_sales_to_csv(db, filters.start_date, filters.end_date, filters.customer_id, filters.product_id)
-        output = StringIO(csv_data)
-        
+        if analytics_pool.enabled():
+            # Encoded by the worker processes, off this process's GIL
+            first_id, last_id = (await db.execute(sales_id_range_statement(*filter_args))).one()
+            body = analytics_pool.sales_csv(first_id, last_id, {
+                "start_date": filters.start_date,
+                "end_date": filters.end_date,
+                "customer_id": filters.customer_id,
+                "product_id": filters.product_id,
+            }, analytics_pool.AnalyticsJob())
+        else:
+            body = aiter_sales_csv(db, *filter_args)
         return StreamingResponse(
-            iter([output.getvalue()]),
+            body,
             media_type="text/csv",
             headers={
                 "Content-Disposition": "attachment; filename=sales_export.csv"
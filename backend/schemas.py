@@ -1,6 +1,6 @@
 from pydantic import BaseModel, EmailStr, Field, validator
 from typing import List, Optional
-from datetime import datetime
+from datetime import date, datetime
 from decimal import Decimal
 
 # User schemas
@@ -21,6 +21,10 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class UserAdminUpdate(BaseModel):
+    is_active: Optional[bool] = None
+    is_admin: Optional[bool] = None
+
 # Token schemas
 class Token(BaseModel):
     access_token: str
@@ -51,12 +55,17 @@ class ProductUpdate(BaseModel):
 
 class Product(ProductBase):
     id: int
+    stock_stripes: int = 0
     created_at: datetime
     updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class ProductStockStripes(BaseModel):
+    # 0 folds the stripes back into the product
+    stripes: int = Field(..., ge=0, le=64)
+
 # Customer schemas
 class CustomerBase(BaseModel):
     name: str = Field(..., min_length=1)
@@ -99,6 +108,15 @@ class Customer(CustomerBase):
     class Config:
         from_attributes = True
 
+class CustomerLookup(BaseModel):
+    id: int
+    name: str
+    email: Optional[str] = None
+    phone: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
 # Sale schemas
 class SaleItemBase(BaseModel):
     product_id: int
@@ -136,6 +154,20 @@ class Sale(SaleBase):
     class Config:
         from_attributes = True
 
+class SaleBatchCreate(BaseModel):
+    sales: List[SaleCreate] = Field(..., min_length=1, max_length=10000)
+
+class SaleBatchItemResult(BaseModel):
+    index: int
+    success: bool
+    sale_id: Optional[int] = None
+    error: Optional[str] = None
+
+class SaleBatchResult(BaseModel):
+    created: int
+    failed: int
+    results: List[SaleBatchItemResult]
+
 class SalesFilterParams(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
@@ -173,6 +205,31 @@ class InvoiceBase(BaseModel):
 class InvoiceCreate(InvoiceBase):
     pass
 
+class InvoiceFromSale(BaseModel):
+    tax_amount: Decimal = Field(default=0, ge=0)
+    discount_amount: Decimal = Field(default=0, ge=0)
+    payment_method: Optional[str] = None
+    notes: Optional[str] = None
+
+class InvoiceBatchCreate(BaseModel):
+    sale_ids: List[int] = Field(..., min_length=1, max_length=10000)
+    # Applied to each sale's total, since one tax amount cannot fit every sale
+    tax_rate: Decimal = Field(default=0, ge=0)
+    payment_method: Optional[str] = None
+    notes: Optional[str] = None
+
+class InvoiceBatchItemResult(BaseModel):
+    sale_id: int
+    success: bool
+    invoice_id: Optional[int] = None
+    invoice_number: Optional[str] = None
+    error: Optional[str] = None
+
+class InvoiceBatchResult(BaseModel):
+    created: int
+    failed: int
+    results: List[InvoiceBatchItemResult]
+
 class Invoice(InvoiceBase):
     id: int
     invoice_number: str
@@ -186,4 +243,40 @@ class Invoice(InvoiceBase):
     user: User
 
     class Config:
-        from_attributes = True 
\ No newline at end of file
+        from_attributes = True 
+# Report schemas
+class ReportJob(BaseModel):
+    id: str
+    report_type: str
+    period: str
+    status: str  # queued, running, succeeded, failed, cancelled
+    enqueued_at: datetime
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+
+    class Config:
+        from_attributes = True
+
+class SalesQueryGroup(BaseModel):
+    # Only the dimensions grouped by are set
+    product_id: Optional[int] = None
+    customer_id: Optional[int] = None
+    user_id: Optional[int] = None
+    day: Optional[date] = None
+    hour: Optional[int] = None
+    quantity: int
+    revenue: float
+    line_items: int
+
+class SalesQueryTotals(BaseModel):
+    quantity: int
+    revenue: float
+    line_items: int
+
+class SalesQueryResult(BaseModel):
+    group_by: List[str]
+    groups: List[SalesQueryGroup]
+    totals: SalesQueryTotals
+    as_of: datetime
+
@@ -0,0 +1,256 @@
+"""Worker processes for report generation and exports.
+
+Building a report or a large CSV export is CPU bound, and in FastAPI's
+threadpool it competes with checkout for the GIL. With ANALYTICS_WORKERS
+above 0 that work runs in a bounded pool of worker processes instead, each
+with its own engine. A report's date range is split into chunks of
+ANALYTICS_CHUNK_DAYS days, summarised in parallel and merged
+(reports.build_sales_report); a sales export is split into ranges of
+EXPORT_CHUNK_IDS sale ids, each written to a temporary part file by a worker
+and streamed back in order, with EXPORT_PARTS_IN_FLIGHT parts per worker
+written ahead of the one being sent.
+
+Each piece of work runs as an AnalyticsJob with a timeout. Cancelling a job
+drops its chunks not started yet, and the running ones stop at their next
+check of the job's cancel token. ANALYTICS_WORKERS=0 runs the same chunks in
+threads, as before.
+"""
+from concurrent.futures import Executor, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from datetime import date, datetime, timedelta
+from collections import deque
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from sqlalchemy import create_engine
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from ..database import SQLALCHEMY_DATABASE_URL, SessionLocal, configure_engine, engine_options, is_sqlite
+from . import export, reports
+
+ANALYTICS_WORKERS = int(os.getenv("ANALYTICS_WORKERS", str(min(4, os.cpu_count() or 1))))
+ANALYTICS_CHUNK_DAYS = int(os.getenv("ANALYTICS_CHUNK_DAYS", "7"))
+ANALYTICS_TIMEOUT_SECONDS = int(os.getenv("ANALYTICS_TIMEOUT_SECONDS", "120"))
+EXPORT_CHUNK_IDS = int(os.getenv("EXPORT_CHUNK_IDS", "50000"))
+EXPORT_PARTS_IN_FLIGHT = int(os.getenv("EXPORT_PARTS_IN_FLIGHT", "2"))
+
+logger = logging.getLogger(__name__)
+
+class JobCancelled(Exception):
+    pass
+
+class AnalyticsTimeout(Exception):
+    pass
+
+_pool: Optional[ProcessPoolExecutor] = None
+_manager = None
+_pool_lock = threading.Lock()
+# Set in worker processes by _init_worker
+_worker_sessions: Optional[sessionmaker] = None
+
+def enabled() -> bool:
+    if ANALYTICS_WORKERS <= 0:
+        return False
+    # Worker processes cannot see an in-memory database
+    return not (is_sqlite(SQLALCHEMY_DATABASE_URL)
+                and make_url(SQLALCHEMY_DATABASE_URL).database in (None, "", ":memory:"))
+
+def _init_worker(url: str):
+    global _worker_sessions
+    options = engine_options(url)
+    if not is_sqlite(url):
+        # A worker runs one chunk at a time
+        options.update(pool_size=1, max_overflow=0)
+    engine = configure_engine(create_engine(url, **options))
+    _worker_sessions = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+def _session():
+    return (_worker_sessions or SessionLocal)()
+
+def _executor() -> Optional[Executor]:
+    """The process pool, or None (the event loop's default threads) when
+    it is disabled."""
+    global _pool, _manager
+    if not enabled():
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the parent has an event loop, threads and open connections
+            context = multiprocessing.get_context("spawn")
+            _manager = context.Manager()
+            _pool = ProcessPoolExecutor(
+                max_workers=ANALYTICS_WORKERS,
+                mp_context=context,
+                initializer=_init_worker,
+                initargs=(SQLALCHEMY_DATABASE_URL,)
+            )
+        return _pool
+
+def _cancel_token():
+    # Shared with the worker processes through the manager
+    return _manager.Event() if _executor() is not None else threading.Event()
+
+def start():
+    """Start the pool ahead of the first job; call from the app's startup hook."""
+    _executor()
+
+def shutdown():
+    global _pool, _manager
+    with _pool_lock:
+        pool, manager, _pool, _manager = _pool, _manager, None, None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+    if manager is not None:
+        manager.shutdown()
+
+def _reset_broken_pool(pool: Optional[Executor]):
+    # A worker died (killed, out of memory); start a new pool for the next job
+    global _pool
+    logger.warning("analytics worker pool broken, restarting it")
+    with _pool_lock:
+        if _pool is pool:
+            _pool = None
+    if pool is not None:
+        pool.shutdown(wait=False, cancel_futures=True)
+
+class AnalyticsJob:
+    def __init__(self, timeout: float = ANALYTICS_TIMEOUT_SECONDS):
+        self.id = uuid.uuid4().hex
+        self.deadline = time.monotonic() + timeout
+        self.cancelled = False
+        self._token = _cancel_token()
+        self._futures: List[asyncio.Future] = []
+
+    def submit(self, fn: Callable, *args) -> asyncio.Future:
+        """Run ``fn(*args, token)`` in the pool; ``token.is_set()`` turns true
+        when the job is cancelled."""
+        if self.cancelled:
+            raise JobCancelled(self.id)
+        future = asyncio.get_running_loop().run_in_executor(_executor(), fn, *args, self._token)
+        self._futures.append(future)
+        return future
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        self._token.set()
+        for future in self._futures:
+            future.cancel()
+
+    async def wait(self, awaitable: Awaitable, timeout: Optional[float] = None) -> Any:
+        """Await work of this job, within ``timeout`` seconds or else what is
+        left of the job's timeout. The job is cancelled if the work fails,
+        times out or the caller goes away."""
+        pool = _executor()
+        if timeout is None:
+            timeout = max(0.0, self.deadline - time.monotonic())
+        try:
+            return await asyncio.wait_for(awaitable, timeout)
+        except asyncio.TimeoutError:
+            self.cancel()
+            raise AnalyticsTimeout(self.id) from None
+        except asyncio.CancelledError:
+            # Cancelled through cancel() rather than by our own caller
+            if self.cancelled and not asyncio.current_task().cancelling():
+                raise JobCancelled(self.id) from None
+            self.cancel()
+            raise
+        except BrokenProcessPool:
+            self.cancel()
+            _reset_broken_pool(pool)
+            raise
+        except BaseException:
+            self.cancel()
+            raise
+
+def day_chunks(start_day: date, end_day: date, days: int = ANALYTICS_CHUNK_DAYS) -> List[Tuple[date, date]]:
+    chunks = []
+    while start_day <= end_day:
+        chunk_end = min(start_day + timedelta(days=days - 1), end_day)
+        chunks.append((start_day, chunk_end))
+        start_day = chunk_end + timedelta(days=1)
+    return chunks
+
+def summarize_sales_chunk(start_day: date, end_day: date, token) -> Dict[str, Any]:
+    if token.is_set():
+        raise JobCancelled()
+    db = _session()
+    try:
+        return reports.summarize_sales(db, start_day, end_day)
+    finally:
+        db.close()
+
+async def sales_report(start_date: datetime, end_date: datetime, job: AnalyticsJob) -> Dict[str, Any]:
+    parts = await job.wait(asyncio.gather(*(
+        job.submit(summarize_sales_chunk, start_day, end_day)
+        for start_day, end_day in day_chunks(start_date.date(), end_date.date())
+    )))
+    return reports.build_sales_report(start_date, end_date, parts)
+
+def export_sales_chunk(path: str, first_id: int, last_id: int, filters: Dict[str, Any], token) -> int:
+    db = _session()
+    try:
+        with open(path, "wb") as out:
+            written = export.write_sales_csv(db, out, first_id, last_id, should_stop=token.is_set, **filters)
+    finally:
+        db.close()
+    if token.is_set():
+        raise JobCancelled()
+    return written
+
+def sales_csv(first_id: Optional[int], last_id: Optional[int], filters: Dict[str, Any],
+              job: AnalyticsJob) -> AsyncIterator[bytes]:
+    """Stream the CSV of the sales with ids from ``first_id`` to ``last_id``
+    matching ``filters`` (as for export.sales_export_statement), exported in
+    the pool.
+
+    The header is sent at once. Only EXPORT_PARTS_IN_FLIGHT parts per worker
+    are submitted ahead; the next one is submitted as each part is streamed,
+    so a slow client does not pile finished parts up on disk. Each part gets
+    ANALYTICS_TIMEOUT_SECONDS; one that takes longer cuts the download short.
+    """
+    ranges = []
+    if first_id is not None:
+        ranges = [(low, min(low + EXPORT_CHUNK_IDS - 1, last_id))
+                  for low in range(first_id, last_id + 1, EXPORT_CHUNK_IDS)]
+    return _stream_parts(ranges, filters, job)
+
+async def _stream_parts(ranges: List[Tuple[int, int]], filters: Dict[str, Any],
+                        job: AnalyticsJob) -> AsyncIterator[bytes]:
+    directory = tempfile.mkdtemp(prefix="pos-export-")
+    waiting = iter(ranges)
+    in_flight: deque = deque()
+
+    def submit_next():
+        low_high = next(waiting, None)
+        if low_high is not None:
+            path = os.path.join(directory, f"{low_high[0]}.csv")
+            in_flight.append((path, job.submit(export_sales_chunk, path, *low_high, filters)))
+
+    try:
+        yield export.csv_header(export.SALES_HEADERS)
+        for _ in range(max(1, EXPORT_PARTS_IN_FLIGHT * ANALYTICS_WORKERS)):
+            submit_next()
+        while in_flight:
+            path, future = in_flight.popleft()
+            await job.wait(future, ANALYTICS_TIMEOUT_SECONDS)
+            submit_next()
+            with open(path, "rb") as part:
+                while True:
+                    data = await asyncio.to_thread(part.read, 1 << 20)
+                    if not data:
+                        break
+                    yield data
+            os.remove(path)
+    finally:
+        # Also when the client goes away mid-download
+        job.cancel()
+        shutil.rmtree(directory, ignore_errors=True)
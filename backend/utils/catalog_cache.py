@@ -0,0 +1,60 @@
+from collections import OrderedDict
+from typing import Hashable, NamedTuple, Optional, Tuple
+import hashlib
+import os
+import threading
+
+CATALOG_CACHE_SIZE = int(os.getenv("CATALOG_CACHE_SIZE", "256"))
+
+# Pages are keyed by the catalog and stock versions (utils.versions), read
+# before the page itself, so a write committed by any worker process moves
+# every process on to new keys and ETags.
+
+class CachedPage(NamedTuple):
+    etag: str
+    body: bytes
+    next_cursor: Optional[str] = None
+    prev_cursor: Optional[str] = None
+
+# (catalog version, stock version); both only grow
+CatalogVersion = Tuple[int, int]
+
+_cache: "OrderedDict[Tuple[CatalogVersion, Hashable], CachedPage]" = OrderedDict()
+_lock = threading.Lock()
+# The newest version seen; pages of older versions are dropped
+_version: CatalogVersion = (0, 0)
+
+def _observe(version: CatalogVersion):
+    global _version
+    if version > _version:
+        _version = version
+        _cache.clear()
+
+def etag_for(version: CatalogVersion, key: Hashable) -> str:
+    digest = hashlib.sha1(repr(key).encode("utf-8")).hexdigest()[:16]
+    return f'"{version[0]}.{version[1]}-{digest}"'
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def get(version: CatalogVersion, key: Hashable) -> Optional[CachedPage]:
+    with _lock:
+        _observe(version)
+        page = _cache.get((version, key))
+        if page is not None:
+            _cache.move_to_end((version, key))
+        return page
+
+def put(version: CatalogVersion, key: Hashable, page: CachedPage):
+    with _lock:
+        # A newer version was seen while this page was read; nobody asks for
+        # this one any more
+        _observe(version)
+        if version != _version:
+            return
+        _cache[(version, key)] = page
+        while len(_cache) > CATALOG_CACHE_SIZE:
+            _cache.popitem(last=False)
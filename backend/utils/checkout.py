@@ -0,0 +1,432 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from fastapi import HTTPException, status
+from sqlalchemy import case, insert, select, update
+from sqlalchemy.orm import Session, selectinload
+from sqlalchemy.orm.attributes import set_committed_value
+
+from .. import models
+from .. import schemas
+from . import inventory, rollups, stock_stripes, versions
+
+BATCH_CHUNK_SIZE = 500
+# Key in the session's info counting the batch sales replayed one at a time
+REPLAYED_SALES = "replayed_sales"
+
+
+def aggregate_quantities(items: Iterable[schemas.SaleItemCreate]) -> Dict[int, int]:
+    # The same product may appear on several lines of a basket
+    quantities: Dict[int, int] = {}
+    for item in items:
+        quantities[item.product_id] = quantities.get(item.product_id, 0) + item.quantity
+    return quantities
+
+
+def load_products(db: Session, product_ids: Iterable[int]) -> Dict[int, models.Product]:
+    ids = set(product_ids)
+    if not ids:
+        return {}
+    products = db.query(models.Product).filter(models.Product.id.in_(ids)).all()
+    return {product.id: product for product in products}
+
+
+def insert_returning_ids(db: Session, model, rows: List[Dict]) -> List[int]:
+    """Insert ``rows`` into ``model``'s table in as few statements as the
+    dialect batches them into, and return the new ids in the order of the rows."""
+    if db.get_bind().dialect.name != "sqlite":
+        return db.scalars(insert(model).returning(model.id, sort_by_parameter_order=True), rows).all()
+    # SQLAlchemy can only keep RETURNING in parameter order on SQLite by
+    # running one INSERT per row. SQLite gives each new row the largest id
+    # so far plus one, and writers take turns, so the ids of a batch ascend
+    # in row order and sorting them restores it
+    return sorted(db.scalars(insert(model).returning(model.id), rows).all())
+
+
+def reserve_stock(
+    db: Session,
+    products: Dict[int, models.Product],
+    quantities: Dict[int, int],
+    now: datetime
+) -> List[int]:
+    """Decrement stock for every product in ``quantities`` with one conditional UPDATE.
+
+    The ``stock >= quantity`` guard is evaluated by the database on the row it
+    updates, so concurrent checkouts cannot oversell. Returns the ids of the
+    products that could not be decremented; if it is not empty the caller must
+    roll back, as the other rows have already been updated.
+    """
+    if not quantities:
+        return []
+
+    delta = case(quantities, value=models.Product.id)
+    stmt = (
+        update(models.Product)
+        .where(models.Product.id.in_(quantities.keys()), models.Product.stock >= delta)
+        .values(stock=models.Product.stock - delta, updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+    if db.get_bind().dialect.update_returning:
+        rows = db.execute(stmt.returning(models.Product.id, models.Product.stock)).all()
+        new_stock = {row.id: row.stock for row in rows}
+    else:
+        result = db.execute(stmt)
+        if result.rowcount != len(quantities):
+            # Without RETURNING we cannot tell which rows matched; report the
+            # products that were already short when loaded, or all of them.
+            short = [
+                product_id for product_id, quantity in quantities.items()
+                if (products[product_id].stock or 0) < quantity
+            ]
+            return short or list(quantities)
+        new_stock = {
+            product_id: products[product_id].stock - quantity
+            for product_id, quantity in quantities.items()
+        }
+
+    # Keep the loaded objects in step with the database without marking them dirty
+    for product_id in new_stock:
+        set_committed_value(products[product_id], "stock", new_stock[product_id])
+        set_committed_value(products[product_id], "updated_at", now)
+
+    return [product_id for product_id in quantities if product_id not in new_stock]
+
+
+def _take_stock(
+    db: Session,
+    products: Dict[int, models.Product],
+    quantities: Dict[int, int],
+    now: datetime
+) -> List[int]:
+    # Striped products are decremented on one of their stripes, the rest with reserve_stock
+    striped = {
+        product_id: quantity for product_id, quantity in quantities.items() if products[product_id].stock_stripes
+    }
+    if not striped:
+        return reserve_stock(db, products, quantities, now)
+    plain = {product_id: quantity for product_id, quantity in quantities.items() if product_id not in striped}
+    # Their full stock was read for the pre-check; a rebalance resets the loaded value
+    before = {product_id: products[product_id].stock for product_id in striped}
+    short = reserve_stock(db, products, plain, now) + stock_stripes.take_stock(db, products, striped)
+    for product_id, quantity in striped.items():
+        set_committed_value(products[product_id], "stock", before[product_id] - quantity)
+    return short
+
+
+def release_stock(db: Session, quantities: Dict[int, int], now: datetime):
+    # Put stock back with one UPDATE; there is no upper bound to check
+    if not quantities:
+        return
+    db.execute(
+        update(models.Product)
+        .where(models.Product.id.in_(quantities.keys()))
+        .values(stock=models.Product.stock + case(quantities, value=models.Product.id), updated_at=now)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def create_sale(
+    db: Session,
+    sale: schemas.SaleCreate,
+    user_id: int,
+    now: Optional[datetime] = None
+) -> models.Sale:
+    """Validate a basket, reserve its stock and insert the sale and its items.
+
+    Products are loaded and decremented, and the items inserted, with one
+    statement each whatever the basket size, and nothing is committed. The returned sale has its items and
+    their products attached, so it can be serialised without going back to the
+    database. In ledger mode (see utils.inventory) the stock is taken by
+    appending movements once the sale has an id, and checked after.
+    """
+    now = now or datetime.utcnow()
+
+    # Validate items
+    if not sale.items:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Sale must have at least one item"
+        )
+
+    # Validate customer exists if provided
+    if sale.customer_id:
+        customer = db.query(models.Customer.id).filter(models.Customer.id == sale.customer_id).first()
+        if not customer:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Customer not found"
+            )
+
+    quantities = aggregate_quantities(sale.items)
+    products = load_products(db, quantities.keys())
+    for item in sale.items:
+        if item.product_id not in products:
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail=f"Product with id {item.product_id} not found"
+            )
+
+    ledger = inventory.ledger_enabled()
+    inventory.apply_current_stock(db, products.values())
+
+    # Reject baskets that are already short before touching any row
+    for product_id, quantity in quantities.items():
+        product = products[product_id]
+        if (product.stock or 0) < quantity:
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail=f"Insufficient stock for product {product.name}"
+            )
+
+    # Calculate total
+    total_amount = Decimal('0')
+    for item in sale.items:
+        total_amount += Decimal(str(products[item.product_id].price)) * item.quantity
+
+    if not ledger:
+        _raise_if_short(products, _take_stock(db, products, quantities, now))
+
+    db_sale = models.Sale(
+        customer_id=sale.customer_id,
+        user_id=user_id,
+        total_amount=float(total_amount),
+        status="completed",
+        created_at=now,
+        updated_at=None
+    )
+    db.add(db_sale)
+    db.flush()
+
+    # Plain rows in one executemany skip the unit of work's per-object flush
+    # bookkeeping. The items are read back with a SELECT rather than
+    # RETURNING because SQLite returns whole REAL prices from RETURNING as
+    # integers (4, not 4.0), which would change the response
+    db.execute(
+        insert(models.SaleItem),
+        [
+            {
+                "sale_id": db_sale.id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "price": products[item.product_id].price,
+                "created_at": now,
+            }
+            for item in sale.items
+        ]
+    )
+    items = db.scalars(
+        select(models.SaleItem).where(models.SaleItem.sale_id == db_sale.id).order_by(models.SaleItem.id)
+    ).all()
+    for item in items:
+        set_committed_value(item, "product", products[item.product_id])
+    set_committed_value(db_sale, "items", items)
+
+    if ledger:
+        _raise_if_short(products, inventory.take_stock(db, products, [
+            inventory.movement(product_id, -quantity, inventory.SALE, now, db_sale.id)
+            for product_id, quantity in quantities.items()
+        ]))
+
+    rollups.record_sales(db, [db_sale])
+    versions.record_change(db, versions.STOCK)
+    return db_sale
+
+
+def _raise_if_short(products: Dict[int, models.Product], short: List[int]):
+    if short:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Insufficient stock for product {products[short[0]].name}"
+        )
+
+
+def record_status_change(db: Session, sale_id: int, new_status: Optional[str], now: datetime):
+    """Log a sale's new status, or its deletion with ``new_status=None``, in
+    the transaction making the change."""
+    db.execute(insert(models.SaleStatusChange).values(sale_id=sale_id, status=new_status, created_at=now))
+
+def delete_sale(db: Session, sale_id: int) -> Optional[models.Sale]:
+    """Delete a sale and return its stock. Returns None if there is no such sale."""
+    sale = db.query(models.Sale).options(
+        selectinload(models.Sale.items)
+    ).filter(models.Sale.id == sale_id).first()
+    if sale is None:
+        return None
+
+    now = datetime.utcnow()
+    quantities = aggregate_quantities(sale.items)
+    if inventory.ledger_enabled():
+        inventory.record_movements(db, [
+            inventory.movement(product_id, quantity, inventory.VOID, now, sale.id)
+            for product_id, quantity in quantities.items()
+        ])
+    else:
+        release_stock(db, quantities, now)
+    rollups.record_sales(db, [sale], sign=-1)
+    versions.record_change(db, versions.STOCK)
+    record_status_change(db, sale.id, None, now)
+    db.delete(sale)
+    return sale
+
+
+def _batch_failure(index: int, detail: str) -> schemas.SaleBatchItemResult:
+    return schemas.SaleBatchItemResult(index=index, success=False, error=detail)
+
+
+def _ingest_chunk(
+    db: Session,
+    chunk: Sequence[Tuple[int, schemas.SaleCreate]],
+    user_id: int,
+    now: datetime
+) -> Optional[List[schemas.SaleBatchItemResult]]:
+    # Everything the chunk refers to is fetched once up front
+    products = load_products(db, {item.product_id for _, sale in chunk for item in sale.items})
+    customer_ids = {sale.customer_id for _, sale in chunk if sale.customer_id}
+    customers = set()
+    if customer_ids:
+        customers = {
+            row.id for row in db.query(models.Customer.id).filter(models.Customer.id.in_(customer_ids))
+        }
+
+    ledger = inventory.ledger_enabled()
+    inventory.apply_current_stock(db, products.values())
+    available = {product_id: product.stock or 0 for product_id, product in products.items()}
+
+    # Validate sales in order against the stock left by the ones accepted before them
+    results: Dict[int, schemas.SaleBatchItemResult] = {}
+    accepted = []
+    for index, sale in chunk:
+        quantities = aggregate_quantities(sale.items)
+        missing = [item.product_id for item in sale.items if item.product_id not in products]
+        short = [product_id for product_id, quantity in quantities.items()
+                 if not missing and available[product_id] < quantity]
+        if not sale.items:
+            results[index] = _batch_failure(index, "Sale must have at least one item")
+        elif sale.customer_id and sale.customer_id not in customers:
+            results[index] = _batch_failure(index, "Customer not found")
+        elif missing:
+            results[index] = _batch_failure(index, f"Product with id {missing[0]} not found")
+        elif short:
+            results[index] = _batch_failure(index, f"Insufficient stock for product {products[short[0]].name}")
+        else:
+            for product_id, quantity in quantities.items():
+                available[product_id] -= quantity
+            accepted.append((index, sale))
+
+    if not accepted:
+        return [results[index] for index, _ in chunk]
+
+    totals: Dict[int, int] = {}
+    for _, sale in accepted:
+        for product_id, quantity in aggregate_quantities(sale.items).items():
+            totals[product_id] = totals.get(product_id, 0) + quantity
+    if not ledger and _take_stock(db, products, totals, now):
+        # Stock moved between the read and the update; let the caller fall back
+        return None
+
+    totals_by_sale = [
+        float(sum(
+            (Decimal(str(products[item.product_id].price)) * item.quantity for item in sale.items),
+            Decimal('0')
+        ))
+        for _, sale in accepted
+    ]
+    sale_ids = insert_returning_ids(db, models.Sale, [
+        {
+            "customer_id": sale.customer_id,
+            "user_id": user_id,
+            "total_amount": total_amount,
+            "status": "completed",
+            "created_at": now,
+        }
+        for (_, sale), total_amount in zip(accepted, totals_by_sale)
+    ])
+    db.execute(
+        insert(models.SaleItem),
+        [
+            {
+                "sale_id": sale_id,
+                "product_id": item.product_id,
+                "quantity": item.quantity,
+                "price": products[item.product_id].price,
+                "created_at": now,
+            }
+            for (_, sale), sale_id in zip(accepted, sale_ids)
+            for item in sale.items
+        ]
+    )
+
+    if ledger and inventory.take_stock(db, products, [
+        inventory.movement(product_id, -quantity, inventory.SALE, now, sale_id)
+        for (_, sale), sale_id in zip(accepted, sale_ids)
+        for product_id, quantity in aggregate_quantities(sale.items).items()
+    ]):
+        return None
+
+    delta = rollups.RollupDelta()
+    for (_, sale), total_amount in zip(accepted, totals_by_sale):
+        delta.add(
+            now,
+            total_amount,
+            [(item.product_id, item.quantity, products[item.product_id].price) for item in sale.items]
+        )
+    delta.apply(db)
+    versions.record_change(db, versions.STOCK)
+
+    for (index, _), sale_id in zip(accepted, sale_ids):
+        results[index] = schemas.SaleBatchItemResult(index=index, success=True, sale_id=sale_id)
+    return [results[index] for index, _ in chunk]
+
+
+def _ingest_one_by_one(
+    db: Session,
+    chunk: Sequence[Tuple[int, schemas.SaleCreate]],
+    user_id: int,
+    now: datetime
+) -> List[schemas.SaleBatchItemResult]:
+    results = []
+    for index, sale in chunk:
+        try:
+            with db.begin_nested():
+                db_sale = create_sale(db, sale, user_id, now)
+            results.append(schemas.SaleBatchItemResult(index=index, success=True, sale_id=db_sale.id))
+        except HTTPException as e:
+            results.append(_batch_failure(index, e.detail))
+    return results
+
+
+def create_sales_batch(
+    db: Session,
+    sales: Sequence[schemas.SaleCreate],
+    user_id: int,
+    chunk_size: int = BATCH_CHUNK_SIZE
+) -> List[schemas.SaleBatchItemResult]:
+    """Ingest many sales, committing one transaction per chunk.
+
+    Each chunk loads its products and customers once, reserves the stock of all
+    accepted sales with a single conditional UPDATE and bulk-inserts the sale
+    and item rows. A sale that fails validation is reported and skipped without
+    affecting the rest of its chunk. If stock changed concurrently between the
+    read and the update, the chunk is replayed one sale at a time, and the
+    sales replayed are counted in ``db.info[REPLAYED_SALES]``. In ledger
+    mode the stock is taken by appending movements instead of the UPDATE.
+    """
+    indexed = list(enumerate(sales))
+    results: List[schemas.SaleBatchItemResult] = []
+    for start in range(0, len(indexed), chunk_size):
+        chunk = indexed[start:start + chunk_size]
+        now = datetime.utcnow()
+        try:
+            chunk_results = _ingest_chunk(db, chunk, user_id, now)
+            if chunk_results is None:
+                db.rollback()
+                db.info[REPLAYED_SALES] = db.info.get(REPLAYED_SALES, 0) + len(chunk)
+                chunk_results = _ingest_one_by_one(db, chunk, user_id, now)
+            db.commit()
+        except Exception:
+            db.rollback()
+            chunk_results = [_batch_failure(index, "Error creating sale") for index, _ in chunk]
+        results.extend(chunk_results)
+    return results
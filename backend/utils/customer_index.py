@@ -0,0 +1,124 @@
+from bisect import bisect_left, insort
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+import re
+import threading
+
+LOOKUP_LIMIT_MAX = 50
+
+class CustomerEntry(NamedTuple):
+    id: int
+    name: str
+    email: Optional[str]
+    phone: Optional[str]
+
+def normalize_phone(phone: str) -> str:
+    return re.sub(r"\D", "", phone)
+
+def _phone_keys(phone: str) -> List[str]:
+    # Numbers are stored with or without the +1 country code the validator
+    # allows; index the national number too so local digits match either way
+    digits = normalize_phone(phone)
+    if len(digits) == 11 and digits.startswith("1"):
+        return [digits, digits[1:]]
+    return [digits] if digits else []
+
+def _name_keys(name: str) -> List[str]:
+    # The whole name plus each word, so "smi" finds "John Smith"
+    name = name.lower().strip()
+    words = name.split()
+    return [name] + words[1:] if len(words) > 1 else [name]
+
+class CustomerIndex:
+    """Sorted-array prefix indexes over customer names, emails and phone
+    numbers, kept in memory so till lookups do not search the database.
+
+    Each index is a sorted list of (key, customer id); a prefix is located
+    with one bisect and the matches are the run of keys that follow it.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[int, CustomerEntry] = {}
+        self._keys: Dict[str, List[Tuple[str, int]]] = {"name": [], "email": [], "phone": []}
+        # The customers version (utils.versions) the index was built at, or
+        # None before the first load, and the newest change event it has seen
+        self.version: Optional[int] = None
+        self.last_event_id = 0
+
+    def _entry_keys(self, entry: CustomerEntry) -> Iterable[Tuple[str, str]]:
+        for key in _name_keys(entry.name):
+            yield "name", key
+        if entry.email:
+            yield "email", entry.email.lower()
+        if entry.phone:
+            for key in _phone_keys(entry.phone):
+                yield "phone", key
+
+    def load(self, entries: Iterable[CustomerEntry], version: int, last_event_id: int = 0):
+        """Replace the index with ``entries``, read from the database after
+        ``version`` was. Kept if a newer version was loaded meanwhile."""
+        entries = list(entries)
+        keys: Dict[str, List[Tuple[str, int]]] = {field: [] for field in self._keys}
+        for entry in entries:
+            for field, key in self._entry_keys(entry):
+                keys[field].append((key, entry.id))
+        for field_keys in keys.values():
+            field_keys.sort()
+
+        with self._lock:
+            if self.version is not None and self.version >= version:
+                return
+            self._entries = {entry.id: entry for entry in entries}
+            self._keys = keys
+            self.version = version
+            self.last_event_id = last_event_id
+
+    def apply(self, changes: Dict[int, Optional[CustomerEntry]], version: int, last_event_id: int):
+        """Bring the index to ``version`` by replacing the customers in
+        ``changes``, read after it was; None for those deleted."""
+        with self._lock:
+            if self.version is not None and self.version >= version:
+                return
+            for customer_id, entry in changes.items():
+                old = self._entries.pop(customer_id, None)
+                if old is not None:
+                    for field, key in self._entry_keys(old):
+                        keys = self._keys[field]
+                        position = bisect_left(keys, (key, customer_id))
+                        if position < len(keys) and keys[position] == (key, customer_id):
+                            del keys[position]
+                if entry is not None:
+                    self._entries[customer_id] = entry
+                    for field, key in self._entry_keys(entry):
+                        insort(self._keys[field], (key, customer_id))
+            self.version = version
+            self.last_event_id = last_event_id
+
+    def _prefix_ids(self, field: str, prefix: str, limit: int, seen: Dict[int, None]):
+        keys = self._keys[field]
+        position = bisect_left(keys, (prefix,))
+        while position < len(keys) and len(seen) < limit:
+            key, customer_id = keys[position]
+            if not key.startswith(prefix):
+                break
+            seen.setdefault(customer_id)
+            position += 1
+
+    def lookup(self, q: str, limit: int) -> List[CustomerEntry]:
+        """Customers whose phone, name (or any word of it) or email starts
+        with ``q``. Queries made only of digits and phone punctuation search
+        phone numbers; anything else searches names first, then emails."""
+        q = q.strip()
+        digits = normalize_phone(q)
+        seen: Dict[int, None] = {}
+        with self._lock:
+            if digits and re.fullmatch(r"[\d\s()+.-]+", q):
+                self._prefix_ids("phone", digits, limit, seen)
+            else:
+                prefix = q.lower()
+                if "@" not in prefix:
+                    self._prefix_ids("name", " ".join(prefix.split()), limit, seen)
+                self._prefix_ids("email", prefix, limit, seen)
+            return [self._entries[customer_id] for customer_id in seen]
+
+customer_index = CustomerIndex()
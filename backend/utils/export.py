@@ -1,9 +1,15 @@
 import csv
 from io import StringIO
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, AsyncIterator, BinaryIO, Callable, Iterable, Optional, Tuple
 from datetime import datetime
-from sqlalchemy.orm import Session
+from sqlalchemy import Select, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session, joinedload, selectinload
 from .. import models
+from . import inventory
+
+EXPORT_CHUNK_SIZE = 1000
+SALES_HEADERS = ['Sale ID', 'Date', 'Customer', 'Total Amount', 'Items']
 
 def export_to_csv(data: List[Dict[str, Any]], headers: List[str]) -> str:
     output = StringIO()
@@ -12,40 +18,119 @@ def export_to_csv(data: List[Dict[str, Any]], headers: List[str]) -> str:
     writer.writerows(data)
     return output.getvalue()
 
-def export_sales_to_csv(db: Session, 
-                        start_date: Optional[datetime] = None, 
-                        end_date: Optional[datetime] = None,
-                        customer_id: Optional[int] = None,
-                        product_id: Optional[int] = None) -> str:
-    query = db.query(models.Sale)
-    
+def _encode_rows(output: StringIO, writer: csv.DictWriter, rows: Iterable[Dict[str, Any]]) -> bytes:
+    writer.writerows(rows)
+    data = output.getvalue().encode('utf-8')
+    output.seek(0)
+    output.truncate()
+    return data
+
+def csv_header(headers: List[str]) -> bytes:
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=headers)
+    writer.writeheader()
+    return output.getvalue().encode('utf-8')
+
+def _sales_filters(start_date: Optional[datetime] = None,
+                   end_date: Optional[datetime] = None,
+                   customer_id: Optional[int] = None,
+                   product_id: Optional[int] = None) -> List[Any]:
+    criteria = []
     if start_date:
-        query = query.filter(models.Sale.created_at >= start_date)
+        criteria.append(models.Sale.created_at >= start_date)
     if end_date:
-        query = query.filter(models.Sale.created_at <= end_date)
+        criteria.append(models.Sale.created_at <= end_date)
     if customer_id:
-        query = query.filter(models.Sale.customer_id == customer_id)
+        criteria.append(models.Sale.customer_id == customer_id)
     if product_id:
-        query = query.join(models.Sale.items).filter(models.SaleItem.product_id == product_id)
+        criteria.append(models.Sale.items.any(models.SaleItem.product_id == product_id))
+    return criteria
 
-    sales = query.all()
-    
-    data = []
-    for sale in sales:
-        sale_data = {
-            'Sale ID': sale.id,
-            'Date': sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
-            'Customer': sale.customer.name if sale.customer else 'N/A',
-            'Total Amount': f"${sale.total_amount:.2f}",
-            'Items': ', '.join([f"{item.product.name} x{item.quantity}" for item in sale.items])
-        }
-        data.append(sale_data)
-    
-    headers = ['Sale ID', 'Date', 'Customer', 'Total Amount', 'Items']
-    return export_to_csv(data, headers)
+def sales_export_statement(start_date: Optional[datetime] = None,
+                           end_date: Optional[datetime] = None,
+                           customer_id: Optional[int] = None,
+                           product_id: Optional[int] = None) -> Select:
+    return select(models.Sale).options(
+        joinedload(models.Sale.customer),
+        selectinload(models.Sale.items).joinedload(models.SaleItem.product)
+    ).where(*_sales_filters(start_date, end_date, customer_id, product_id))
+
+def sales_id_range_statement(start_date: Optional[datetime] = None,
+                             end_date: Optional[datetime] = None,
+                             customer_id: Optional[int] = None,
+                             product_id: Optional[int] = None) -> Select:
+    # Bounds of the export, for splitting it into ranges of ids
+    return select(func.min(models.Sale.id), func.max(models.Sale.id)).where(
+        *_sales_filters(start_date, end_date, customer_id, product_id)
+    )
+
+def sale_csv_row(sale: models.Sale) -> Dict[str, Any]:
+    return {
+        'Sale ID': sale.id,
+        'Date': sale.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+        'Customer': sale.customer.name if sale.customer else 'N/A',
+        'Total Amount': f"${sale.total_amount:.2f}",
+        'Items': ', '.join([f"{item.product.name} x{item.quantity}" for item in sale.items])
+    }
+
+def _next_chunk(db: Session, stmt: Select, last_id: int, chunk_size: int) -> Tuple[List[Dict[str, Any]], int]:
+    """The CSV rows of the next ``chunk_size`` sales of ``stmt`` after
+    ``last_id``, walking the table in primary key order, and the id to
+    continue from. Every export reads its sales through here."""
+    sales = db.execute(
+        stmt.where(models.Sale.id > last_id).order_by(models.Sale.id).limit(chunk_size)
+    ).unique().scalars().all()
+    rows = [sale_csv_row(sale) for sale in sales]
+    # Drop the chunk from the identity map so it can be garbage collected
+    db.expunge_all()
+    return rows, sales[-1].id if sales else last_id
+
+def write_sales_csv(db: Session, out: BinaryIO, first_id: int, last_id: int,
+                    start_date: Optional[datetime] = None,
+                    end_date: Optional[datetime] = None,
+                    customer_id: Optional[int] = None,
+                    product_id: Optional[int] = None,
+                    should_stop: Callable[[], bool] = lambda: False,
+                    chunk_size: int = EXPORT_CHUNK_SIZE) -> int:
+    """Write the rows (no header) of the sales with ids from ``first_id`` to
+    ``last_id`` to ``out``; returns how many. ``should_stop`` is checked
+    between chunks."""
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=SALES_HEADERS)
+    stmt = sales_export_statement(start_date, end_date, customer_id, product_id).where(
+        models.Sale.id <= last_id
+    )
+    written, last = 0, first_id - 1
+    while not should_stop():
+        rows, last = _next_chunk(db, stmt, last, chunk_size)
+        if not rows:
+            break
+        out.write(_encode_rows(output, writer, rows))
+        written += len(rows)
+    return written
+
+async def aiter_sales_csv(db: AsyncSession,
+                          start_date: Optional[datetime] = None,
+                          end_date: Optional[datetime] = None,
+                          customer_id: Optional[int] = None,
+                          product_id: Optional[int] = None,
+                          chunk_size: int = EXPORT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """The whole export with its header, for request handlers using the
+    async session; chunks are read as in write_sales_csv."""
+    output = StringIO()
+    writer = csv.DictWriter(output, fieldnames=SALES_HEADERS)
+    yield csv_header(SALES_HEADERS)
+    stmt = sales_export_statement(start_date, end_date, customer_id, product_id)
+    last_id = 0
+    while True:
+        rows, last_id = await db.run_sync(_next_chunk, stmt, last_id, chunk_size)
+        if not rows:
+            break
+        yield _encode_rows(output, writer, rows)
 
 def export_invoices_to_csv(db: Session, start_date: datetime = None, end_date: datetime = None) -> str:
-    query = db.query(models.Invoice)
+    # The customer is read for every row; load it with the invoices
+    query = db.query(models.Invoice).options(joinedload(models.Invoice.customer))
     
     if start_date:
         query = query.filter(models.Invoice.created_at >= start_date)
@@ -74,6 +159,8 @@ def export_invoices_to_csv(db: Session, start_date: datetime = None, end_date: d
 
 def export_inventory_to_csv(db: Session) -> str:
     products = db.query(models.Product).all()
+    for start in range(0, len(products), EXPORT_CHUNK_SIZE):
+        inventory.apply_current_stock(db, products[start:start + EXPORT_CHUNK_SIZE])
     
     data = []
     for product in products:
@@ -0,0 +1,215 @@
+"""Append-only stock ledger.
+
+With INVENTORY_MODE=ledger, sales, voids, receipts and adjustments append
+StockMovement rows instead of rewriting products.stock, so checkouts of a
+best-seller no longer queue on its row lock, and every change of stock is on
+record. A product's current stock is products.stock, plus its stock
+stripes if it has any (see utils.stock_stripes), plus the movements after
+its StockSnapshot; compact_ledger periodically folds that tail into
+products.stock and moves the snapshot forward, so reads stay short.
+
+In the default "column" mode checkouts update products.stock in place
+(utils.checkout.reserve_stock). Compaction runs on startup in either mode,
+so switching between them carries the stock over.
+
+    python -m backend.utils.inventory   # compact now
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+import asyncio
+import logging
+import os
+from sqlalchemy import case, delete, func, insert, select, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from .. import models
+
+INVENTORY_MODE = os.getenv("INVENTORY_MODE", "column")
+LEDGER_COMPACT_INTERVAL_SECONDS = int(os.getenv("LEDGER_COMPACT_INTERVAL_SECONDS", "30"))
+# Movements younger than this are left in the tail: on PostgreSQL ids are
+# handed out before commit, so a lower id may still become visible later
+LEDGER_COMPACT_GRACE_SECONDS = int(os.getenv("LEDGER_COMPACT_GRACE_SECONDS", "60"))
+COMPACT_CHUNK_SIZE = 500
+# First key of the advisory locks taken on products by ledger checkouts
+LEDGER_LOCK_SPACE = 1
+
+SALE, VOID, RECEIPT, ADJUSTMENT = "sale", "void", "receipt", "adjustment"
+
+logger = logging.getLogger(__name__)
+
+def ledger_enabled() -> bool:
+    return INVENTORY_MODE == "ledger"
+
+def movement(product_id: int, quantity: int, kind: str, now: datetime,
+             sale_id: Optional[int] = None) -> Dict:
+    return {"product_id": product_id, "quantity": quantity, "kind": kind, "sale_id": sale_id, "created_at": now}
+
+def record_movements(db: Session, movements: List[Dict]):
+    if movements:
+        db.execute(insert(models.StockMovement), movements)
+
+def stock_levels(db: Session, product_ids: Iterable[int]) -> Dict[int, int]:
+    """Current stock of the given products, read with one statement."""
+    ids = set(product_ids)
+    if not ids:
+        return {}
+    stripes = (
+        select(models.ProductStockStripe.product_id, func.sum(models.ProductStockStripe.stock).label("stock"))
+        .where(models.ProductStockStripe.product_id.in_(ids))
+        .group_by(models.ProductStockStripe.product_id)
+        .subquery()
+    )
+    movements = models.StockMovement
+    tail = (
+        select(movements.product_id, func.sum(movements.quantity).label("quantity"))
+        .outerjoin(models.StockSnapshot, models.StockSnapshot.product_id == movements.product_id)
+        .where(
+            movements.product_id.in_(ids),
+            movements.id > func.coalesce(models.StockSnapshot.last_movement_id, 0)
+        )
+        .group_by(movements.product_id)
+        .subquery()
+    )
+    rows = db.execute(
+        select(models.Product.id, models.Product.stock, stripes.c.stock.label("striped"), tail.c.quantity)
+        .outerjoin(stripes, stripes.c.product_id == models.Product.id)
+        .outerjoin(tail, tail.c.product_id == models.Product.id)
+        .where(models.Product.id.in_(ids))
+    )
+    return {row.id: (row.stock or 0) + (row.striped or 0) + (row.quantity or 0) for row in rows}
+
+def apply_stock_levels(db: Session, products: Iterable[models.Product]) -> Dict[int, int]:
+    """Set the stock of loaded products to their current level, without
+    marking them dirty."""
+    products = list(products)
+    levels = stock_levels(db, (product.id for product in products))
+    for product in products:
+        if product.id in levels:
+            set_committed_value(product, "stock", levels[product.id])
+    return levels
+
+def apply_current_stock(db: Session, products: Iterable[models.Product]):
+    """Like apply_stock_levels, for the products whose products.stock is not
+    their whole stock: all of them in ledger mode, else the striped ones."""
+    products = [product for product in products if ledger_enabled() or product.stock_stripes]
+    if products:
+        apply_stock_levels(db, products)
+
+def take_stock(db: Session, products: Dict[int, models.Product], movements: List[Dict]) -> List[int]:
+    """Append ``movements`` and return the ids of the products they left
+    below zero; if it is not empty the caller must roll back.
+
+    Together with the rollup deltas (see utils.rollups) a ledger checkout
+    only inserts rows and updates no product row. On PostgreSQL the foreign
+    keys take a key-share lock on the product row, which neither other
+    inserts nor plain product updates conflict with. The check after the
+    insert only sees the movements committed before it, so there checkouts
+    first take a transaction-level advisory lock on each of their products:
+    checkouts of the same product queue on it until commit, and two of them
+    can no longer both take its last units. SQLite runs one writer at a
+    time, so there the check is exact as it is.
+    """
+    product_ids = {m["product_id"] for m in movements}
+    if db.get_bind().dialect.name == "postgresql":
+        _lock_products(db, product_ids)
+    record_movements(db, movements)
+    levels = apply_stock_levels(db, (products[product_id] for product_id in product_ids))
+    return [product_id for product_id, level in levels.items() if level < 0]
+
+def _lock_products(db: Session, product_ids: Iterable[int]):
+    # In id order, so baskets sharing products cannot deadlock; the sorted
+    # subquery makes the locks be taken in that order
+    ordered = (
+        select(models.Product.id).where(models.Product.id.in_(set(product_ids))).order_by(models.Product.id)
+        .subquery()
+    )
+    db.execute(select(func.pg_advisory_xact_lock(LEDGER_LOCK_SPACE, ordered.c.id)))
+
+def compact_ledger(db: Session, grace_seconds: int = LEDGER_COMPACT_GRACE_SECONDS,
+                   now: Optional[datetime] = None) -> int:
+    """Fold the movements older than ``grace_seconds`` into products.stock
+    and the snapshots. Movements are kept. Returns how many products moved;
+    the caller commits."""
+    now = now or datetime.utcnow()
+    movements = models.StockMovement
+    high = db.scalar(
+        select(func.max(movements.id)).where(movements.created_at <= now - timedelta(seconds=grace_seconds))
+    )
+    # Every compaction folds all products up to its watermark, so nothing at
+    # or below the highest snapshot is left to fold
+    low = db.scalar(select(func.max(models.StockSnapshot.last_movement_id))) or 0
+    if high is None or high <= low:
+        return 0
+
+    deltas = {
+        row.product_id: row.quantity for row in db.execute(
+            select(movements.product_id, func.sum(movements.quantity).label("quantity"))
+            .where(movements.id > low, movements.id <= high)
+            .group_by(movements.product_id)
+        )
+    }
+    product_ids = sorted(deltas)
+    for start in range(0, len(product_ids), COMPACT_CHUNK_SIZE):
+        chunk = {product_id: deltas[product_id] for product_id in product_ids[start:start + COMPACT_CHUNK_SIZE]}
+        db.execute(
+            update(models.Product)
+            .where(models.Product.id.in_(chunk.keys()))
+            .values(stock=models.Product.stock + case(chunk, value=models.Product.id), updated_at=now)
+            .execution_options(synchronize_session=False)
+        )
+        stock = dict(db.execute(
+            select(models.Product.id, models.Product.stock).where(models.Product.id.in_(chunk.keys()))
+        ).all())
+        db.execute(
+            delete(models.StockSnapshot)
+            .where(models.StockSnapshot.product_id.in_(chunk.keys()))
+            .execution_options(synchronize_session=False)
+        )
+        db.execute(
+            insert(models.StockSnapshot),
+            [
+                {"product_id": product_id, "quantity": stock[product_id], "last_movement_id": high, "taken_at": now}
+                for product_id in chunk
+            ]
+        )
+    return len(product_ids)
+
+def run_compaction(grace_seconds: int = LEDGER_COMPACT_GRACE_SECONDS) -> int:
+    from ..database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        compacted = compact_ledger(db, grace_seconds)
+        db.commit()
+        return compacted
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+def compact_on_startup() -> int:
+    # Outside ledger mode nothing reads the tail, so all of it is folded
+    return run_compaction(LEDGER_COMPACT_GRACE_SECONDS if ledger_enabled() else 0)
+
+async def compact_periodically(interval: int = LEDGER_COMPACT_INTERVAL_SECONDS):
+    from fastapi.concurrency import run_in_threadpool
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(run_compaction)
+        except Exception:
+            logger.exception("stock ledger compaction failed")
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import create_tables
+
+    parser = argparse.ArgumentParser(description="Fold the stock ledger into products.stock and the snapshots")
+    parser.add_argument("--grace", type=int, default=0,
+                        help="leave movements younger than this many seconds in the tail")
+    args = parser.parse_args()
+
+    create_tables()
+    print(f"Compacted the stock of {run_compaction(args.grace)} products.")
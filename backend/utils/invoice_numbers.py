@@ -0,0 +1,67 @@
+from datetime import date, datetime
+from typing import List, Optional
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from ..database import engine
+from .. import models
+import os
+import threading
+
+# Numbers reserved per round trip to the counter table. A process that exits
+# leaves the rest of its block unused, so numbers are monotonic per day but
+# may have gaps.
+INVOICE_NUMBER_BLOCK = int(os.getenv("INVOICE_NUMBER_BLOCK", "100"))
+
+def format_invoice_number(day: date, value: int) -> str:
+    # Zero padded so numbers of the same day sort in the order they were issued
+    return f"INV-{day.strftime('%Y%m%d')}-{value:06d}"
+
+def reserve_block(day: date, size: int) -> int:
+    """Reserve ``size`` numbers for ``day`` and return the first one.
+
+    Runs in its own short transaction, so the reservation holds whatever
+    happens to the caller's transaction, and concurrent reservations only
+    wait for each other for the duration of one UPDATE.
+    """
+    counter = models.InvoiceCounter
+    while True:
+        with engine.begin() as connection:
+            result = connection.execute(
+                update(counter).where(counter.day == day).values(last_value=counter.last_value + size)
+            )
+            if result.rowcount:
+                last_value = connection.scalar(select(counter.last_value).where(counter.day == day))
+                return last_value - size + 1
+            try:
+                connection.execute(insert(counter).values(day=day, last_value=size))
+                return 1
+            except IntegrityError:
+                # Another process created the day's row first; take a block from it
+                pass
+
+class InvoiceNumberAllocator:
+    def __init__(self, block_size: int = INVOICE_NUMBER_BLOCK):
+        self.block_size = block_size
+        self._lock = threading.Lock()
+        self._day: Optional[date] = None
+        self._next = 0
+        self._end = 0
+
+    def allocate(self, count: int = 1, now: Optional[datetime] = None) -> List[str]:
+        """Return ``count`` invoice numbers, reserving from the counter table
+        only when the local block runs out or the day changes."""
+        day = (now or datetime.utcnow()).date()
+        numbers = []
+        with self._lock:
+            if day != self._day:
+                self._day, self._next, self._end = day, 0, 0
+            while len(numbers) < count:
+                if self._next >= self._end:
+                    size = max(self.block_size, count - len(numbers))
+                    self._next = reserve_block(day, size)
+                    self._end = self._next + size
+                numbers.append(format_invoice_number(day, self._next))
+                self._next += 1
+        return numbers
+
+invoice_numbers = InvoiceNumberAllocator()
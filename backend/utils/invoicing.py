@@ -0,0 +1,182 @@
+from datetime import datetime
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from fastapi import HTTPException, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy import insert, literal, select
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from .. import models
+from .. import schemas
+from .checkout import insert_returning_ids
+from .invoice_numbers import invoice_numbers
+
+# Keeps IN lists well below the bound parameter limits of every backend
+INVOICE_CHUNK_SIZE = 500
+ALREADY_INVOICED = "Sale already invoiced"
+
+async def allocate_invoice_numbers(count: int = 1) -> List[str]:
+    # Reserving a block runs its own transaction on the sync engine; keep it
+    # off the event loop
+    return await run_in_threadpool(invoice_numbers.allocate, count)
+
+async def generate_invoice_number() -> str:
+    return (await allocate_invoice_numbers())[0]
+
+def _chunks(values: Sequence) -> Iterable[Sequence]:
+    for start in range(0, len(values), INVOICE_CHUNK_SIZE):
+        yield values[start:start + INVOICE_CHUNK_SIZE]
+
+def _load_sales(db: Session, sale_ids: Sequence[int]) -> Dict[int, Row]:
+    sales = {}
+    for chunk in _chunks(sale_ids):
+        rows = db.execute(
+            select(models.Sale.id, models.Sale.customer_id, models.Sale.total_amount, models.Sale.status)
+            .where(models.Sale.id.in_(chunk))
+        )
+        sales.update((row.id, row) for row in rows)
+    return sales
+
+def _invoiced_sale_ids(db: Session, sale_ids: Sequence[int]) -> Set[int]:
+    invoiced = set()
+    for chunk in _chunks(sale_ids):
+        invoiced.update(db.scalars(
+            select(models.Invoice.sale_id).where(
+                models.Invoice.sale_id.in_(chunk),
+                models.Invoice.status != "cancelled"
+            )
+        ))
+    return invoiced
+
+def _invoice_error(sale: Optional[Row], invoiced: Set[int]) -> Optional[str]:
+    if sale is None:
+        return "Sale not found"
+    if sale.status == "cancelled":
+        return "Cannot invoice a cancelled sale"
+    if sale.id in invoiced:
+        return ALREADY_INVOICED
+    return None
+
+def _insert_invoices(db: Session, rows: List[dict]) -> List[int]:
+    # Batched with RETURNING as in checkout._ingest_chunk. The unique index
+    # on open invoices' sale_id turns a sale invoiced concurrently since
+    # _invoiced_sale_ids into an IntegrityError
+    return insert_returning_ids(db, models.Invoice, rows)
+
+def _copy_sale_items(db: Session, invoice_ids: Sequence[int], now: datetime):
+    # The invoice lines are the sale lines: copy them with one INSERT ... SELECT
+    for chunk in _chunks(invoice_ids):
+        db.execute(
+            insert(models.InvoiceItem.__table__).from_select(
+                ["invoice_id", "product_id", "quantity", "unit_price", "discount", "created_at"],
+                select(
+                    models.Invoice.id,
+                    models.SaleItem.product_id,
+                    models.SaleItem.quantity,
+                    models.SaleItem.price,
+                    literal(0.0),
+                    literal(now)
+                )
+                .join(models.Invoice, models.Invoice.sale_id == models.SaleItem.sale_id)
+                .where(models.Invoice.id.in_(chunk))
+            )
+        )
+
+def _invoice_row(sale: Row, invoice_number: str, user_id: int, tax_amount: Decimal,
+                 discount_amount: Decimal, payment_method: Optional[str], notes: Optional[str]) -> dict:
+    total_amount = Decimal(str(sale.total_amount)) + tax_amount - discount_amount
+    return {
+        "invoice_number": invoice_number,
+        "sale_id": sale.id,
+        "customer_id": sale.customer_id,
+        "user_id": user_id,
+        "total_amount": float(total_amount),
+        "tax_amount": float(tax_amount),
+        "discount_amount": float(discount_amount),
+        "payment_method": payment_method,
+        "notes": notes,
+        "status": "pending"
+    }
+
+def _invoiceable_sale(db: Session, sale_id: int) -> Row:
+    sale = _load_sales(db, [sale_id]).get(sale_id)
+    error = _invoice_error(sale, _invoiced_sale_ids(db, [sale_id]) if sale else set())
+    if error:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND if sale is None else status.HTTP_400_BAD_REQUEST,
+            detail=error
+        )
+    return sale
+
+def _insert_with_sale_items(db: Session, rows: List[dict]) -> List[int]:
+    invoice_ids = _insert_invoices(db, rows)
+    _copy_sale_items(db, invoice_ids, datetime.utcnow())
+    return invoice_ids
+
+async def create_invoice_from_sale(db: AsyncSession, sale_id: int, user_id: int,
+                                   invoice: schemas.InvoiceFromSale) -> int:
+    """Invoice a sale from its own line items and return the invoice id.
+    Issues a fixed number of statements whatever the size of the sale.
+    Does not commit."""
+    sale = await db.run_sync(_invoiceable_sale, sale_id)
+    row = _invoice_row(
+        sale, await generate_invoice_number(), user_id,
+        Decimal(str(invoice.tax_amount)), Decimal(str(invoice.discount_amount)),
+        invoice.payment_method, invoice.notes
+    )
+    return (await db.run_sync(_insert_with_sale_items, [row]))[0]
+
+def _check_batch(db: Session, sale_ids: List[int]) -> Tuple[Dict[int, schemas.InvoiceBatchItemResult], List[Row]]:
+    sales = _load_sales(db, sale_ids)
+    invoiced = _invoiced_sale_ids(db, list(sales))
+    results: Dict[int, schemas.InvoiceBatchItemResult] = {}
+    invoiceable = []
+    for sale_id in sale_ids:
+        sale = sales.get(sale_id)
+        error = _invoice_error(sale, invoiced)
+        if error:
+            results[sale_id] = schemas.InvoiceBatchItemResult(sale_id=sale_id, success=False, error=error)
+        else:
+            invoiceable.append(sale)
+    return results, invoiceable
+
+async def create_invoices_batch(db: AsyncSession, batch: schemas.InvoiceBatchCreate,
+                                user_id: int) -> List[schemas.InvoiceBatchItemResult]:
+    """Invoice many sales in one transaction. Sales that cannot be invoiced
+    are reported and skipped; the others are inserted with a constant number
+    of statements per chunk of sales. Commits."""
+    sale_ids = list(dict.fromkeys(batch.sale_ids))
+    results, invoiceable = await db.run_sync(_check_batch, sale_ids)
+    tax_rate = Decimal(str(batch.tax_rate))
+
+    rows = []
+    numbers = await allocate_invoice_numbers(len(invoiceable)) if invoiceable else []
+    for sale, invoice_number in zip(invoiceable, numbers):
+        tax_amount = (Decimal(str(sale.total_amount)) * tax_rate).quantize(Decimal("0.01"))
+        rows.append(_invoice_row(
+            sale, invoice_number, user_id, tax_amount, Decimal("0"), batch.payment_method, batch.notes
+        ))
+
+    if rows:
+        invoice_ids = await db.run_sync(_insert_with_sale_items, rows)
+        for row, invoice_id in zip(rows, invoice_ids):
+            results[row["sale_id"]] = schemas.InvoiceBatchItemResult(
+                sale_id=row["sale_id"],
+                success=True,
+                invoice_id=invoice_id,
+                invoice_number=row["invoice_number"]
+            )
+    await db.commit()
+
+    seen: Set[int] = set()
+    ordered = []
+    for sale_id in batch.sale_ids:
+        if sale_id in seen:
+            ordered.append(schemas.InvoiceBatchItemResult(sale_id=sale_id, success=False, error="Duplicate sale in batch"))
+        else:
+            seen.add(sale_id)
+            ordered.append(results[sale_id])
+    return ordered
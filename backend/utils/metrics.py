@@ -0,0 +1,157 @@
+"""Request and SQL metrics in the Prometheus text format.
+
+MetricsMiddleware times every HTTP request and labels it with the route
+template ("/sales/{sale_id}"), so label cardinality stays bounded. SQL
+statements are counted and timed through engine events into a per-request
+context variable, which follows the request into AsyncSession greenlets
+and threadpool calls.
+
+Metrics are updated on the event loop thread only, so the registry does
+not lock.
+"""
+from bisect import bisect_left
+from contextvars import ContextVar
+from time import perf_counter
+from typing import Dict, List, Optional, Sequence, Tuple
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SQL_COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 500)
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(str(value))}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [f"{self.name}{_labels(self.labelnames, labels)} {value}" for labels, value in self.values.items()]
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, labels: Tuple[str, ...] = (), amount: float = 1):
+        self.inc(labels, -amount)
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.documentation, self.labelnames = name, documentation, tuple(labelnames)
+        self.buckets = tuple(buckets)
+        # Per label set: a count per bucket (the last one is +Inf), then the sum
+        self.values: Dict[Tuple[str, ...], Tuple[List[int], List[float]]] = {}
+
+    def observe(self, labels: Tuple[str, ...], value: float):
+        entry = self.values.get(labels)
+        if entry is None:
+            entry = self.values[labels] = ([0] * (len(self.buckets) + 1), [0.0])
+        entry[0][bisect_left(self.buckets, value)] += 1
+        entry[1][0] += value
+
+    def samples(self) -> List[str]:
+        lines = []
+        for labels, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_labels(self.labelnames, labels, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_labels(self.labelnames, labels)} {total[0]}")
+            lines.append(f"{self.name}_count{_labels(self.labelnames, labels)} {cumulative}")
+        return lines
+
+REQUESTS = Counter("http_requests_total", "HTTP requests by route and status", ("method", "route", "status"))
+LATENCY = Histogram("http_request_duration_seconds", "HTTP request latency", ("method", "route"))
+IN_FLIGHT = Gauge("http_requests_in_flight", "HTTP requests being served", ("method",))
+SQL_STATEMENTS = Histogram(
+    "http_request_sql_statements", "SQL statements executed per request", ("method", "route"), SQL_COUNT_BUCKETS
+)
+SQL_TIME = Histogram("http_request_sql_duration_seconds", "Time spent in SQL per request", ("method", "route"))
+METRICS = [REQUESTS, LATENCY, IN_FLIGHT, SQL_STATEMENTS, SQL_TIME]
+
+class SQLStats:
+    __slots__ = ("statements", "seconds")
+
+    def __init__(self):
+        self.statements = 0
+        self.seconds = 0.0
+
+_sql_stats: ContextVar[Optional[SQLStats]] = ContextVar("sql_stats", default=None)
+
+def current_sql_stats() -> Optional[SQLStats]:
+    return _sql_stats.get()
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_started = perf_counter()
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    stats = _sql_stats.get()
+    if stats is not None:
+        stats.statements += 1
+        stats.seconds += perf_counter() - context._metrics_started
+
+def instrument_engine(engine: Engine):
+    """Count and time statements on ``engine`` (for an AsyncEngine, pass
+    its sync_engine)."""
+    if not event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+def render_metrics() -> str:
+    lines = []
+    for metric in METRICS:
+        lines.append(f"# HELP {metric.name} {metric.documentation}")
+        lines.append(f"# TYPE {metric.name} {metric.kind}")
+        lines.extend(metric.samples())
+    return "\n".join(lines) + "\n"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        status_code = [500]
+
+        async def send_with_status(message):
+            if message["type"] == "http.response.start":
+                status_code[0] = message["status"]
+            await send(message)
+
+        stats = SQLStats()
+        token = _sql_stats.set(stats)
+        IN_FLIGHT.inc((method,))
+        started = perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = perf_counter() - started
+            IN_FLIGHT.dec((method,))
+            _sql_stats.reset(token)
+            # The router stores the matched route in the scope
+            route = scope.get("route")
+            labels = (method, getattr(route, "path", "unmatched"))
+            REQUESTS.inc(labels + (str(status_code[0]),))
+            LATENCY.observe(labels, elapsed)
+            SQL_STATEMENTS.observe(labels, stats.statements)
+            SQL_TIME.observe(labels, stats.seconds)
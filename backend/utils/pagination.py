@@ -0,0 +1,80 @@
+import base64
+import json
+from typing import Any, List, Optional, Tuple
+
+from fastapi import HTTPException, Request, Response, status
+from sqlalchemy import Select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+def encode_cursor(key: int, direction: str) -> str:
+    raw = json.dumps({"k": key, "d": direction}, separators=(",", ":")).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[int, str]:
+    try:
+        data = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        key, direction = data["k"], data["d"]
+    except (ValueError, KeyError, TypeError):
+        key, direction = None, None
+    if not isinstance(key, int) or direction not in ("next", "prev"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Invalid cursor"
+        )
+    return key, direction
+
+async def paginate(
+    db: AsyncSession,
+    stmt: Select,
+    key_column: Any,
+    cursor: Optional[str],
+    limit: int,
+    skip: int = 0
+) -> Tuple[List[Any], Optional[str], Optional[str]]:
+    """Return one page of ``stmt`` plus the cursors of the pages around it.
+
+    Pages are located with ``key_column > key`` (or ``<`` going backwards) on
+    an indexed, unique, monotonically assigned column, so every page costs an
+    index seek plus ``limit`` rows however deep it is. ``skip`` is only honoured
+    on the first page for clients that still page by offset.
+    """
+    def key_of(row: Any) -> int:
+        return getattr(row, key_column.key)
+
+    async def fetch(page_stmt: Select) -> List[Any]:
+        result = await db.execute(page_stmt)
+        return list(result.unique().scalars().all())
+
+    if cursor is None:
+        rows = await fetch(stmt.order_by(key_column).offset(skip).limit(limit + 1))
+        next_cursor = encode_cursor(key_of(rows[limit - 1]), "next") if len(rows) > limit else None
+        return rows[:limit], next_cursor, None
+
+    key, direction = decode_cursor(cursor)
+    if direction == "next":
+        rows = await fetch(stmt.where(key_column > key).order_by(key_column).limit(limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        next_cursor = encode_cursor(key_of(rows[-1]), "next") if has_more else None
+        prev_cursor = encode_cursor(key_of(rows[0]), "prev") if rows else None
+    else:
+        rows = await fetch(stmt.where(key_column < key).order_by(key_column.desc()).limit(limit + 1))
+        has_more = len(rows) > limit
+        rows = rows[:limit][::-1]
+        prev_cursor = encode_cursor(key_of(rows[0]), "prev") if has_more else None
+        next_cursor = encode_cursor(key_of(rows[-1]), "next") if rows else None
+    return rows, next_cursor, prev_cursor
+
+def set_link_header(
+    request: Request,
+    response: Response,
+    next_cursor: Optional[str],
+    prev_cursor: Optional[str]
+) -> None:
+    links = []
+    if next_cursor:
+        links.append(f'<{request.url.remove_query_params("skip").include_query_params(cursor=next_cursor)}>; rel="next"')
+    if prev_cursor:
+        links.append(f'<{request.url.remove_query_params("skip").include_query_params(cursor=prev_cursor)}>; rel="prev"')
+    if links:
+        response.headers["Link"] = ", ".join(links)
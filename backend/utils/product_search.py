@@ -0,0 +1,132 @@
+from typing import Any, List, Tuple
+from sqlalchemy import Select, column, func, literal_column, select, table, text
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.asyncio import AsyncSession
+from .. import models
+import os
+import re
+
+SEARCH_LIMIT_MAX = 100
+
+# SQLite keeps an external-content FTS5 table over products; triggers keep it
+# in step with inserts, deletes and changes to name or description (stock
+# updates from checkout do not touch it). 'prefix' builds prefix indexes so
+# type-ahead queries of two or three characters do not scan the term list.
+SQLITE_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+        name, description,
+        content='products', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2', prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF name, description ON products BEGIN
+        INSERT INTO products_fts(products_fts, rowid, name, description) VALUES ('delete', old.id, old.name, old.description);
+        INSERT INTO products_fts(rowid, name, description) VALUES (new.id, new.name, new.description);
+    END
+    """,
+]
+
+# Matches on the name weigh more than matches in the description
+NAME_WEIGHT = 10.0
+DESCRIPTION_WEIGHT = 1.0
+
+# PostgreSQL matches against an expression index, so there is no extra
+# column or trigger to maintain. The query must use the same expression.
+# Name lexemes are labelled A and description ones D for ts_rank to weigh.
+POSTGRES_DOCUMENT = (
+    "(setweight(to_tsvector('simple', coalesce(name, '')), 'A') || "
+    "setweight(to_tsvector('simple', coalesce(description, '')), 'D'))"
+)
+# ts_rank takes the weights of D, C, B and A, each at most 1
+POSTGRES_WEIGHTS = f"'{{{DESCRIPTION_WEIGHT / NAME_WEIGHT}, 0, 0, 1}}'::float4[]"
+POSTGRES_DDL = [
+    # The earlier index over the unlabelled document
+    "DROP INDEX IF EXISTS ix_products_search",
+    f"CREATE INDEX IF NOT EXISTS ix_products_search_weighted ON products USING GIN ({POSTGRES_DOCUMENT})",
+]
+# Ranking scores every match, so broad prefixes ("ap") that match a large
+# part of the catalog are returned in index order instead
+SEARCH_RANK_MAX_MATCHES = int(os.getenv("SEARCH_RANK_MAX_MATCHES", "1000"))
+
+products_fts = table("products_fts", column("rowid"))
+
+def search_terms(q: str) -> List[str]:
+    # Only word characters reach the match expression, so user input cannot
+    # inject FTS or tsquery operators
+    return re.findall(r"\w+", q.lower())
+
+def install_search_index(connection: Connection):
+    """Create the search index if it is missing. Safe to run on every start."""
+    dialect = connection.dialect.name
+    if dialect == "sqlite":
+        created = not connection.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'products_fts'")
+        ).first()
+        for ddl in SQLITE_DDL:
+            connection.execute(text(ddl))
+        if created:
+            # Index the products that existed before the table did
+            connection.execute(text("INSERT INTO products_fts(products_fts) VALUES ('rebuild')"))
+    elif dialect == "postgresql":
+        for ddl in POSTGRES_DDL:
+            connection.execute(text(ddl))
+
+def _matching(dialect: str, terms: List[str], stmt: Select) -> Tuple[Select, Any, Any]:
+    """Restrict ``stmt`` to products matching every term (as a prefix).
+
+    Also returns the relevance expression (lower is better) and the product
+    id column the index can return rows in without sorting.
+    """
+    if dialect == "sqlite":
+        match = " ".join(f'"{term}"*' for term in terms)
+        stmt = stmt.join(products_fts, products_fts.c.rowid == models.Product.id).where(
+            literal_column("products_fts").op("MATCH")(match)
+        )
+        relevance = func.bm25(literal_column("products_fts"), NAME_WEIGHT, DESCRIPTION_WEIGHT)
+        return stmt, relevance, products_fts.c.rowid
+
+    if dialect == "postgresql":
+        query = func.to_tsquery("simple", " & ".join(f"{term}:*" for term in terms))
+        document = literal_column(POSTGRES_DOCUMENT)
+        relevance = -func.ts_rank(literal_column(POSTGRES_WEIGHTS), document, query)
+        return stmt.where(document.op("@@")(query)), relevance, models.Product.id
+
+    # No full-text support: fall back to substring matches on the name
+    for term in terms:
+        stmt = stmt.where(models.Product.name.ilike(f"%{term}%"))
+    return stmt, models.Product.name, models.Product.id
+
+def search_statement(dialect: str, terms: List[str], limit: int, ranked: bool = True) -> Select:
+    stmt, relevance, product_id = _matching(dialect, terms, select(models.Product))
+    if ranked:
+        return stmt.order_by(relevance, product_id).limit(limit)
+    return stmt.order_by(product_id).limit(limit)
+
+async def find_products(db: AsyncSession, q: str, limit: int) -> List[models.Product]:
+    terms = search_terms(q)
+    if not terms:
+        return []
+    dialect = db.bind.dialect.name
+
+    # Counting up to the cap only reads that many index entries
+    matches, _, _ = _matching(dialect, terms, select(models.Product.id))
+    count = await db.scalar(
+        select(func.count()).select_from(matches.limit(SEARCH_RANK_MAX_MATCHES + 1).subquery())
+    )
+    if not count:
+        return []
+
+    result = await db.execute(search_statement(dialect, terms, limit, ranked=count <= SEARCH_RANK_MAX_MATCHES))
+    return list(result.scalars().all())
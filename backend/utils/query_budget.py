@@ -0,0 +1,137 @@
+"""Per-request SQL statement budgets and N+1 detection.
+
+Routes declare how many statements they may issue next to their path:
+
+    @router.get("/{sale_id}", dependencies=[query_budget(3)])
+
+QueryBudgetMiddleware counts the statements of every request, including
+those made while the response is serialised or streamed, and reports a
+request that goes over its budget or runs the same statement text
+N_PLUS_ONE_THRESHOLD times or more. QUERY_BUDGET_MODE selects what happens
+then: "raise" (development and tests) raises QueryBudgetExceeded, "log"
+(the default) logs a warning and "off" skips the tracking altogether.
+
+Budgets count the user lookup of a cold principal cache and, on routes
+that number invoices, the reservation of a new block of numbers. A route
+whose request took a rarer, costlier path allows for its extra statements
+with extend_budget. Routes reading in keyset chunks run the same statements
+once per chunk; they allow for that with allow_repeats, or the repeats_ok
+dependency when the number of chunks is not known up front.
+"""
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, List, Optional
+import logging
+import os
+from fastapi import Depends
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "log")
+N_PLUS_ONE_THRESHOLD = int(os.getenv("N_PLUS_ONE_THRESHOLD", "5"))
+
+logger = logging.getLogger(__name__)
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+class QueryTracker:
+    def __init__(self, name: str = "", budget: Optional[int] = None):
+        self.name = name
+        self.budget = budget
+        self.statements = 0
+        self.repeats: Counter = Counter()
+        # Extra runs of each statement before it counts as an N+1, None for any number
+        self.repeat_allowance: Optional[int] = 0
+
+    def record(self, statement: str):
+        self.statements += 1
+        self.repeats[statement] += 1
+
+    def problems(self) -> List[str]:
+        problems = []
+        if self.budget is not None and self.statements > self.budget:
+            problems.append(f"{self.statements} statements, budget is {self.budget}")
+        if self.repeat_allowance is None:
+            return problems
+        for statement, count in self.repeats.items():
+            if count >= N_PLUS_ONE_THRESHOLD + self.repeat_allowance:
+                problems.append(f"possible N+1, run {count} times: {' '.join(statement.split())[:200]}")
+        return problems
+
+    def check(self, mode: str = QUERY_BUDGET_MODE):
+        problems = self.problems()
+        if not problems:
+            return
+        message = f"{self.name or 'query budget'}: " + "; ".join(problems)
+        if mode == "raise":
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+_tracker: ContextVar[Optional[QueryTracker]] = ContextVar("query_tracker", default=None)
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    tracker = _tracker.get()
+    if tracker is not None:
+        tracker.record(statement)
+
+def instrument_engine(engine: Engine):
+    """Track statements on ``engine`` (for an AsyncEngine, pass its sync_engine)."""
+    if not event.contains(engine, "after_cursor_execute", _after_cursor_execute):
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+
+@contextmanager
+def track_queries(name: str = "", budget: Optional[int] = None,
+                  mode: str = QUERY_BUDGET_MODE) -> Iterator[QueryTracker]:
+    """Track the statements run inside the block and check them on exit."""
+    tracker = QueryTracker(name, budget)
+    token = _tracker.set(tracker)
+    try:
+        yield tracker
+    finally:
+        _tracker.reset(token)
+    tracker.check(mode)
+
+def query_budget(statements: int):
+    """Route dependency declaring the most statements a request may run."""
+    async def set_budget():
+        tracker = _tracker.get()
+        if tracker is not None:
+            tracker.budget = statements
+    return Depends(set_budget)
+
+def extend_budget(statements: int):
+    """Allow the current request ``statements`` more, for a slow path it took."""
+    tracker = _tracker.get()
+    if tracker is not None and tracker.budget is not None:
+        tracker.budget += statements
+
+def allow_repeats(times: Optional[int]):
+    """Let each statement of the current request run ``times`` more before
+    it is reported as a possible N+1, or any number of times with None."""
+    tracker = _tracker.get()
+    if tracker is not None and tracker.repeat_allowance is not None:
+        tracker.repeat_allowance = None if times is None else tracker.repeat_allowance + times
+
+def repeats_ok():
+    """Route dependency for routes looping over keyset chunks: the same
+    statements run once per chunk, which is not an N+1."""
+    async def exempt_repeats():
+        allow_repeats(None)
+    return Depends(exempt_repeats)
+
+class QueryBudgetMiddleware:
+    def __init__(self, app, mode: str = QUERY_BUDGET_MODE):
+        self.app = app
+        self.mode = mode
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or self.mode == "off":
+            await self.app(scope, receive, send)
+            return
+
+        with track_queries(mode=self.mode) as tracker:
+            await self.app(scope, receive, send)
+            route = scope.get("route")
+            tracker.name = f"{scope['method']} {getattr(route, 'path', scope['path'])}"
@@ -0,0 +1,145 @@
+"""Check that the hot queries are answered from an index.
+
+Runs EXPLAIN QUERY PLAN for each query against a scratch SQLite database
+built from the models (or against DATABASE_URL with --current) and fails
+if a query does not use the index it was written for. From the repository
+root:
+
+    python -m backend.utils.query_plans
+"""
+from datetime import datetime
+from typing import Callable, List, NamedTuple
+from sqlalchemy import create_engine, func, select
+from sqlalchemy.engine import Engine
+from .. import models
+from .export import sales_export_statement
+
+class HotQuery(NamedTuple):
+    name: str
+    index: str
+    statement: Callable
+
+START, END = datetime(2024, 1, 1), datetime(2024, 1, 31)
+
+HOT_QUERIES: List[HotQuery] = [
+    HotQuery(
+        "sales filtered by date, keyset page",
+        "ix_sales_created_at_id",
+        lambda: select(models.Sale.id).where(
+            models.Sale.created_at >= START, models.Sale.created_at <= END, models.Sale.id > 0
+        ).order_by(models.Sale.id).limit(100)
+    ),
+    HotQuery(
+        "sales filtered by customer, keyset page",
+        "ix_sales_customer_id_id",
+        lambda: select(models.Sale.id).where(
+            models.Sale.customer_id == 1, models.Sale.id > 0
+        ).order_by(models.Sale.id).limit(100)
+    ),
+    HotQuery(
+        "sales filtered by product",
+        "ix_sale_items_product_id_sale_id",
+        lambda: sales_export_statement(product_id=1).limit(100)
+    ),
+    HotQuery(
+        "sale items of a page of sales",
+        "ix_sale_items_sale_id",
+        lambda: select(models.SaleItem).where(models.SaleItem.sale_id.in_([1, 2, 3]))
+    ),
+    HotQuery(
+        "delete_product: has been sold",
+        "ix_sale_items_product_id_sale_id",
+        lambda: select(models.SaleItem.id).where(models.SaleItem.product_id == 1).limit(1)
+    ),
+    HotQuery(
+        "delete_product: has stock movements",
+        "ix_stock_movements_product_id_id",
+        lambda: select(models.StockMovement.id).where(models.StockMovement.product_id == 1).limit(1)
+    ),
+    HotQuery(
+        "delete_customer: has sales",
+        "ix_sales_customer_id_id",
+        lambda: select(models.Sale.id).where(models.Sale.customer_id == 1).limit(1)
+    ),
+    HotQuery(
+        "delete_user: has sales",
+        "ix_sales_user_id",
+        lambda: select(models.Sale.id).where(models.Sale.user_id == 1).limit(1)
+    ),
+    HotQuery(
+        "rollup rebuild over a date range",
+        "ix_sales_created_at_id",
+        lambda: select(func.date(models.Sale.created_at), func.sum(models.Sale.total_amount)).where(
+            models.Sale.created_at >= START, models.Sale.created_at < END
+        ).group_by(func.date(models.Sale.created_at))
+    ),
+    HotQuery(
+        "invoices in a date range",
+        "ix_invoices_created_at_id",
+        lambda: select(models.Invoice).where(
+            models.Invoice.created_at >= START, models.Invoice.created_at <= END
+        )
+    ),
+    HotQuery(
+        "invoices by status",
+        "ix_invoices_status",
+        lambda: select(models.Invoice.id).where(models.Invoice.status == "pending")
+    ),
+    HotQuery(
+        "invoices of a sale",
+        "ix_invoices_sale_id",
+        lambda: select(models.Invoice.id).where(models.Invoice.sale_id == 1)
+    ),
+    HotQuery(
+        "invoice items of a page of invoices",
+        "ix_invoice_items_invoice_id",
+        lambda: select(models.InvoiceItem).where(models.InvoiceItem.invoice_id.in_([1, 2, 3]))
+    ),
+    HotQuery(
+        "stock ledger tail of a basket",
+        "ix_stock_movements_product_id_id",
+        lambda: select(models.StockMovement.product_id, func.sum(models.StockMovement.quantity)).where(
+            models.StockMovement.product_id.in_([1, 2, 3]), models.StockMovement.id > 100
+        ).group_by(models.StockMovement.product_id)
+    ),
+]
+
+def query_plan(engine: Engine, statement) -> List[str]:
+    compiled = statement.compile(engine, compile_kwargs={"literal_binds": True})
+    with engine.connect() as connection:
+        rows = connection.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}").all()
+    return [row[-1] for row in rows]
+
+def check_query_plans(engine: Engine) -> List[str]:
+    """Return a description of every hot query that misses its index."""
+    if engine.dialect.name != "sqlite":
+        raise ValueError("query plan checks need a SQLite database")
+    failures = []
+    for query in HOT_QUERIES:
+        plan = query_plan(engine, query.statement())
+        if not any(query.index in line for line in plan):
+            failures.append(f"{query.name}: expected {query.index}, got {plan}")
+    return failures
+
+if __name__ == "__main__":
+    import argparse
+    import sys
+    from ..database import Base, engine as current_engine
+
+    parser = argparse.ArgumentParser(description="Check that the hot queries use their indexes")
+    parser.add_argument("--current", action="store_true",
+                        help="check the configured database instead of a scratch one")
+    args = parser.parse_args()
+
+    if args.current:
+        engine = current_engine
+    else:
+        engine = create_engine("sqlite://")
+        Base.metadata.create_all(bind=engine)
+
+    failures = check_query_plans(engine)
+    for query in HOT_QUERIES:
+        print(f"{'FAIL' if any(f.startswith(query.name + ':') for f in failures) else 'ok  '} {query.name}")
+    for failure in failures:
+        print(failure, file=sys.stderr)
+    sys.exit(1 if failures else 0)
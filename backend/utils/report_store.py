@@ -0,0 +1,121 @@
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+from sqlalchemy import func, select
+from sqlalchemy.orm import Session
+from .. import models
+import json
+import os
+import threading
+
+REPORT_CACHE_SIZE = int(os.getenv("REPORT_CACHE_SIZE", "32"))
+# Snapshots older than this are thinned out to the last one of each day...
+REPORT_KEEP_ALL_HOURS = int(os.getenv("REPORT_KEEP_ALL_HOURS", "24"))
+# ...and dropped altogether after this many days
+REPORT_RETENTION_DAYS = int(os.getenv("REPORT_RETENTION_DAYS", "90"))
+COMPACTION_INTERVAL = timedelta(hours=1)
+
+class Snapshot(NamedTuple):
+    generated_at: datetime
+    data: Dict[str, Any]
+
+_cache: "OrderedDict[Tuple[str, str], Snapshot]" = OrderedDict()
+_lock = threading.Lock()
+_last_compaction: Optional[datetime] = None
+
+def _remember(key: Tuple[str, str], snapshot: Snapshot):
+    with _lock:
+        current = _cache.get(key)
+        # Never replace a newer snapshot with an older one read concurrently
+        if current is None or current.generated_at <= snapshot.generated_at:
+            _cache[key] = snapshot
+        _cache.move_to_end(key)
+        while len(_cache) > REPORT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+def clear_cache():
+    with _lock:
+        _cache.clear()
+
+def save_snapshot(db: Session, report_type: str, period: str, data: Dict[str, Any],
+                  generated_at: Optional[datetime] = None) -> Snapshot:
+    snapshot = Snapshot(generated_at or datetime.utcnow(), data)
+    db.add(models.ReportSnapshot(
+        report_type=report_type,
+        period=period,
+        generated_at=snapshot.generated_at,
+        data=json.dumps(data, separators=(",", ":"), default=str)
+    ))
+    db.commit()
+    _remember((report_type, period), snapshot)
+    maybe_compact(db, snapshot.generated_at)
+    return snapshot
+
+def latest_snapshot(db: Session, report_type: str, period: str) -> Optional[Snapshot]:
+    """The newest snapshot of a report. A cached one is served after checking,
+    with one index-only query, that no other process saved a newer one."""
+    key = (report_type, period)
+    snapshots = models.ReportSnapshot
+    with _lock:
+        cached = _cache.get(key)
+    if cached is not None:
+        latest = db.scalar(
+            select(func.max(snapshots.generated_at))
+            .where(snapshots.report_type == report_type, snapshots.period == period)
+        )
+        if latest == cached.generated_at:
+            with _lock:
+                if key in _cache:
+                    _cache.move_to_end(key)
+            return cached
+
+    row = db.query(snapshots).filter(
+        snapshots.report_type == report_type,
+        snapshots.period == period
+    ).order_by(snapshots.generated_at.desc()).first()
+    if row is None:
+        with _lock:
+            _cache.pop(key, None)
+        return None
+    snapshot = Snapshot(row.generated_at, json.loads(row.data))
+    _remember(key, snapshot)
+    return snapshot
+
+def maybe_compact(db: Session, now: datetime):
+    global _last_compaction
+    with _lock:
+        if _last_compaction is not None and now - _last_compaction < COMPACTION_INTERVAL:
+            return
+        _last_compaction = now
+    compact_snapshots(db, now)
+
+def compact_snapshots(db: Session, now: Optional[datetime] = None):
+    """Apply retention and thin out old snapshots to the newest of each day."""
+    now = now or datetime.utcnow()
+    db.query(models.ReportSnapshot).filter(
+        models.ReportSnapshot.generated_at < now - timedelta(days=REPORT_RETENTION_DAYS)
+    ).delete(synchronize_session=False)
+
+    old = db.query(
+        models.ReportSnapshot.id,
+        models.ReportSnapshot.report_type,
+        models.ReportSnapshot.period,
+        models.ReportSnapshot.generated_at
+    ).filter(
+        models.ReportSnapshot.generated_at < now - timedelta(hours=REPORT_KEEP_ALL_HOURS)
+    ).order_by(models.ReportSnapshot.generated_at.desc()).all()
+
+    kept = set()
+    superseded = []
+    for row in old:
+        day_key = (row.report_type, row.period, row.generated_at.date())
+        if day_key in kept:
+            superseded.append(row.id)
+        else:
+            kept.add(day_key)
+
+    for start in range(0, len(superseded), 500):
+        db.query(models.ReportSnapshot).filter(
+            models.ReportSnapshot.id.in_(superseded[start:start + 500])
+        ).delete(synchronize_session=False)
+    db.commit()
@@ -1,56 +1,74 @@
-from datetime import datetime, timedelta
-from sqlalchemy import func
+from datetime import date, datetime, time, timedelta
+from sqlalchemy import func, select, union_all
 from sqlalchemy.orm import Session
 from .. import models
-from typing import Dict, Any, List
-import json
-import os
-from pathlib import Path
+from typing import Dict, Any, List, Optional, Tuple
+from ..database import SessionLocal
+from . import report_store
 
-REPORTS_DIR = Path("reports")
+def save_report(db: Session, data: Dict[str, Any], report_type: str, period: str) -> report_store.Snapshot:
+    return report_store.save_snapshot(db, report_type, period, data)
 
-def ensure_reports_directory():
-    REPORTS_DIR.mkdir(exist_ok=True)
+def summarize_sales(db: Session, start_day: date, end_day: date) -> Dict[str, Any]:
+    """Sales totals of a range of days, in a form that merges with the
+    totals of adjacent ranges (see build_sales_report)."""
+    # Read the daily rollups, so the cost depends on the number of days, not
+    # sales, plus the deltas appended since they were last folded
+    rollup, deltas = models.DailySalesRollup, models.SalesRollupDelta
+    days = union_all(
+        select(rollup.day, rollup.total_amount, rollup.num_transactions)
+        .where(rollup.day.between(start_day, end_day)),
+        select(deltas.day, deltas.total_amount, deltas.num_transactions)
+        .where(deltas.day.between(start_day, end_day), deltas.product_id.is_(None))
+    ).subquery()
+    num_transactions = func.sum(days.c.num_transactions)
+    daily_sales = db.execute(
+        select(days.c.day, func.sum(days.c.total_amount).label('total_amount'), num_transactions.label('count'))
+        .group_by(days.c.day)
+        .having(num_transactions > 0)
+        .order_by(days.c.day)
+    ).all()
 
-def save_report(data: Dict[str, Any], report_type: str, period: str):
-    ensure_reports_directory()
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    filename = f"{report_type}_{period}_{timestamp}.json"
-    filepath = REPORTS_DIR / filename
-    
-    with open(filepath, 'w') as f:
-        json.dump(data, f, indent=2, default=str)
-    
-    return filepath
+    product_rollup = models.DailyProductSalesRollup
+    lines = union_all(
+        select(product_rollup.product_id, product_rollup.quantity, product_rollup.revenue)
+        .where(product_rollup.day.between(start_day, end_day)),
+        select(deltas.product_id, deltas.quantity, deltas.revenue)
+        .where(deltas.day.between(start_day, end_day), deltas.product_id.is_not(None))
+    ).subquery()
+    products = db.execute(
+        select(
+            models.Product.id,
+            models.Product.name,
+            func.sum(lines.c.quantity).label('quantity'),
+            func.sum(lines.c.revenue).label('revenue')
+        )
+        .select_from(lines)
+        .join(models.Product, models.Product.id == lines.c.product_id)
+        .group_by(models.Product.id, models.Product.name)
+    ).all()
+
+    return {
+        'days': [(str(day.day), float(day.total_amount), day.count) for day in daily_sales],
+        'products': {product.id: (product.name, product.quantity, float(product.revenue)) for product in products}
+    }
+
+def build_sales_report(start_date: datetime, end_date: datetime, parts: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """Merge the summaries of consecutive day ranges into a report."""
+    days = sorted(day for part in parts for day in part['days'])
+    products: Dict[int, List] = {}
+    for part in parts:
+        for product_id, (name, quantity, revenue) in part['products'].items():
+            merged = products.setdefault(product_id, [name, 0, 0.0])
+            merged[1] += quantity
+            merged[2] += revenue
+
+    total_sales = sum(total for _, total, _ in days)
+    num_transactions = sum(count for _, _, count in days)
+    top_products = sorted(
+        (product for product in products.values() if product[1] > 0), key=lambda product: -product[1]
+    )[:10]
 
-def generate_sales_report(db: Session, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
-    # Get total sales
-    total_sales = db.query(func.sum(models.Sale.total_amount)).filter(
-        models.Sale.created_at.between(start_date, end_date)
-    ).scalar() or 0
-    
-    # Get number of transactions
-    num_transactions = db.query(func.count(models.Sale.id)).filter(
-        models.Sale.created_at.between(start_date, end_date)
-    ).scalar() or 0
-    
-    # Get top selling products
-    top_products = db.query(
-        models.Product.name,
-        func.sum(models.SaleItem.quantity).label('total_quantity'),
-        func.sum(models.SaleItem.quantity * models.SaleItem.price).label('total_revenue')
-    ).join(models.SaleItem).join(models.Sale).filter(
-        models.Sale.created_at.between(start_date, end_date)
-    ).group_by(models.Product.id).order_by(func.sum(models.SaleItem.quantity).desc()).limit(10).all()
-    
-    # Get sales by day
-    daily_sales = db.query(
-        func.date(models.Sale.created_at).label('date'),
-        func.sum(models.Sale.total_amount).label('total')
-    ).filter(
-        models.Sale.created_at.between(start_date, end_date)
-    ).group_by(func.date(models.Sale.created_at)).all()
-    
     report_data = {
         'period': {
             'start': start_date.isoformat(),
@@ -63,44 +81,74 @@ def generate_sales_report(db: Session, start_date: datetime, end_date: datetime)
         },
         'top_products': [
             {
-                'name': product.name,
-                'quantity_sold': product.total_quantity,
-                'revenue': float(product.total_revenue)
+                'name': name,
+                'quantity_sold': quantity,
+                'revenue': float(revenue)
             }
-            for product in top_products
+            for name, quantity, revenue in top_products
         ],
         'daily_sales': [
             {
-                'date': str(sale.date),
-                'total': float(sale.total)
+                'date': day,
+                'total': total
             }
-            for sale in daily_sales
+            for day, total, _ in days
         ]
     }
     
     return report_data
 
+def generate_sales_report(db: Session, start_date: datetime, end_date: datetime) -> Dict[str, Any]:
+    return build_sales_report(start_date, end_date, [summarize_sales(db, start_date.date(), end_date.date())])
+
+def report_window(days: int) -> Tuple[datetime, datetime]:
+    # Whole days, today included, matching the granularity of the rollups
+    end_date = datetime.utcnow()
+    start_date = datetime.combine((end_date - timedelta(days=days - 1)).date(), time.min)
+    return start_date, end_date
+
+def generate_daily_report(db: Session) -> Dict[str, Any]:
+    start_date, end_date = report_window(1)
+    report_data = generate_sales_report(db, start_date, end_date)
+    save_report(db, report_data, 'daily_sales', 'daily')
+    return report_data
+
 def generate_weekly_report(db: Session) -> Dict[str, Any]:
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=7)
+    start_date, end_date = report_window(7)
     report_data = generate_sales_report(db, start_date, end_date)
-    save_report(report_data, 'weekly_sales', 'weekly')
+    save_report(db, report_data, 'weekly_sales', 'weekly')
     return report_data
 
 def generate_monthly_report(db: Session) -> Dict[str, Any]:
-    end_date = datetime.now()
-    start_date = end_date - timedelta(days=30)
+    start_date, end_date = report_window(30)
     report_data = generate_sales_report(db, start_date, end_date)
-    save_report(report_data, 'monthly_sales', 'monthly')
+    save_report(db, report_data, 'monthly_sales', 'monthly')
     return report_data
 
-def get_latest_report(report_type: str, period: str) -> Dict[str, Any]:
-    ensure_reports_directory()
-    pattern = f"{report_type}_{period}_*.json"
-    report_files = sorted(REPORTS_DIR.glob(pattern), reverse=True)
-    
-    if not report_files:
-        return None
-    
-    with open(report_files[0], 'r') as f:
-        return json.load(f) 
\ No newline at end of file
+REPORT_GENERATORS = {
+    ('daily_sales', 'daily'): generate_daily_report,
+    ('weekly_sales', 'weekly'): generate_weekly_report,
+    ('monthly_sales', 'monthly'): generate_monthly_report,
+}
+# Days covered by each report, for building them in chunks (utils.analytics_pool)
+REPORT_WINDOWS = {
+    ('daily_sales', 'daily'): 1,
+    ('weekly_sales', 'weekly'): 7,
+    ('monthly_sales', 'monthly'): 30,
+}
+
+def get_latest_report(db: Session, report_type: str, period: str) -> Optional[Dict[str, Any]]:
+    snapshot = report_store.latest_snapshot(db, report_type, period)
+    return snapshot.data if snapshot else None
+
+def is_stale(snapshot: report_store.Snapshot, max_age: timedelta) -> bool:
+    # Stale reports are still served, but trigger a regeneration
+    return datetime.utcnow() - snapshot.generated_at > max_age
+
+def store_report(report_type: str, period: str, data: Dict[str, Any]) -> report_store.Snapshot:
+    """Save a report built off the request path, with its own session."""
+    db = SessionLocal()
+    try:
+        return save_report(db, data, report_type, period)
+    finally:
+        db.close()
@@ -0,0 +1,257 @@
+"""Daily sales rollups behind the reports.
+
+Every sale, void and status change appends its rollup changes to
+sales_rollup_deltas in its own transaction rather than updating the
+per-day rows, which every checkout of the day would otherwise queue on.
+fold_deltas periodically adds the deltas into daily_sales_rollups and
+daily_product_sales_rollups and deletes them; readers add the deltas not
+folded yet, so reports stay exact.
+
+    python -m backend.utils.rollups --start 2024-01-01 --end 2024-12-31   # rebuild
+    python -m backend.utils.rollups --fold                                # fold now
+"""
+from collections import defaultdict
+from datetime import date, datetime, time, timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+import asyncio
+import logging
+import os
+from sqlalchemy import delete, func, insert, select
+from sqlalchemy.orm import Session
+from .. import models
+
+# Sales in these states are left out of the rollups and therefore the reports
+EXCLUDED_STATUSES = ("cancelled",)
+ROLLUP_FOLD_INTERVAL_SECONDS = int(os.getenv("ROLLUP_FOLD_INTERVAL_SECONDS", "10"))
+FOLD_CHUNK_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+def counts_in_rollup(status: Optional[str]) -> bool:
+    return status not in EXCLUDED_STATUSES
+
+class RollupDelta:
+    """Accumulates the rollup changes of one transaction so they are written
+    with one statement, however many sales were touched."""
+
+    def __init__(self):
+        self.days: Dict[date, List] = defaultdict(lambda: [0.0, 0])
+        self.products: Dict[Tuple[date, int], List] = defaultdict(lambda: [0, 0.0])
+
+    def add(self, created_at: datetime, total_amount: float,
+            items: Iterable[Tuple[int, int, float]], sign: int = 1):
+        day = created_at.date()
+        self.days[day][0] += sign * total_amount
+        self.days[day][1] += sign
+        for product_id, quantity, price in items:
+            self.products[(day, product_id)][0] += sign * quantity
+            self.products[(day, product_id)][1] += sign * quantity * price
+
+    def add_sale(self, sale: models.Sale, sign: int = 1):
+        self.add(
+            sale.created_at,
+            sale.total_amount,
+            [(item.product_id, item.quantity, item.price) for item in sale.items],
+            sign
+        )
+
+    def apply(self, db: Session):
+        """Append the changes to sales_rollup_deltas; an insert, so no row is locked."""
+        rows = [
+            {"day": day, "product_id": None, "total_amount": amount, "num_transactions": count,
+             "quantity": 0, "revenue": 0.0}
+            for day, (amount, count) in self.days.items()
+        ] + [
+            {"day": day, "product_id": product_id, "total_amount": 0.0, "num_transactions": 0,
+             "quantity": quantity, "revenue": revenue}
+            for (day, product_id), (quantity, revenue) in self.products.items()
+        ]
+        if rows:
+            db.execute(insert(models.SalesRollupDelta), rows)
+
+    def upsert(self, db: Session):
+        """Add the changes into the rollup tables directly."""
+        # Rows are written in key order so concurrent transactions lock them in the same order
+        _upsert(
+            db,
+            models.DailySalesRollup.__table__,
+            ["day"],
+            [
+                {"day": day, "total_amount": amount, "num_transactions": count}
+                for day, (amount, count) in sorted(self.days.items())
+            ]
+        )
+        _upsert(
+            db,
+            models.DailyProductSalesRollup.__table__,
+            ["day", "product_id"],
+            [
+                {"day": day, "product_id": product_id, "quantity": quantity, "revenue": revenue}
+                for (day, product_id), (quantity, revenue) in sorted(self.products.items())
+            ]
+        )
+
+def _upsert(db: Session, table, keys: List[str], rows: List[Dict]):
+    if not rows:
+        return
+    columns = [column for column in rows[0] if column not in keys]
+    dialect = db.get_bind().dialect.name
+
+    if dialect in ("sqlite", "postgresql"):
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as dialect_insert
+        else:
+            from sqlalchemy.dialects.postgresql import insert as dialect_insert
+        stmt = dialect_insert(table)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=keys,
+            set_={column: table.c[column] + stmt.excluded[column] for column in columns}
+        )
+        db.execute(stmt, rows)
+        return
+
+    for row in rows:
+        condition = [table.c[key] == row[key] for key in keys]
+        result = db.execute(
+            table.update().where(*condition).values(
+                {column: table.c[column] + row[column] for column in columns}
+            )
+        )
+        if result.rowcount == 0:
+            db.execute(table.insert().values(row))
+
+def record_sales(db: Session, sales: Iterable[models.Sale], sign: int = 1):
+    delta = RollupDelta()
+    for sale in sales:
+        if counts_in_rollup(sale.status):
+            delta.add_sale(sale, sign)
+    delta.apply(db)
+
+def record_status_change(db: Session, sale: models.Sale, new_status: str):
+    # Only transitions into or out of an excluded state move the rollups
+    if counts_in_rollup(sale.status) != counts_in_rollup(new_status):
+        delta = RollupDelta()
+        delta.add_sale(sale, 1 if counts_in_rollup(new_status) else -1)
+        delta.apply(db)
+
+def _take_deltas(db: Session, limit: int) -> List:
+    # Deleted and read back in one statement, so a delta committed meanwhile
+    # is either folded here or left for the next fold, never lost or counted twice
+    deltas = models.SalesRollupDelta.__table__
+    columns = (deltas.c.day, deltas.c.product_id, deltas.c.total_amount, deltas.c.num_transactions,
+               deltas.c.quantity, deltas.c.revenue)
+    if db.get_bind().dialect.delete_returning:
+        oldest = select(deltas.c.id).order_by(deltas.c.id).limit(limit)
+        return db.execute(delete(deltas).where(deltas.c.id.in_(oldest)).returning(*columns)).all()
+    rows = db.execute(select(deltas.c.id, *columns).order_by(deltas.c.id).limit(limit)).all()
+    if rows and db.execute(delete(deltas).where(deltas.c.id.in_([row.id for row in rows]))).rowcount != len(rows):
+        raise RuntimeError("sales rollup deltas folded concurrently")
+    return rows
+
+def fold_deltas(db: Session, limit: int = FOLD_CHUNK_SIZE) -> int:
+    """Add up to ``limit`` of the oldest deltas into the rollup tables and
+    delete them. Returns how many were folded; the caller commits."""
+    rows = _take_deltas(db, limit)
+    delta = RollupDelta()
+    for row in rows:
+        if row.product_id is None:
+            delta.days[row.day][0] += row.total_amount
+            delta.days[row.day][1] += row.num_transactions
+        else:
+            delta.products[(row.day, row.product_id)][0] += row.quantity
+            delta.products[(row.day, row.product_id)][1] += row.revenue
+    delta.upsert(db)
+    return len(rows)
+
+def run_fold() -> int:
+    from ..database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        folded = 0
+        while True:
+            count = fold_deltas(db)
+            db.commit()
+            folded += count
+            if count < FOLD_CHUNK_SIZE:
+                return folded
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def fold_periodically(interval: int = ROLLUP_FOLD_INTERVAL_SECONDS):
+    from fastapi.concurrency import run_in_threadpool
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(run_fold)
+        except Exception:
+            logger.exception("sales rollup fold failed")
+
+def rebuild_rollups(db: Session, start_day: Optional[date] = None, end_day: Optional[date] = None):
+    """Recompute the rollups from the sales tables for the given days (all
+    days when no bounds are given). Does not commit."""
+    sale_day = func.date(models.Sale.created_at)
+
+    for rollup in (models.DailySalesRollup, models.DailyProductSalesRollup, models.SalesRollupDelta):
+        query = db.query(rollup)
+        if start_day:
+            query = query.filter(rollup.day >= start_day)
+        if end_day:
+            query = query.filter(rollup.day <= end_day)
+        query.delete(synchronize_session=False)
+
+    day_filter = [models.Sale.status.notin_(EXCLUDED_STATUSES)]
+    if start_day:
+        day_filter.append(models.Sale.created_at >= datetime.combine(start_day, time.min))
+    if end_day:
+        day_filter.append(models.Sale.created_at < datetime.combine(end_day + timedelta(days=1), time.min))
+
+    db.execute(
+        insert(models.DailySalesRollup.__table__).from_select(
+            ["day", "total_amount", "num_transactions"],
+            select(sale_day, func.sum(models.Sale.total_amount), func.count(models.Sale.id))
+            .where(*day_filter)
+            .group_by(sale_day)
+        )
+    )
+    db.execute(
+        insert(models.DailyProductSalesRollup.__table__).from_select(
+            ["day", "product_id", "quantity", "revenue"],
+            select(
+                sale_day,
+                models.SaleItem.product_id,
+                func.sum(models.SaleItem.quantity),
+                func.sum(models.SaleItem.quantity * models.SaleItem.price)
+            )
+            .join(models.Sale, models.Sale.id == models.SaleItem.sale_id)
+            .where(*day_filter)
+            .group_by(sale_day, models.SaleItem.product_id)
+        )
+    )
+
+if __name__ == "__main__":
+    import argparse
+    from ..database import SessionLocal, create_tables
+
+    parser = argparse.ArgumentParser(description="Rebuild the daily sales rollups from the sales tables")
+    parser.add_argument("--start", type=date.fromisoformat, help="first day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--end", type=date.fromisoformat, help="last day to rebuild (YYYY-MM-DD)")
+    parser.add_argument("--fold", action="store_true", help="only fold the appended deltas into the rollups")
+    args = parser.parse_args()
+
+    create_tables()
+    if args.fold:
+        print(f"Folded {run_fold()} rollup deltas.")
+    else:
+        db = SessionLocal()
+        try:
+            print("Rebuilding daily sales rollups...")
+            rebuild_rollups(db, args.start, args.end)
+            db.commit()
+            print("Rollups rebuilt.")
+        finally:
+            db.close()
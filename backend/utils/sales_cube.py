@@ -0,0 +1,676 @@
+"""In-memory columnar copy of the sale items, for ad-hoc analytics.
+
+The fixed reports answer fixed questions from the rollups. /reports/query
+answers a group-by over any date range, set of products, customers,
+cashiers and hours of the day, vectorised over NumPy arrays instead of
+scanning the sales tables. The cube holds one row per sale item: the time
+of the sale (UTC, to the second), product, customer, cashier, quantity and
+amount (quantity x price), sorted by time so that a date range is a slice.
+It takes about 46 bytes per line item, in each API process.
+
+Every query first appends the sale items added since the previous one, so
+sales made anywhere are seen at once. Items younger than
+SALES_CUBE_GRACE_SECONDS are read again by every query instead of kept: on
+PostgreSQL ids are handed out before commit, so a lower id may still become
+visible later. Cancelled sales are left out, as in the reports. Status
+changes and deletions, made through any process, are read back from the
+sale_status_changes log the same way and applied to the rows already in.
+
+The rows are also summed into day x product blocks (_Blocks), one per
+product sold on a day, at 32 bytes each. Questions grouped and filtered by
+day and product alone, over whole days, add up the blocks instead of the
+rows. With 50M line items on one core (see benchmarks/cube_benchmark),
+totals over a month take about 15 ms and top products about 10 ms for a
+month and 75 ms for all time. Group-bys by customer, cashier or hour, or
+filtered by them, are still a pass over every row in range and take
+0.15-1.1 s; only SALES_CUBE_THREADS brings that down.
+"""
+from datetime import date, datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, NamedTuple, Optional, Sequence, Set, Tuple
+import calendar
+import contextvars
+import os
+import threading
+import time
+import numpy as np
+from sqlalchemy import BigInteger, Integer, cast, func, select
+from sqlalchemy.orm import Session
+from .. import models
+from .rollups import counts_in_rollup
+
+SALES_CUBE_PRELOAD = os.getenv("SALES_CUBE_PRELOAD", "true").lower() in ("1", "true", "yes")
+SALES_CUBE_GRACE_SECONDS = int(os.getenv("SALES_CUBE_GRACE_SECONDS", "60"))
+SALES_CUBE_THREADS = int(os.getenv("SALES_CUBE_THREADS", str(os.cpu_count() or 1)))
+LOAD_CHUNK_SIZE = 100_000
+# Scans of more rows than this are split over SALES_CUBE_THREADS threads;
+# np.bincount and the other passes release the GIL
+SCAN_SLICE_ROWS = 1 << 20
+# Filters matching fewer rows than this share compress the rows before grouping
+SPARSE_MATCH_SHARE = 0.25
+# Group-bys with more possible groups than this are grouped by sorting
+# instead of counting into one bin per possible group
+DENSE_GROUP_LIMIT = 1 << 22
+
+# Key in a session's info of the reads past the first each catch-up made, so
+# the route can allow for them in its query budget
+EXTRA_READS = "sales_cube_extra_reads"
+
+DIMENSIONS = ("product", "customer", "user", "day", "hour")
+ORDERINGS = ("revenue", "quantity", "line_items")
+
+COLUMNS = {
+    "ts": np.int64,  # seconds since the epoch
+    "hour": np.int8,
+    "product_id": np.int32,
+    "customer_id": np.int32,  # 0 for sales without a customer
+    "user_id": np.int32,
+    # Floats, which is what np.bincount sums in anyway
+    "quantity": np.float64,
+    "amount": np.float64,
+    "sale_id": np.int64,
+    "excluded": np.bool_,
+}
+ID_COLUMNS = {"product": "product_id", "customer": "customer_id", "user": "user_id"}
+_GROUP_COLUMNS = dict(ID_COLUMNS, day="ts", hour="hour")
+DAY = 86400
+
+def epoch_seconds(moment: datetime) -> int:
+    # Naive datetimes are UTC, as everywhere in the database
+    return calendar.timegm(moment.utctimetuple())
+
+def _count_extra_read(db: Session):
+    db.info[EXTRA_READS] = db.info.get(EXTRA_READS, 0) + 1
+
+def _ts_expression(db: Session):
+    dialect = db.get_bind().dialect.name
+    if dialect == "sqlite":
+        return cast(func.strftime("%s", models.Sale.created_at), Integer)
+    if dialect == "postgresql":
+        return cast(func.extract("epoch", models.Sale.created_at), BigInteger)
+    return models.Sale.created_at
+
+def _empty(size: int = 0) -> Dict[str, np.ndarray]:
+    return {name: np.empty(size, dtype) for name, dtype in COLUMNS.items()}
+
+def _take(columns: Dict[str, np.ndarray], index) -> Dict[str, np.ndarray]:
+    return {name: column[index] for name, column in columns.items()}
+
+def _concat(parts: List[Dict[str, np.ndarray]]) -> Dict[str, np.ndarray]:
+    if not parts:
+        return _empty()
+    return {name: np.concatenate([part[name] for part in parts]) for name in COLUMNS}
+
+def _read(db: Session, after_id: int, limit: int = LOAD_CHUNK_SIZE) -> Tuple[np.ndarray, Dict[str, np.ndarray]]:
+    """The sale items after ``after_id`` in id order, as their ids and columns."""
+    rows = db.execute(
+        select(
+            models.SaleItem.id, _ts_expression(db), models.SaleItem.product_id, models.Sale.customer_id,
+            models.Sale.user_id, models.SaleItem.quantity, models.SaleItem.price, models.SaleItem.sale_id,
+            models.Sale.status
+        )
+        .join(models.Sale, models.Sale.id == models.SaleItem.sale_id)
+        .where(models.SaleItem.id > after_id)
+        .order_by(models.SaleItem.id)
+        .limit(limit)
+    ).all()
+    if not rows:
+        return np.empty(0, np.int64), _empty()
+    ids, ts, product_ids, customer_ids, user_ids, quantities, prices, sale_ids, statuses = zip(*rows)
+    if not isinstance(ts[0], int):
+        ts = [epoch_seconds(moment) for moment in ts]
+    columns = {
+        "ts": np.array(ts, np.int64),
+        "product_id": np.array(product_ids, np.int32),
+        "customer_id": np.array([customer_id or 0 for customer_id in customer_ids], np.int32),
+        "user_id": np.array(user_ids, np.int32),
+        "quantity": np.array(quantities, np.float64),
+        "sale_id": np.array(sale_ids, np.int64),
+        "excluded": np.array([not counts_in_rollup(status) for status in statuses], np.bool_),
+    }
+    columns["hour"] = (columns["ts"] // 3600 % 24).astype(np.int8)
+    columns["amount"] = columns["quantity"] * np.array(prices, np.float64)
+    return np.array(ids, np.int64), columns
+
+def _group_keys(view: Dict[str, np.ndarray], is_sorted: bool, dimensions: Sequence[str],
+                sizes: Sequence[int], first_day: int) -> Optional[np.ndarray]:
+    key = None
+    for dimension, size in zip(dimensions, sizes):
+        if dimension == "day":
+            ts = view["ts"]
+            if is_sorted:
+                # Rows are in time order, so each day is a run
+                bounds = np.searchsorted(ts, (first_day + np.arange(1, size)) * DAY)
+                values = np.repeat(np.arange(size), np.diff(bounds, prepend=0, append=len(ts)))
+            else:
+                values = ts // DAY - first_day
+        elif dimension == "hour":
+            values = view["hour"].astype(np.intp)
+        else:
+            values = view[ID_COLUMNS[dimension]].astype(np.intp)
+        key = values if key is None else key * size + values
+    return key
+
+class _Scan(NamedTuple):
+    is_sorted: bool
+    start: Optional[int]
+    end: Optional[int]
+    has_excluded: bool
+    tables: List[Tuple[str, np.ndarray]]
+    dimensions: Sequence[str]
+    sizes: Sequence[int]
+    first_day: int
+    groups: int
+
+def _lookup_table(ids: Sequence[int], top: int) -> np.ndarray:
+    # Indexing a table by the column is one pass, unlike np.isin
+    table = np.zeros(top + 1, np.bool_)
+    wanted = np.asarray(ids, np.int64)
+    table[wanted[(wanted >= 0) & (wanted <= top)]] = True
+    return table
+
+def _line_items(view: Dict[str, np.ndarray], key: np.ndarray, bins: int) -> np.ndarray:
+    # A row of the day x product blocks stands for the line items it sums
+    if "line_items" in view:
+        return np.bincount(key, weights=view["line_items"], minlength=bins)
+    return np.bincount(key, minlength=bins).astype(np.float64)
+
+def _scan(view: Dict[str, np.ndarray], scan: _Scan) -> Tuple[Optional[np.ndarray], np.ndarray, np.ndarray, np.ndarray]:
+    """Sum the rows of ``view`` matching ``scan`` by group. Returns the
+    groups' keys and their quantity, amount and line item count, or with
+    keys None, arrays indexed by every possible key."""
+    quantity, amount, mask = view["quantity"], view["amount"], None
+    if not scan.is_sorted:
+        # Sorted rows arrive already sliced to the date range
+        ts = view["ts"]
+        if scan.start is not None:
+            mask = ts >= scan.start
+        if scan.end is not None:
+            mask = ts <= scan.end if mask is None else mask & (ts <= scan.end)
+    if scan.has_excluded:
+        mask = ~view["excluded"] if mask is None else mask & ~view["excluded"]
+    for column, table in scan.tables:
+        matches = table[view[column]]
+        mask = matches if mask is None else mask & matches
+    if mask is not None and np.count_nonzero(mask) < len(mask) * SPARSE_MATCH_SHARE:
+        # Few rows match: working on just those beats carrying the mask through
+        wanted = {"quantity", "amount"} | {_GROUP_COLUMNS[dimension] for dimension in scan.dimensions}
+        wanted |= view.keys() & {"line_items"}
+        rows = np.flatnonzero(mask)
+        view, mask = {name: view[name][rows] for name in wanted}, None
+        quantity, amount = view["quantity"], view["amount"]
+    if mask is None and scan.is_sorted and tuple(scan.dimensions) == ("day",):
+        # Each day is a run of rows, so its sums are sums of slices
+        starts = np.searchsorted(view["ts"], (scan.first_day + np.arange(scan.sizes[0])) * DAY)
+        counts = np.diff(starts, append=len(quantity))
+        present = np.flatnonzero(counts)
+        if not len(present):
+            return present, np.zeros(0), np.zeros(0), np.zeros(0)
+        return (
+            present,
+            np.add.reduceat(quantity, starts[present]),
+            np.add.reduceat(amount, starts[present]),
+            np.add.reduceat(view["line_items"], starts[present]) if "line_items" in view
+            else counts[present].astype(np.float64)
+        )
+    key = _group_keys(view, scan.is_sorted, scan.dimensions, scan.sizes, scan.first_day)
+
+    if key is None and mask is None:
+        line_items = view["line_items"].sum() if "line_items" in view else float(len(quantity))
+        return None, np.array([quantity.sum()]), np.array([amount.sum()]), np.array([line_items])
+    groups = scan.groups
+    if groups <= DENSE_GROUP_LIMIT:
+        if mask is None:
+            bins = groups
+        else:
+            # Rows left out go to one more bin, dropped below; cheaper than compressing every column
+            bins = groups + 1
+            if key is None:
+                key = (~mask).astype(np.intp)
+            else:
+                np.copyto(key, groups, where=~mask)
+        return (
+            None,
+            np.bincount(key, weights=quantity, minlength=bins)[:groups],
+            np.bincount(key, weights=amount, minlength=bins)[:groups],
+            _line_items(view, key, bins)[:groups]
+        )
+    if mask is not None:
+        view = {name: view[name][mask] for name in view.keys() & {"quantity", "amount", "line_items"}}
+        key, quantity, amount = key[mask], view["quantity"], view["amount"]
+    present, inverse = np.unique(key, return_inverse=True)
+    return (
+        present,
+        np.bincount(inverse, weights=quantity, minlength=len(present)),
+        np.bincount(inverse, weights=amount, minlength=len(present)),
+        _line_items(view, inverse, len(present))
+    )
+
+def _merge(results) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """Add up the results of _scan into the keys of the groups with rows,
+    and their quantity, amount and row count."""
+    dense = [result[1:] for result in results if result[0] is None]
+    merged = [result for result in results if result[0] is not None]
+    if dense:
+        quantity, amount, counts = (np.sum([result[index] for result in dense], axis=0) for index in range(3))
+        present = np.flatnonzero(counts)
+        merged.append((present, quantity[present], amount[present], counts[present]))
+    if not merged:
+        return np.zeros(0, np.intp), np.zeros(0), np.zeros(0), np.zeros(0)
+    if len(merged) == 1:
+        result = merged[0]
+    else:
+        present, inverse = np.unique(np.concatenate([result[0] for result in merged]), return_inverse=True)
+        result = (present,) + tuple(
+            np.bincount(inverse, weights=np.concatenate([result[index] for result in merged]), minlength=len(present))
+            for index in (1, 2, 3)
+        )
+    # Blocks whose line items were all cancelled since are left in, empty
+    kept = result[3] > 0
+    return result if kept.all() else tuple(column[kept] for column in result)
+
+_pool: Optional[ThreadPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+def _scan_all(view: Dict[str, np.ndarray], scan: _Scan) -> List[Tuple]:
+    rows = len(view["ts"])
+    # Enough rows per slice that adding up per-slice bins stays cheap
+    slices = min(SALES_CUBE_THREADS, rows // max(SCAN_SLICE_ROWS, 4 * min(scan.groups, DENSE_GROUP_LIMIT)))
+    if slices <= 1:
+        return [_scan(view, scan)]
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=SALES_CUBE_THREADS, thread_name_prefix="sales-cube")
+    bounds = np.linspace(0, rows, slices + 1).astype(int)
+    return list(_pool.map(
+        lambda index: _scan(_take(view, slice(bounds[index], bounds[index + 1])), scan), range(slices)
+    ))
+
+class _Blocks:
+    """Totals of the cube's rows by day and product, sorted by day, then
+    product. Questions grouping and filtering by nothing else, over whole
+    days, sum these instead of the rows: a product sold many times a day is
+    one block."""
+
+    def __init__(self):
+        self._keys = np.empty(0, np.int64)
+        # Quantity, amount and line items of each block
+        self._values = np.empty((3, 0))
+        self._size = 0
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _reserve(self, blocks: int):
+        capacity = len(self._keys)
+        if blocks <= capacity:
+            return
+        capacity = max(blocks, capacity + capacity // 4, 1024)
+        keys, values = np.empty(capacity, np.int64), np.empty((3, capacity))
+        keys[:self._size], values[:, :self._size] = self._keys[:self._size], self._values[:, :self._size]
+        self._keys, self._values = keys, values
+
+    def add(self, ts: np.ndarray, product_ids: np.ndarray, quantity: np.ndarray, amount: np.ndarray,
+            line_items: np.ndarray):
+        """Add rows to their blocks; negative ones take them out."""
+        if not len(ts):
+            return
+        keys, inverse = np.unique(ts // DAY << 32 | product_ids.astype(np.int64), return_inverse=True)
+        sums = np.stack([np.bincount(inverse, weights=column, minlength=len(keys))
+                         for column in (quantity, amount, line_items)])
+        size = self._size
+        held = self._keys[:size]
+        positions = np.searchsorted(held, keys)
+        found = positions < size
+        found[found] = held[positions[found]] == keys[found]
+        self._values[:, positions[found]] += sums[:, found]
+        if found.all():
+            return
+        # Merged into the blocks from the first new one on; rows arrive
+        # mostly in time order, so that is usually just the last day's
+        first = int(positions[~found][0])
+        merged_keys = np.concatenate([held[first:], keys[~found]])
+        merged_values = np.concatenate([self._values[:, first:size], sums[:, ~found]], axis=1)
+        order = np.argsort(merged_keys, kind="stable")
+        self._reserve(size + int(np.count_nonzero(~found)))
+        self._keys[first:first + len(order)] = merged_keys[order]
+        self._values[:, first:first + len(order)] = merged_values[:, order]
+        self._size = first + len(order)
+
+    def view(self, start: Optional[int], end: Optional[int]) -> Dict[str, np.ndarray]:
+        """The blocks of the days from ``start`` to ``end``, as cube columns
+        with a line_items column."""
+        keys = self._keys[:self._size]
+        low = int(np.searchsorted(keys, start // DAY << 32)) if start is not None else 0
+        high = int(np.searchsorted(keys, (end // DAY + 1) << 32)) if end is not None else len(keys)
+        keys = keys[low:high]
+        return {
+            "ts": (keys >> 32) * DAY,
+            "product_id": keys & 0xFFFFFFFF,
+            "quantity": self._values[0, low:high],
+            "amount": self._values[1, low:high],
+            "line_items": self._values[2, low:high],
+        }
+
+def _answered_by_blocks(start: Optional[int], end: Optional[int], group_by: Sequence[str],
+                        customer_ids: Sequence[int], user_ids: Sequence[int], hours: Sequence[int]) -> bool:
+    return (
+        set(group_by) <= {"day", "product"} and not (customer_ids or user_ids or hours)
+        and (start is None or start % DAY == 0) and (end is None or end % DAY == DAY - 1)
+    )
+
+def _slice_days(columns: Dict[str, np.ndarray], start: Optional[int], end: Optional[int]) -> Dict[str, np.ndarray]:
+    ts = columns["ts"]
+    low = int(np.searchsorted(ts, start, side="left")) if start is not None else 0
+    high = int(np.searchsorted(ts, end, side="right")) if end is not None else len(ts)
+    return _take(columns, slice(low, max(low, high)))
+
+class SalesCube:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._columns = _empty()
+        self._size = 0
+        self._excluded = 0
+        # Highest sale item id appended; later ones are read by every query
+        self._last_id = 0
+        self._max_ids = {column: 0 for column in ID_COLUMNS.values()}
+        self._loaded = False
+        # Highest sale_status_changes id applied; later ones are read by every query
+        self._last_change_id = 0
+        self._young_changes: Set[int] = set()
+        self._blocks = _Blocks()
+
+    def __len__(self) -> int:
+        return self._size
+
+    @property
+    def loaded(self) -> bool:
+        return self._loaded
+
+    @property
+    def block_count(self) -> int:
+        return len(self._blocks)
+
+    def reserve(self, rows: int):
+        """Make room for ``rows`` more rows at once, instead of growing the
+        columns step by step as they are appended."""
+        capacity = len(self._columns["ts"])
+        if self._size + rows <= capacity:
+            return
+        # Grow by a quarter: a copy of every column is held while growing
+        capacity = max(self._size + rows, capacity + capacity // 4, 1024)
+        for name, column in self._columns.items():
+            grown = np.empty(capacity, column.dtype)
+            grown[:self._size] = column[:self._size]
+            self._columns[name] = grown
+
+    def append(self, columns: Dict[str, np.ndarray]):
+        """Add rows (a column per name in COLUMNS), keeping time order."""
+        rows = len(columns["ts"])
+        if not rows:
+            return
+        self.reserve(rows)
+        self._excluded += int(np.count_nonzero(columns["excluded"]))
+        counted = ~columns["excluded"]
+        self._blocks.add(columns["ts"][counted], columns["product_id"][counted], columns["quantity"][counted],
+                         columns["amount"][counted], np.ones(int(np.count_nonzero(counted))))
+        for column in self._max_ids:
+            self._max_ids[column] = max(self._max_ids[column], int(columns[column].max()))
+
+        columns = _take(columns, np.argsort(columns["ts"], kind="stable"))
+        ts, size = self._columns["ts"], self._size
+        start = size
+        if size and columns["ts"][0] < ts[size - 1]:
+            # Older than rows already in (backdated imports, transactions
+            # committing out of order): merge with the rows they overlap
+            start = int(np.searchsorted(ts[:size], columns["ts"][0], side="right"))
+            columns = {name: np.concatenate([self._columns[name][start:size], columns[name]]) for name in COLUMNS}
+            columns = _take(columns, np.argsort(columns["ts"], kind="stable"))
+        for name, column in columns.items():
+            self._columns[name][start:start + len(column)] = column
+        self._size = size + rows
+
+    def _catch_up(self, db: Session) -> Dict[str, np.ndarray]:
+        """Append the sale items added since the last call and return those
+        still in the grace period."""
+        cutoff = time.time() - SALES_CUBE_GRACE_SECONDS
+        after, young, reads = self._last_id, [], 0
+        while True:
+            if reads:
+                # A burst of sales, or the initial load
+                _count_extra_read(db)
+            reads += 1
+            ids, columns = _read(db, after, LOAD_CHUNK_SIZE)
+            if not len(ids):
+                break
+            after = int(ids[-1])
+            if not young:
+                # Keep the items up to the first young one; the rest are read again next time
+                settled = np.flatnonzero(columns["ts"] > cutoff)
+                settled = int(settled[0]) if len(settled) else len(ids)
+                if settled:
+                    self.append(_take(columns, slice(0, settled)))
+                    self._last_id = int(ids[settled - 1])
+                if settled < len(ids):
+                    young.append(_take(columns, slice(settled, None)))
+            else:
+                young.append(columns)
+            if len(ids) < LOAD_CHUNK_SIZE:
+                break
+        return _concat(young)
+
+    def _load(self, db: Session):
+        # The rows are read with their current status, so the changes logged
+        # before the load are already in them; the young ones are read again
+        cutoff = datetime.utcnow() - timedelta(seconds=SALES_CUBE_GRACE_SECONDS)
+        self._last_change_id = db.scalar(
+            select(func.max(models.SaleStatusChange.id)).where(models.SaleStatusChange.created_at <= cutoff)
+        ) or 0
+        rows = db.scalar(select(func.count(models.SaleItem.id)))
+        self.reserve(rows or 0)
+        self._catch_up(db)
+        self._loaded = True
+
+    def load(self, db: Session):
+        with self._lock:
+            if not self._loaded:
+                self._load(db)
+
+    def _catch_up_changes(self, db: Session):
+        """Apply the sale status changes logged since the last call. Those
+        younger than SALES_CUBE_GRACE_SECONDS are read again next time, and
+        a sale is re-applied if an older change of it shows up late, so its
+        latest change wins."""
+        cutoff = datetime.utcnow() - timedelta(seconds=SALES_CUBE_GRACE_SECONDS)
+        log = models.SaleStatusChange
+        after, rows = self._last_change_id, []
+        while True:
+            if rows:
+                _count_extra_read(db)
+            chunk = db.execute(
+                select(log.id, log.sale_id, log.status, log.created_at)
+                .where(log.id > after)
+                .order_by(log.id)
+                .limit(LOAD_CHUNK_SIZE)
+            ).all()
+            rows.extend(chunk)
+            if len(chunk) < LOAD_CHUNK_SIZE:
+                break
+            after = chunk[-1].id
+
+        touched = {row.sale_id for row in rows if row.id not in self._young_changes}
+        self._apply_changes({
+            row.sale_id: row.status is None or not counts_in_rollup(row.status)
+            for row in rows if row.sale_id in touched
+        })
+        for row in rows:
+            if row.created_at > cutoff:
+                break
+            self._last_change_id = row.id
+        self._young_changes = {row.id for row in rows if row.id > self._last_change_id}
+
+    def _apply_changes(self, changes: Dict[int, bool]):
+        if not changes or not self._size:
+            return
+        sale_ids = np.array(sorted(changes), np.int64)
+        excluded = np.array([changes[sale_id] for sale_id in sale_ids.tolist()], np.bool_)
+        column = self._columns["sale_id"][:self._size]
+        rows = np.flatnonzero(np.isin(column, sale_ids))
+        if not len(rows):
+            return
+        new = excluded[np.searchsorted(sale_ids, column[rows])]
+        flags = self._columns["excluded"]
+        self._excluded += int(np.count_nonzero(new)) - int(np.count_nonzero(flags[rows]))
+        flipped = new != flags[rows]
+        moved, sign = rows[flipped], np.where(new[flipped], -1.0, 1.0)
+        self._blocks.add(self._columns["ts"][moved], self._columns["product_id"][moved],
+                         self._columns["quantity"][moved] * sign, self._columns["amount"][moved] * sign, sign)
+        flags[rows] = new
+
+    def query(self, db: Session,
+              start_date: Optional[datetime] = None,
+              end_date: Optional[datetime] = None,
+              product_ids: Sequence[int] = (),
+              customer_ids: Sequence[int] = (),
+              user_ids: Sequence[int] = (),
+              hours: Sequence[int] = (),
+              group_by: Sequence[str] = (),
+              order_by: str = "revenue",
+              limit: int = 100) -> Dict[str, Any]:
+        """Totals of the sale items matching every filter given, grouped by
+        the ``group_by`` dimensions (DIMENSIONS), largest ``order_by`` first.
+
+        Empty filters match everything; ``customer_ids`` matches sales
+        without a customer with 0.
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load(db)
+            young = self._catch_up(db)
+            self._catch_up_changes(db)
+            start = epoch_seconds(start_date) if start_date else None
+            end = epoch_seconds(end_date) if end_date else None
+            if _answered_by_blocks(start, end, group_by, customer_ids, user_ids, hours):
+                settled = (self._blocks.view(start, end), False)
+            else:
+                settled = (_slice_days(_take(self._columns, slice(0, self._size)), start, end), self._excluded > 0)
+            parts = [
+                (settled[0], True, settled[1]),
+                (young, False, bool(young["excluded"].any())),
+            ]
+            first_day, last_day = self._day_range(parts, start, end)
+            max_ids = {column: int(young[column].max(initial=top)) for column, top in self._max_ids.items()}
+
+            sizes = []
+            for dimension in group_by:
+                if dimension == "day":
+                    sizes.append(last_day - first_day + 1)
+                elif dimension == "hour":
+                    sizes.append(24)
+                else:
+                    sizes.append(max_ids[ID_COLUMNS[dimension]] + 1)
+            tables = [
+                (column, _lookup_table(ids, 23 if column == "hour" else max_ids[column]))
+                for column, ids in (
+                    ("product_id", product_ids), ("customer_id", customer_ids),
+                    ("user_id", user_ids), ("hour", hours)
+                ) if ids
+            ]
+
+            results = []
+            for columns, is_sorted, has_excluded in parts:
+                if not len(columns["ts"]):
+                    continue
+                results.extend(_scan_all(columns, _Scan(
+                    is_sorted, start, end, has_excluded, tables, group_by, sizes, first_day,
+                    int(np.prod(sizes, dtype=np.float64)) if sizes else 1
+                )))
+
+        return self._result(_merge(results), group_by, sizes, first_day, order_by, limit)
+
+    @staticmethod
+    def _day_range(parts, start: Optional[int], end: Optional[int]) -> Tuple[int, int]:
+        # Only the young rows are not in time order
+        bounds = [
+            (columns["ts"][0], columns["ts"][-1]) if is_sorted else (columns["ts"].min(), columns["ts"].max())
+            for columns, is_sorted, _ in parts if len(columns["ts"])
+        ]
+        first = start if start is not None else int(min((low for low, _ in bounds), default=0))
+        last = end if end is not None else int(max((high for _, high in bounds), default=0))
+        return first // DAY, max(first, last) // DAY
+
+    @staticmethod
+    def _result(merged, group_by: Sequence[str], sizes: Sequence[int], first_day: int,
+                order_by: str, limit: int) -> Dict[str, Any]:
+        present, quantity, amount, counts = merged
+        totals = {"quantity": quantity, "revenue": amount, "line_items": counts}
+
+        metric = totals[order_by]
+        if len(present) > limit:
+            top = np.argpartition(-metric, limit - 1)[:limit]
+        else:
+            top = np.arange(len(present))
+        # Largest first, ties by group
+        top = top[np.lexsort((present[top], -metric[top]))]
+
+        decoded = {}
+        keys = present[top]
+        for dimension, size in reversed(list(zip(group_by, sizes))):
+            decoded[dimension] = keys % size
+            keys = keys // size
+        groups = []
+        for row, index in enumerate(top.tolist()):
+            group = {}
+            for dimension in group_by:
+                value = int(decoded[dimension][row])
+                if dimension == "day":
+                    group[dimension] = date(1970, 1, 1) + timedelta(days=first_day + value)
+                elif dimension == "customer":
+                    group["customer_id"] = value or None
+                elif dimension == "hour":
+                    group[dimension] = value
+                else:
+                    group[ID_COLUMNS[dimension]] = value
+            group.update(
+                quantity=int(totals["quantity"][index]),
+                revenue=float(totals["revenue"][index]),
+                line_items=int(totals["line_items"][index])
+            )
+            groups.append(group)
+
+        return {
+            "group_by": list(group_by),
+            "groups": groups,
+            "totals": {
+                "quantity": int(totals["quantity"].sum()),
+                "revenue": float(totals["revenue"].sum()),
+                "line_items": int(totals["line_items"].sum()),
+            },
+            "as_of": datetime.utcnow(),
+        }
+
+cube = SalesCube()
+
+def load():
+    from ..database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        cube.load(db)
+    finally:
+        db.close()
+
+def query(**filters) -> Tuple[Dict[str, Any], int]:
+    """The answer of cube.query, and how many more reads than one per
+    catch-up it made (EXTRA_READS)."""
+    from ..database import SessionLocal
+
+    if not cube.loaded:
+        # From an empty context, so the one-off load is not counted as the request's statements
+        contextvars.Context().run(load)
+    db = SessionLocal()
+    try:
+        return cube.query(db, **filters), db.info.get(EXTRA_READS, 0)
+    finally:
+        db.close()
@@ -0,0 +1,205 @@
+"""In-process scheduler that precomputes the sales reports.
+
+Reports are generated off the request path: once on startup, then on a
+cron-like schedule, and whenever a client asks with ?refresh=true. The
+schedules are "minute hour" cron fields in UTC (each a number, a list,
+"*" or "*/n"), set with REPORT_SCHEDULE_DAILY, REPORT_SCHEDULE_WEEKLY and
+REPORT_SCHEDULE_MONTHLY.
+
+Jobs are single-flight: asking for a report that is already queued or
+running returns that job instead of queuing another. One worker runs the
+jobs one at a time, building each report in the analytics pool
+(utils.analytics_pool); a job can be cancelled while queued or running, and
+fails when it runs out of ANALYTICS_TIMEOUT_SECONDS.
+"""
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Set, Tuple
+import asyncio
+import contextvars
+import logging
+import os
+import uuid
+from fastapi.concurrency import run_in_threadpool
+from . import analytics_pool
+from .reports import REPORT_GENERATORS, REPORT_WINDOWS, report_window, store_report
+
+REPORT_SCHEDULES = {
+    ("daily_sales", "daily"): os.getenv("REPORT_SCHEDULE_DAILY", "*/5 *"),
+    ("weekly_sales", "weekly"): os.getenv("REPORT_SCHEDULE_WEEKLY", "*/15 *"),
+    ("monthly_sales", "monthly"): os.getenv("REPORT_SCHEDULE_MONTHLY", "0 *"),
+}
+# Finished jobs kept for status polling
+REPORT_JOB_HISTORY = 200
+# Overrides the age past which a report counts as stale, which is otherwise
+# derived from its schedule (max_age)
+REPORT_MAX_AGE_SECONDS = os.getenv("REPORT_MAX_AGE_SECONDS")
+# For reports that are not on a schedule
+UNSCHEDULED_MAX_AGE_SECONDS = 300
+
+logger = logging.getLogger(__name__)
+
+def parse_field(field: str, limit: int) -> Set[int]:
+    values = set()
+    for part in field.split(","):
+        if part == "*":
+            values.update(range(limit))
+        elif part.startswith("*/"):
+            values.update(range(0, limit, int(part[2:])))
+        else:
+            values.add(int(part))
+    if not values or not all(0 <= value < limit for value in values):
+        raise ValueError(f"invalid cron field {field!r}")
+    return values
+
+class CronSchedule:
+    def __init__(self, spec: str):
+        minute, hour = spec.split()
+        self.spec = spec
+        self.minutes = parse_field(minute, 60)
+        self.hours = parse_field(hour, 24)
+
+    def matches(self, moment: datetime) -> bool:
+        return moment.minute in self.minutes and moment.hour in self.hours
+
+    def longest_gap(self) -> timedelta:
+        """The longest time between two runs, across midnight included."""
+        times = sorted(hour * 60 + minute for hour in self.hours for minute in self.minutes)
+        gaps = [later - earlier for earlier, later in zip(times, times[1:])]
+        gaps.append(times[0] + 24 * 60 - times[-1])
+        return timedelta(minutes=max(gaps))
+
+def max_age(report_type: str, period: str) -> timedelta:
+    """How old the latest report may be before it counts as stale: once the
+    scheduled run that should have replaced it has had its time to finish."""
+    if REPORT_MAX_AGE_SECONDS:
+        return timedelta(seconds=int(REPORT_MAX_AGE_SECONDS))
+    spec = REPORT_SCHEDULES.get((report_type, period))
+    if spec is None:
+        return timedelta(seconds=UNSCHEDULED_MAX_AGE_SECONDS)
+    return CronSchedule(spec).longest_gap() + timedelta(seconds=analytics_pool.ANALYTICS_TIMEOUT_SECONDS)
+
+class Job:
+    def __init__(self, report_type: str, period: str):
+        self.id = uuid.uuid4().hex
+        self.report_type = report_type
+        self.period = period
+        self.status = "queued"
+        self.enqueued_at = datetime.utcnow()
+        self.started_at: Optional[datetime] = None
+        self.finished_at: Optional[datetime] = None
+        self.error: Optional[str] = None
+        self.analytics: Optional[analytics_pool.AnalyticsJob] = None
+        self.done = asyncio.Event()
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished_at = datetime.utcnow()
+        key = (self.report_type, self.period)
+        if _pending.get(key) is self:
+            del _pending[key]
+        self.done.set()
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_queue: Optional[asyncio.Queue] = None
+_tasks: List[asyncio.Task] = []
+_pending: Dict[Tuple[str, str], Job] = {}
+_jobs: "OrderedDict[str, Job]" = OrderedDict()
+
+def _spawn(coro) -> asyncio.Task:
+    # Started from an empty context, so a worker started by a request does not
+    # report the statements of every later job as that request's
+    return contextvars.Context().run(asyncio.get_running_loop().create_task, coro)
+
+def _ensure_worker():
+    global _loop, _queue
+    loop = asyncio.get_running_loop()
+    if _loop is loop:
+        return
+    # First use, or a new event loop (tests); jobs of the old loop cannot finish
+    _loop, _queue = loop, asyncio.Queue()
+    _pending.clear()
+    _tasks[:] = [_spawn(_work())]
+
+async def _work():
+    while True:
+        job = await _queue.get()
+        if job.status != "queued":
+            # Cancelled while queued
+            continue
+        job.analytics = analytics_pool.AnalyticsJob()
+        job.status = "running"
+        job.started_at = datetime.utcnow()
+        try:
+            start_date, end_date = report_window(REPORT_WINDOWS[(job.report_type, job.period)])
+            data = await analytics_pool.sales_report(start_date, end_date, job.analytics)
+            await run_in_threadpool(store_report, job.report_type, job.period, data)
+            job.finish("succeeded")
+        except analytics_pool.JobCancelled:
+            job.finish("cancelled")
+        except analytics_pool.AnalyticsTimeout:
+            logger.error("report job %s %s timed out", job.report_type, job.period)
+            job.finish("failed", "timed out")
+        except Exception as e:
+            logger.exception("report job %s %s failed", job.report_type, job.period)
+            job.finish("failed", str(e))
+        except asyncio.CancelledError:
+            job.finish("cancelled")
+            raise
+
+def enqueue(report_type: str, period: str) -> Job:
+    """Queue a regeneration of a report, or return the one already pending."""
+    key = (report_type, period)
+    if key not in REPORT_GENERATORS:
+        raise KeyError(key)
+    _ensure_worker()
+    job = _pending.get(key)
+    if job is None:
+        job = _pending[key] = Job(report_type, period)
+        _jobs[job.id] = job
+        while len(_jobs) > REPORT_JOB_HISTORY:
+            _jobs.popitem(last=False)
+        _queue.put_nowait(job)
+    return job
+
+def get_job(job_id: str) -> Optional[Job]:
+    return _jobs.get(job_id)
+
+def cancel(job: Job):
+    """Cancel a queued or running job; finished ones are left as they are."""
+    if job.status == "queued":
+        job.finish("cancelled")
+    elif job.status == "running" and job.analytics is not None:
+        job.analytics.cancel()
+
+async def _run_schedule(schedules: Dict[Tuple[str, str], CronSchedule]):
+    for key in schedules:
+        enqueue(*key)
+    last = None
+    while True:
+        now = datetime.utcnow()
+        await asyncio.sleep(60 - now.second - now.microsecond / 1_000_000)
+        moment = datetime.utcnow().replace(second=0, microsecond=0)
+        if moment == last:
+            continue
+        last = moment
+        for key, schedule in schedules.items():
+            if schedule.matches(moment):
+                enqueue(*key)
+
+def start():
+    """Precompute every report now and then on its schedule; call from the
+    app's startup hook."""
+    schedules = {key: CronSchedule(spec) for key, spec in REPORT_SCHEDULES.items()}
+    _ensure_worker()
+    _tasks.append(_spawn(_run_schedule(schedules)))
+
+async def stop():
+    global _loop, _queue
+    for task in _tasks:
+        task.cancel()
+    await asyncio.gather(*_tasks, return_exceptions=True)
+    _tasks.clear()
+    _pending.clear()
+    _loop = _queue = None
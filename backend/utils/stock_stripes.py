@@ -0,0 +1,156 @@
+"""Striped stock for hot products.
+
+Every checkout of a product decrements its one products row, so during a
+flash sale all registers queue on that row's lock. A product given N stock
+stripes keeps its stock in N product_stock_stripes rows instead, and each
+checkout decrements one picked at random, so up to N checkouts of it
+proceed at once. Its stock is products.stock (normally 0, voids are put
+back there) plus the sum of the stripes; inventory.stock_levels reads it
+exactly.
+
+When the picked stripe cannot cover a checkout, the product's rows are
+locked and the stock left is spread evenly over the stripes again.
+
+These paths run more statements than a plain checkout. They are counted in
+the session's info under STRIPED_TAKES, REBALANCES and RESPREADS, so the
+routes can allow for them in their query budgets.
+"""
+from typing import Dict, List, Set, Tuple
+import random
+from sqlalchemy import bindparam, case, delete, insert, select, tuple_, update
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import set_committed_value
+from .. import models
+
+STRIPED_TAKES = "striped_takes"
+REBALANCES = "stripe_rebalances"
+RESPREADS = "stripe_respreads"
+
+def _count(db: Session, path: str):
+    db.info[path] = db.info.get(path, 0) + 1
+
+def take_stock(db: Session, products: Dict[int, models.Product], quantities: Dict[int, int],
+               rng: random.Random = random) -> List[int]:
+    """Decrement the stock of striped products; returns the ids of those
+    that are short. If it is not empty the caller must roll back."""
+    if not quantities:
+        return []
+    _count(db, STRIPED_TAKES)
+    picks = {product_id: rng.randrange(products[product_id].stock_stripes) for product_id in quantities}
+
+    # On PostgreSQL an UPDATE that waited for a stripe and then found it
+    # short keeps it locked. Holding it into _rebalance, which locks all the
+    # product's stripes, deadlocks with another checkout doing the same, so
+    # a short pick rolls back to the savepoint, letting go of every stripe
+    # picked, and each product is rebalanced instead.
+    savepoint = db.begin_nested()
+    taken = _take_picked(db, quantities, picks)
+    if len(taken) == len(quantities):
+        savepoint.commit()
+        return []
+    savepoint.rollback()
+    # In id order, as every rebalance locks its product row first
+    return [
+        product_id for product_id in sorted(quantities)
+        if not _rebalance(db, products[product_id], quantities[product_id])
+    ]
+
+def _take_picked(db: Session, quantities: Dict[int, int], picks: Dict[int, int]) -> Set[int]:
+    stripes = models.ProductStockStripe
+    if db.get_bind().dialect.update_returning:
+        delta = case(quantities, value=stripes.product_id)
+        return set(db.scalars(
+            update(stripes)
+            .where(tuple_(stripes.product_id, stripes.stripe).in_(list(picks.items())), stripes.stock >= delta)
+            .values(stock=stripes.stock - delta)
+            .returning(stripes.product_id)
+            .execution_options(synchronize_session=False)
+        ))
+    # Without RETURNING only the row count tells whether a stripe matched
+    return {
+        product_id for product_id, quantity in quantities.items()
+        if db.execute(
+            update(stripes)
+            .where(stripes.product_id == product_id, stripes.stripe == picks[product_id],
+                   stripes.stock >= quantity)
+            .values(stock=stripes.stock - quantity)
+            .execution_options(synchronize_session=False)
+        ).rowcount
+    }
+
+def _lock_stock(db: Session, product_id: int) -> Tuple[int, List]:
+    # products.stock, then the stripes in order, all locked until commit;
+    # locking the stripes waits for the checkouts decrementing them and reads
+    # their result. Taking the product row first queues rebalances of a
+    # product behind each other instead of deadlocking over its stripes, and
+    # FOR NO KEY UPDATE leaves it open to the key-share lock that checkouts
+    # holding a stripe take through their sale items' foreign key.
+    stock = db.scalar(
+        select(models.Product.stock).where(models.Product.id == product_id).with_for_update(key_share=True)
+    )
+    stripes = db.execute(
+        select(models.ProductStockStripe.stripe, models.ProductStockStripe.stock)
+        .where(models.ProductStockStripe.product_id == product_id)
+        .order_by(models.ProductStockStripe.stripe)
+        .with_for_update()
+    ).all()
+    return stock or 0, stripes
+
+def _rebalance(db: Session, product: models.Product, quantity: int) -> bool:
+    # Locks the product and all its stripes, so it only runs when a stripe is short
+    _count(db, REBALANCES)
+    stripes = models.ProductStockStripe
+    column, rows = _lock_stock(db, product.id)
+    if not rows:
+        return False
+    striped = sum(row.stock for row in rows)
+    if column + striped < quantity:
+        return False
+    if striped < quantity:
+        # Only now draw on the stock put back into products.stock by voids
+        _count(db, RESPREADS)
+        spread_stock(db, product, column + striped - quantity, product.stock_stripes)
+        return True
+
+    share, extra = divmod(striped - quantity, len(rows))
+    db.execute(
+        update(stripes.__table__)
+        .where(stripes.product_id == product.id, stripes.stripe == bindparam("stripe_number"))
+        .values(stock=bindparam("new_stock")),
+        [
+            {"stripe_number": row.stripe, "new_stock": share + (1 if index < extra else 0)}
+            for index, row in enumerate(rows)
+        ]
+    )
+    return True
+
+def spread_stock(db: Session, product: models.Product, stock: int, stripes: int):
+    """Set the stock of ``product`` to ``stock``, split evenly over ``stripes``
+    stripes, or all in products.stock when ``stripes`` is 0."""
+    db.execute(
+        delete(models.ProductStockStripe)
+        .where(models.ProductStockStripe.product_id == product.id)
+        .execution_options(synchronize_session=False)
+    )
+    if stripes:
+        share, extra = divmod(stock, stripes)
+        db.execute(insert(models.ProductStockStripe), [
+            {"product_id": product.id, "stripe": stripe, "stock": share + (1 if stripe < extra else 0)}
+            for stripe in range(stripes)
+        ])
+    column = 0 if stripes else stock
+    db.execute(
+        update(models.Product)
+        .where(models.Product.id == product.id)
+        .values(stock=column, stock_stripes=stripes)
+        .execution_options(synchronize_session=False)
+    )
+    set_committed_value(product, "stock", column)
+    set_committed_value(product, "stock_stripes", stripes)
+
+def set_stripes(db: Session, product: models.Product, stripes: int):
+    """Spread the stock of ``product`` over ``stripes`` stripes, or gather it
+    back into products.stock with 0. In ledger mode only the compacted
+    stock moves; the movements after it apply on top as before."""
+    column, rows = _lock_stock(db, product.id)
+    spread_stock(db, product, column + sum(row.stock for row in rows), stripes)
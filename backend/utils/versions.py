@@ -0,0 +1,223 @@
+"""Change versions shared by every worker process.
+
+In-process caches (the catalog pages, the customer index) are keyed by the
+version of the data they were built from. Each committed change appends a
+ChangeEvent for its topic in the writer's own transaction, so the version
+moves exactly when the change becomes visible, in every process. Appending
+rather than incrementing a counter row keeps checkouts from queueing on a
+shared row; fold_events periodically moves the events into ChangeCounter.
+
+A topic's version is its folded count plus its events not folded yet, read
+in one statement so a fold committing meanwhile is seen whole or not at all.
+Read the version before the data it guards: a change committed in between
+then only makes the cached data newer than its version, never older.
+
+Versions read are kept in memory for VERSION_CACHE_SECONDS, so most
+requests, 304s included, answer from them without touching the database. A
+change committed by another worker is seen once that interval runs out; a
+change committed through this process's sessions is seen at once, as the
+topics passed to record_change are forgotten when their transaction commits.
+
+A change to one row can name it, so a cache of the topic's rows can apply
+only the rows changed since it was built (changes_since) instead of reading
+them all again. Events folded before the cache saw them are detected by
+their count falling short of the version's step, and must be reloaded.
+
+    python -m backend.utils.versions   # fold now
+"""
+from collections import Counter
+from typing import Dict, List, NamedTuple, Optional, Sequence, Tuple
+import asyncio
+import logging
+import os
+import time
+from sqlalchemy import Select, and_, delete, event, func, select, update
+from sqlalchemy.engine import Row
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from .. import models
+
+# Product details and prices
+CATALOG = "catalog"
+# Stock levels, moved by every checkout and void
+STOCK = "stock"
+CUSTOMERS = "customers"
+# Accounts and their flags, behind the principals cached by auth
+USERS = "users"
+
+CHANGE_FOLD_INTERVAL_SECONDS = int(os.getenv("CHANGE_FOLD_INTERVAL_SECONDS", "10"))
+VERSION_CACHE_SECONDS = float(os.getenv("VERSION_CACHE_SECONDS", "1"))
+FOLD_CHUNK_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+# topic -> (version, time.monotonic() it was read at)
+_known: Dict[str, Tuple[int, float]] = {}
+# Bumped when a topic is forgotten, so a read that began before is not kept
+_forgotten: Counter = Counter()
+# Key in a session's info of the topics its transaction changed
+_CHANGED_TOPICS = "changed_topics"
+
+def record_change(db: Session, topic: str, row_id: Optional[int] = None):
+    """Call in the transaction of any change to ``topic``, before it commits.
+    ``row_id`` is the one row it changed, if there is one."""
+    db.execute(models.ChangeEvent.__table__.insert().values(topic=topic, row_id=row_id))
+    db.info.setdefault(_CHANGED_TOPICS, set()).add(topic)
+
+@event.listens_for(Session, "after_commit")
+def _forget_changed(session: Session):
+    for topic in session.info.pop(_CHANGED_TOPICS, ()):
+        _known.pop(topic, None)
+        _forgotten[topic] += 1
+
+@event.listens_for(Session, "after_rollback")
+def _drop_changed(session: Session):
+    session.info.pop(_CHANGED_TOPICS, None)
+
+def forget_versions():
+    """Read every version from the database again next time."""
+    for topic in list(_known):
+        _known.pop(topic, None)
+        _forgotten[topic] += 1
+
+def version_columns(*topics: str) -> List:
+    counters, events = models.ChangeCounter, models.ChangeEvent
+    columns = []
+    for topic in topics:
+        folded = select(counters.folded).where(counters.topic == topic).scalar_subquery()
+        pending = select(func.count()).select_from(events).where(events.topic == topic).scalar_subquery()
+        columns.append(func.coalesce(folded, 0) + pending)
+    return columns
+
+def version_statement(*topics: str):
+    return select(*version_columns(*topics))
+
+def known_version(topic: str) -> Optional[int]:
+    """The version of ``topic`` if it was read less than
+    VERSION_CACHE_SECONDS ago, without going to the database."""
+    entry = _known.get(topic)
+    if entry is None or time.monotonic() - entry[1] >= VERSION_CACHE_SECONDS:
+        return None
+    return entry[0]
+
+async def read_with_versions(db: AsyncSession, statement: Select, topics: Sequence[str]) -> Optional[Row]:
+    """Run ``statement``, which returns at most one row, with the versions of
+    ``topics`` added as its last columns, and remember them like
+    current_versions does."""
+    now = time.monotonic()
+    generations = [_forgotten[topic] for topic in topics]
+    row = (await db.execute(statement.add_columns(*version_columns(*topics)))).first()
+    if row is None:
+        return None
+    _remember(topics, generations, row[len(row) - len(topics):], now)
+    return row
+
+def _remember(topics: Sequence[str], generations: Sequence[int], read: Sequence[int], now: float):
+    for topic, generation, version in zip(topics, generations, read):
+        entry = _known.get(topic)
+        # Versions only grow; a slower read finishing last must not go back
+        if generation == _forgotten[topic] and (entry is None or version >= entry[0]):
+            _known[topic] = (version, now)
+
+class Changes(NamedTuple):
+    version: int
+    # The newest event of the topic, to pass as after_event_id next time
+    last_event_id: int
+    # Row ids of the events after after_event_id, oldest first; None where
+    # an event did not name a row
+    row_ids: List[Optional[int]]
+
+async def changes_since(db: AsyncSession, topic: str, after_event_id: int) -> Changes:
+    """The version of ``topic`` and its events after ``after_event_id``,
+    read in one statement and remembered like current_versions does.
+
+    The events explain the step from an earlier version only if there are
+    exactly as many of them: any fewer and some were folded, or committed
+    with an id below ``after_event_id``, and the rows must be read again."""
+    events = models.ChangeEvent
+    newest = select(func.max(events.id)).where(events.topic == topic).scalar_subquery()
+    head = select(version_columns(topic)[0].label("version"), newest.label("last_event_id")).subquery()
+    statement = (
+        select(head.c.version, head.c.last_event_id, events.id, events.row_id)
+        .select_from(head.outerjoin(events, and_(events.topic == topic, events.id > after_event_id)))
+        .order_by(events.id)
+    )
+    now = time.monotonic()
+    generations = [_forgotten[topic]]
+    rows = (await db.execute(statement)).all()
+    version, last_event_id = rows[0].version, rows[0].last_event_id
+    _remember([topic], generations, [version], now)
+    return Changes(
+        version,
+        after_event_id if last_event_id is None else last_event_id,
+        [row.row_id for row in rows if row.id is not None],
+    )
+
+async def current_versions(db: AsyncSession, topics: Sequence[str]) -> Tuple[int, ...]:
+    """The versions of ``topics``, all read in one statement if any of them
+    is not known or was read more than VERSION_CACHE_SECONDS ago."""
+    known = [known_version(topic) for topic in topics]
+    if all(version is not None for version in known):
+        return tuple(known)
+    return tuple(await read_with_versions(db, select(), topics))
+
+async def current_version(db: AsyncSession, topic: str) -> int:
+    return (await current_versions(db, [topic]))[0]
+
+def _take_events(db: Session, limit: int) -> List[str]:
+    # Deleted and read back in one statement, like the rollup deltas
+    events = models.ChangeEvent.__table__
+    if db.get_bind().dialect.delete_returning:
+        oldest = select(events.c.id).order_by(events.c.id).limit(limit)
+        return db.scalars(delete(events).where(events.c.id.in_(oldest)).returning(events.c.topic)).all()
+    rows = db.execute(select(events.c.id, events.c.topic).order_by(events.c.id).limit(limit)).all()
+    if rows and db.execute(delete(events).where(events.c.id.in_([row.id for row in rows]))).rowcount != len(rows):
+        raise RuntimeError("change events folded concurrently")
+    return [row.topic for row in rows]
+
+def fold_events(db: Session, limit: int = FOLD_CHUNK_SIZE) -> int:
+    """Move up to ``limit`` of the oldest events into the counters. Versions
+    do not change. Returns how many were folded; the caller commits."""
+    topics = _take_events(db, limit)
+    counters = models.ChangeCounter.__table__
+    for topic, count in Counter(topics).items():
+        result = db.execute(
+            update(counters).where(counters.c.topic == topic).values(folded=counters.c.folded + count)
+        )
+        if result.rowcount == 0:
+            db.execute(counters.insert().values(topic=topic, folded=count))
+    return len(topics)
+
+def run_fold() -> int:
+    from ..database import SessionLocal
+
+    db = SessionLocal()
+    try:
+        folded = 0
+        while True:
+            count = fold_events(db)
+            db.commit()
+            folded += count
+            if count < FOLD_CHUNK_SIZE:
+                return folded
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
+
+async def fold_periodically(interval: int = CHANGE_FOLD_INTERVAL_SECONDS):
+    from fastapi.concurrency import run_in_threadpool
+
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_in_threadpool(run_fold)
+        except Exception:
+            logger.exception("change event fold failed")
+
+if __name__ == "__main__":
+    from ..database import create_tables
+
+    create_tables()
+    print(f"Folded {run_fold()} change events.")
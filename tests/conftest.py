@@ -0,0 +1,117 @@
+"""Shared fixtures.
+
+The suite runs against a scratch SQLite file, or against the database in
+TEST_DATABASE_URL (for example a throwaway PostgreSQL database) when set.
+Every table is emptied before each test. Requests run with
+QUERY_BUDGET_MODE=raise, so a route going over its statement budget fails
+its test.
+
+    pytest tests
+    TEST_DATABASE_URL=postgresql://pos@localhost/pos_test pytest tests
+"""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The engines are created when backend.database is imported, so all of this
+# must be set before any test module imports the app
+os.environ["DATABASE_URL"] = os.environ.get("TEST_DATABASE_URL") or (
+    f"sqlite:///{os.path.join(tempfile.mkdtemp(prefix='pos_tests_'), 'test.db')}"
+)
+os.environ["ANALYTICS_WORKERS"] = "0"
+os.environ["SALES_CUBE_PRELOAD"] = "false"
+os.environ["QUERY_BUDGET_MODE"] = "raise"
+# The lowest cost bcrypt accepts, so logins do not dominate the run
+os.environ["BCRYPT_ROUNDS"] = "4"
+
+import contextlib
+import io
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from backend import auth
+from backend.database import Base, SessionLocal, async_engine, engine, init_db, is_sqlite
+from backend.routers import auth as auth_router, customers, invoices, products, reports, sales
+from backend.utils import (catalog_cache, customer_index, invoice_numbers, invoicing, query_budget,
+                           report_store, sales_cube, versions)
+
+def build_app() -> FastAPI:
+    app = FastAPI()
+    for bind in (engine, async_engine.sync_engine):
+        query_budget.instrument_engine(bind)
+    app.add_middleware(query_budget.QueryBudgetMiddleware, mode="raise")
+    app.include_router(auth_router.router, prefix="/auth")
+    app.include_router(products.router, prefix="/products")
+    app.include_router(customers.router, prefix="/customers")
+    app.include_router(sales.router, prefix="/sales")
+    app.include_router(invoices.router, prefix="/invoices")
+    app.include_router(reports.router, prefix="/reports")
+    return app
+
+def on_sqlite() -> bool:
+    return is_sqlite(os.environ["DATABASE_URL"])
+
+def _empty_database():
+    with contextlib.redirect_stdout(io.StringIO()):
+        init_db()
+    with engine.begin() as connection:
+        for table in reversed(Base.metadata.sorted_tables):
+            connection.execute(table.delete())
+    with contextlib.redirect_stdout(io.StringIO()):
+        # Recreates the admin user
+        init_db()
+
+@pytest.fixture
+def fresh_state(monkeypatch):
+    """An empty database and empty in-process caches."""
+    _empty_database()
+    # Versions start again from 0 with the change events gone
+    catalog_cache._cache.clear()
+    monkeypatch.setattr(catalog_cache, "_version", (0, 0))
+    versions.forget_versions()
+    monkeypatch.setattr(customer_index.customer_index, "version", None)
+    monkeypatch.setattr(customer_index.customer_index, "last_event_id", 0)
+    auth.principal_cache.clear()
+    report_store.clear_cache()
+    monkeypatch.setattr(sales_cube, "cube", sales_cube.SalesCube())
+    monkeypatch.setattr(invoicing, "invoice_numbers", invoice_numbers.InvoiceNumberAllocator())
+
+@pytest.fixture
+def client(fresh_state):
+    with TestClient(build_app()) as test_client:
+        yield test_client
+        # Pooled async connections belong to this client's event loop
+        test_client.portal.call(async_engine.dispose)
+
+@pytest.fixture
+def headers(client):
+    response = client.post("/auth/token", data={"username": "admin", "password": "admin123"})
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+def create_product(client, headers, name="Widget", price=2.5, stock=100) -> int:
+    response = client.post("/products/", json={"name": name, "price": price, "stock": stock}, headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+def sell(client, headers, *items, customer_id=None):
+    sale = {"payment_method": "cash", "items": [{"product_id": product_id, "quantity": quantity}
+                                                for product_id, quantity in items]}
+    if customer_id is not None:
+        sale["customer_id"] = customer_id
+    return client.post("/sales/", json=sale, headers=headers)
+
+def stock_of(client, headers, product_id: int) -> int:
+    return client.get(f"/products/{product_id}", headers=headers).json()["stock"]
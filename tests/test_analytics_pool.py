@@ -0,0 +1,94 @@
+import asyncio
+import csv
+import io
+import os
+import tempfile
+from datetime import date, datetime, timedelta
+
+import pytest
+
+from backend import models
+from backend.utils import analytics_pool, export, reports, rollups
+from backend.utils.analytics_pool import AnalyticsJob, AnalyticsTimeout, JobCancelled
+
+START = datetime(2026, 3, 1, 9)
+
+def _add_sales(db, count: int, hours: int = 1) -> list:
+    products = [models.Product(name=name, price=2.0, stock=0) for name in ("Tea", "Cake")]
+    db.add_all(products)
+    db.flush()
+    admin_id = db.query(models.User.id).filter(models.User.username == "admin").scalar()
+    sales = [
+        models.Sale(user_id=admin_id, total_amount=2.0 * (n + 1), status="completed",
+                    created_at=START + timedelta(hours=hours * n),
+                    items=[models.SaleItem(product_id=products[n % 2].id, quantity=n + 1, price=2.0)])
+        for n in range(count)
+    ]
+    db.add_all(sales)
+    db.commit()
+    return [sale.id for sale in sales]
+
+def test_day_chunks_cover_the_range():
+    assert analytics_pool.day_chunks(date(2026, 3, 1), date(2026, 3, 10), days=4) == [
+        (date(2026, 3, 1), date(2026, 3, 4)), (date(2026, 3, 5), date(2026, 3, 8)), (date(2026, 3, 9), date(2026, 3, 10))
+    ]
+    assert analytics_pool.day_chunks(date(2026, 3, 2), date(2026, 3, 1)) == []
+
+def test_report_from_chunks_matches_the_single_query(client, db):
+    # A sale every 20 hours, over more than two weekly chunks
+    _add_sales(db, 25, hours=20)
+    rollups.rebuild_rollups(db)
+    db.commit()
+    start, end = START.replace(hour=0), START + timedelta(days=21)
+
+    report = client.portal.call(analytics_pool.sales_report, start, end, AnalyticsJob())
+
+    assert report == reports.generate_sales_report(db, start, end)
+    assert len(report["daily_sales"]) == 21
+
+def test_work_past_its_timeout_cancels_the_job(client):
+    async def slow():
+        job = AnalyticsJob()
+        with pytest.raises(AnalyticsTimeout):
+            await job.wait(asyncio.sleep(5), timeout=0.01)
+        return job
+
+    assert client.portal.call(slow).cancelled
+
+def test_cancelling_a_job_stops_its_work(client):
+    seen = []
+
+    def wait_for_cancel(token):
+        seen.append(token.wait(5))
+
+    async def run():
+        job = AnalyticsJob()
+        future = job.submit(wait_for_cancel)
+        asyncio.get_running_loop().call_later(0.05, job.cancel)
+        with pytest.raises(JobCancelled):
+            await job.wait(future)
+        with pytest.raises(JobCancelled):
+            job.submit(wait_for_cancel)
+
+    client.portal.call(run)
+
+    assert seen == [True]
+
+def test_csv_streams_each_part_in_order_and_cleans_up(client, db, monkeypatch, tmp_path):
+    sale_ids = _add_sales(db, 7)
+    monkeypatch.setattr(analytics_pool, "EXPORT_CHUNK_IDS", 3)
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+
+    async def collect():
+        job = AnalyticsJob()
+        parts = [part async for part in analytics_pool.sales_csv(sale_ids[0], sale_ids[-1], {}, job)]
+        return parts, job
+
+    parts, job = client.portal.call(collect)
+
+    assert parts[0] == export.csv_header(export.SALES_HEADERS)
+    rows = [row for part in parts[1:] for row in csv.reader(io.StringIO(part.decode()))]
+    assert [int(row[0]) for row in rows] == sale_ids
+    assert len(parts) == 4
+    assert job.cancelled
+    assert os.listdir(tmp_path) == []
@@ -0,0 +1,102 @@
+import asyncio
+
+import bcrypt
+from sqlalchemy import insert, update
+
+from backend import auth, models
+from backend.database import engine
+from backend.utils import versions
+
+def _login(client, password="admin123"):
+    return client.post("/auth/token", data={"username": "admin", "password": password})
+
+def _admin(db) -> models.User:
+    db.expire_all()
+    return db.query(models.User).filter(models.User.username == "admin").one()
+
+def _cashier(client) -> dict:
+    client.post("/auth/register", json={"username": "cashier", "email": "cashier@example.com", "password": "secret-password"})
+    token = client.post("/auth/token", data={"username": "cashier", "password": "secret-password"}).json()["access_token"]
+    return {"Authorization": f"Bearer {token}"}
+
+def _change_elsewhere(username: str, **values):
+    # As an admin request served by another worker process would
+    with engine.begin() as connection:
+        connection.execute(update(models.User).where(models.User.username == username).values(**values))
+        connection.execute(insert(models.ChangeEvent).values(topic=versions.USERS))
+
+def test_hashes_use_the_configured_cost():
+    hashed = auth.get_password_hash("secret")
+
+    assert hashed.startswith(f"$2b${auth.BCRYPT_ROUNDS:02d}$")
+    assert auth.verify_password("secret", hashed)
+    assert not auth.verify_password("wrong", hashed)
+    assert not auth.password_needs_rehash(hashed)
+    assert auth.password_needs_rehash(bcrypt.hashpw(b"secret", bcrypt.gensalt(rounds=auth.BCRYPT_ROUNDS + 1)).decode())
+    assert auth.password_needs_rehash("not a bcrypt hash")
+
+def test_async_hashing_runs_on_its_own_executor():
+    async def hash_and_verify():
+        hashed = await auth.get_password_hash_async("secret")
+        return await auth.verify_password_async("secret", hashed)
+
+    assert asyncio.run(hash_and_verify())
+
+def test_login_rehashes_a_password_made_with_another_cost(client, db):
+    user = _admin(db)
+    user.hashed_password = bcrypt.hashpw(b"admin123", bcrypt.gensalt(rounds=auth.BCRYPT_ROUNDS + 1)).decode()
+    db.commit()
+
+    assert _login(client).status_code == 200
+
+    upgraded = _admin(db).hashed_password
+    assert upgraded.startswith(f"$2b${auth.BCRYPT_ROUNDS:02d}$")
+    assert auth.verify_password("admin123", upgraded)
+    # Already at the configured cost, so the next login leaves it alone
+    assert _login(client).status_code == 200
+    assert _admin(db).hashed_password == upgraded
+
+def test_login_rejects_a_wrong_password_without_rehashing(client, db):
+    before = _admin(db).hashed_password
+
+    response = _login(client, "wrong")
+
+    assert response.status_code == 401
+    assert _admin(db).hashed_password == before
+
+def test_principal_is_cached_between_requests(client, headers):
+    client.get("/auth/users/me", headers=headers)
+    before = auth.principal_cache.stats()
+
+    assert client.get("/auth/users/me", headers=headers).status_code == 200
+
+    after = auth.principal_cache.stats()
+    assert (after["hits"], after["misses"]) == (before["hits"] + 1, before["misses"])
+
+def test_deactivated_user_is_refused_at_once(client, headers):
+    cashier = _cashier(client)
+    assert client.get("/sales/", headers=cashier).status_code == 200
+    cashier_id = client.get("/auth/users/me", headers=cashier).json()["id"]
+
+    assert client.put(f"/auth/users/{cashier_id}", json={"is_active": False}, headers=headers).status_code == 200
+
+    assert client.get("/sales/", headers=cashier).json()["detail"] == "Inactive user"
+
+def test_user_deactivated_by_another_process_is_refused(client, monkeypatch):
+    cashier = _cashier(client)
+    assert client.get("/sales/", headers=cashier).status_code == 200
+
+    _change_elsewhere("cashier", is_active=False)
+    # Every process sees the users version move within VERSION_CACHE_SECONDS
+    monkeypatch.setattr(versions, "VERSION_CACHE_SECONDS", 0)
+
+    assert client.get("/sales/", headers=cashier).json()["detail"] == "Inactive user"
+
+def test_admin_demoted_by_another_process_loses_admin_routes(client, headers, monkeypatch):
+    assert client.get("/auth/principal-cache", headers=headers).status_code == 200
+
+    _change_elsewhere("admin", is_admin=False)
+    monkeypatch.setattr(versions, "VERSION_CACHE_SECONDS", 0)
+
+    assert client.get("/auth/principal-cache", headers=headers).status_code == 403
+    assert client.get("/sales/", headers=headers).status_code == 200
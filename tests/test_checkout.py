@@ -0,0 +1,60 @@
+import asyncio
+
+import httpx
+import pytest
+
+from backend.utils import inventory
+from conftest import create_product, sell, stock_of
+
+def _checkout_concurrently(client, headers, product_id: int, requests: int):
+    async def run():
+        transport = httpx.ASGITransport(app=client.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as concurrent:
+            sale = {"payment_method": "cash", "items": [{"product_id": product_id, "quantity": 1}]}
+            return await asyncio.gather(*(
+                concurrent.post("/sales/", json=sale, headers=headers) for _ in range(requests)
+            ))
+    # On the client's event loop, which owns the pooled async connections
+    return [response.status_code for response in client.portal.call(run)]
+
+def _lines(items):
+    return sorted((item["id"], item["product_id"], item["quantity"], item["price"]) for item in items)
+
+@pytest.mark.parametrize("mode", ["column", "stripes", "ledger"])
+def test_concurrent_checkouts_never_oversell(client, headers, monkeypatch, mode):
+    if mode == "ledger":
+        monkeypatch.setattr(inventory, "INVENTORY_MODE", "ledger")
+    product_id = create_product(client, headers, stock=5)
+    if mode == "stripes":
+        response = client.put(f"/products/{product_id}/stock-stripes", json={"stripes": 4}, headers=headers)
+        assert response.status_code == 200, response.text
+
+    statuses = _checkout_concurrently(client, headers, product_id, 12)
+
+    assert sorted(statuses) == [201] * 5 + [400] * 7
+    assert stock_of(client, headers, product_id) == 0
+
+def test_checkout_rejects_short_basket_without_side_effects(client, headers):
+    plenty = create_product(client, headers, name="Plenty", stock=10)
+    scarce = create_product(client, headers, name="Scarce", stock=1)
+
+    response = sell(client, headers, (plenty, 3), (scarce, 2))
+
+    assert response.status_code == 400
+    assert stock_of(client, headers, plenty) == 10
+    assert stock_of(client, headers, scarce) == 1
+
+def test_checkout_returns_the_items_in_basket_order(client, headers):
+    first = create_product(client, headers, name="First", price=1.5)
+    second = create_product(client, headers, name="Second", price=4.0)
+
+    response = sell(client, headers, (second, 2), (first, 3), (second, 1))
+
+    assert response.status_code == 201, response.text
+    sale = response.json()
+    assert [(item["product_id"], item["quantity"], float(item["price"])) for item in sale["items"]] == [
+        (second, 2, 4.0), (first, 3, 1.5), (second, 1, 4.0)
+    ]
+    assert len({item["id"] for item in sale["items"]}) == 3
+    assert float(sale["total_amount"]) == 16.5
+    assert _lines(client.get(f"/sales/{sale['id']}", headers=headers).json()["items"]) == _lines(sale["items"])
@@ -0,0 +1,69 @@
+from sqlalchemy import insert
+
+from backend import models
+from backend.database import engine
+from backend.utils import versions
+from backend.utils.customer_index import customer_index
+
+def _customer(client, headers, name, email):
+    response = client.post("/customers/", json={"name": name, "email": email}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()["id"]
+
+def _lookup(client, headers, q):
+    response = client.get("/customers/lookup", params={"q": q}, headers=headers)
+    assert response.status_code == 200, response.text
+    return sorted(customer["name"] for customer in response.json())
+
+def _index_updates(monkeypatch):
+    calls = []
+    for method in ("load", "apply"):
+        original = getattr(customer_index, method)
+        monkeypatch.setattr(customer_index, method,
+                            lambda *args, method=method, original=original: calls.append(method) or original(*args))
+    return calls
+
+def test_lookup_applies_only_the_customers_changed(client, headers, monkeypatch):
+    ada = _customer(client, headers, "Ada Lovelace", "ada@example.com")
+    grace = _customer(client, headers, "Grace Hopper", "grace@example.com")
+    assert _lookup(client, headers, "ada") == ["Ada Lovelace"]
+    calls = _index_updates(monkeypatch)
+
+    client.put(f"/customers/{ada}", json={"name": "Adele Goldberg", "email": "adele@example.com"}, headers=headers)
+    client.delete(f"/customers/{grace}", headers=headers)
+    _customer(client, headers, "Adam Smith", "adam@example.com")
+
+    assert _lookup(client, headers, "ad") == ["Adam Smith", "Adele Goldberg"]
+    assert _lookup(client, headers, "lovelace") == []
+    assert _lookup(client, headers, "grace") == []
+    assert calls == ["apply"]
+
+def test_lookup_applies_changes_from_another_process(client, headers, monkeypatch):
+    _customer(client, headers, "Ada Lovelace", "ada@example.com")
+    assert _lookup(client, headers, "ada") == ["Ada Lovelace"]
+    calls = _index_updates(monkeypatch)
+
+    with engine.begin() as connection:
+        customer_id = connection.execute(
+            insert(models.Customer).values(name="Adam Smith", email="adam@example.com").returning(models.Customer.id)
+        ).scalar()
+        connection.execute(insert(models.ChangeEvent).values(topic=versions.CUSTOMERS, row_id=customer_id))
+    monkeypatch.setattr(versions, "VERSION_CACHE_SECONDS", 0)
+
+    assert _lookup(client, headers, "ada") == ["Ada Lovelace", "Adam Smith"]
+    assert calls == ["apply"]
+
+def test_lookup_reloads_when_the_changes_were_folded(client, headers, monkeypatch):
+    _customer(client, headers, "Ada Lovelace", "ada@example.com")
+    assert _lookup(client, headers, "ada") == ["Ada Lovelace"]
+    calls = _index_updates(monkeypatch)
+
+    _customer(client, headers, "Adam Smith", "adam@example.com")
+    assert versions.run_fold() > 0
+
+    assert _lookup(client, headers, "ada") == ["Ada Lovelace", "Adam Smith"]
+    assert calls == ["load"]
+    # Back to applying changes from the events after the reload
+    _customer(client, headers, "Adele Goldberg", "adele@example.com")
+    assert _lookup(client, headers, "ad") == ["Ada Lovelace", "Adam Smith", "Adele Goldberg"]
+    assert calls == ["load", "apply"]
@@ -0,0 +1,108 @@
+import csv
+import functools
+import io
+from datetime import datetime, timedelta
+
+from backend import models
+from backend.database import AsyncSessionLocal
+from backend.routers import sales
+from backend.utils import export, query_budget
+
+START = datetime(2026, 3, 1, 9)
+
+def _add_sales(db, count: int) -> list:
+    product = models.Product(name="Tea", price=2.0, stock=0)
+    customer = models.Customer(name="Ada", email="ada@example.com")
+    db.add_all([product, customer])
+    db.flush()
+    admin_id = db.query(models.User.id).filter(models.User.username == "admin").scalar()
+    sales = [
+        models.Sale(user_id=admin_id, customer_id=customer.id if n % 2 else None, total_amount=2.0 * (n + 1),
+                    status="completed", created_at=START + timedelta(hours=n),
+                    items=[models.SaleItem(product_id=product.id, quantity=n + 1, price=2.0)])
+        for n in range(count)
+    ]
+    db.add_all(sales)
+    db.commit()
+    return [sale.id for sale in sales]
+
+def _rows(data: bytes):
+    return list(csv.reader(io.StringIO(data.decode())))
+
+def test_export_streams_every_sale_in_id_order(client, headers, db):
+    sale_ids = _add_sales(db, 7)
+
+    response = client.get("/sales/export/csv", headers=headers)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = _rows(response.content)
+    assert rows[0] == export.SALES_HEADERS
+    assert [int(row[0]) for row in rows[1:]] == sale_ids
+    assert rows[2] == [str(sale_ids[1]), "2026-03-01 10:00:00", "Ada", "$4.00", "Tea x2"]
+    assert rows[1][2] == "N/A"
+
+def test_export_filters(client, headers, db):
+    sale_ids = _add_sales(db, 6)
+    customer_id = db.query(models.Customer.id).scalar()
+
+    by_customer = client.get("/sales/export/csv", params={"customer_id": customer_id}, headers=headers)
+    by_date = client.get("/sales/export/csv", params={
+        "start_date": (START + timedelta(hours=2)).isoformat(), "end_date": (START + timedelta(hours=4)).isoformat()
+    }, headers=headers)
+    nothing = client.get("/sales/export/csv", params={"customer_id": 999}, headers=headers)
+
+    assert [int(row[0]) for row in _rows(by_customer.content)[1:]] == sale_ids[1::2]
+    assert [int(row[0]) for row in _rows(by_date.content)[1:]] == sale_ids[2:5]
+    assert _rows(nothing.content) == [export.SALES_HEADERS]
+
+def test_export_of_many_chunks_is_not_an_n_plus_one(client, headers, db, monkeypatch):
+    monkeypatch.setattr(sales, "aiter_sales_csv", functools.partial(export.aiter_sales_csv, chunk_size=1))
+    sale_ids = _add_sales(db, query_budget.N_PLUS_ONE_THRESHOLD + 2)
+
+    # The test app raises if the request's repeated chunk reads are reported
+    response = client.get("/sales/export/csv", headers=headers)
+
+    assert len(_rows(response.content)) == len(sale_ids) + 1
+
+def test_export_reads_a_chunk_at_a_time(client, db):
+    sale_ids = _add_sales(db, 5)
+
+    async def collect():
+        parts, held = [], []
+        async with AsyncSessionLocal() as session:
+            async for part in export.aiter_sales_csv(session, chunk_size=2):
+                parts.append(part)
+                # Each chunk is dropped from the session before the next one
+                held.append(len(session.sync_session.identity_map))
+        return parts, held
+
+    parts, held = client.portal.call(collect)
+
+    assert parts[0] == export.csv_header(export.SALES_HEADERS)
+    assert [len(_rows(part)) for part in parts[1:]] == [2, 2, 1]
+    assert set(held) == {0}
+    assert [int(row[0]) for part in parts[1:] for row in _rows(part)] == sale_ids
+
+def test_write_sales_csv_covers_one_id_range(fresh_state, db):
+    sale_ids = _add_sales(db, 6)
+    out = io.BytesIO()
+
+    written = export.write_sales_csv(db, out, sale_ids[1], sale_ids[4], chunk_size=2)
+
+    assert written == 4
+    assert [int(row[0]) for row in _rows(out.getvalue())] == sale_ids[1:5]
+
+def test_write_sales_csv_stops_between_chunks(fresh_state, db):
+    sale_ids = _add_sales(db, 6)
+    out = io.BytesIO()
+    checks = []
+
+    def stop_after_first_chunk():
+        checks.append(True)
+        return len(checks) > 1
+
+    written = export.write_sales_csv(db, out, sale_ids[0], sale_ids[-1], should_stop=stop_after_first_chunk,
+                                     chunk_size=2)
+
+    assert written == 2
@@ -0,0 +1,89 @@
+from sqlalchemy import func, select
+
+from backend import models, schemas
+from backend.utils import checkout, inventory, stock_stripes
+from conftest import create_product, sell, stock_of
+
+def _set_stripes(client, headers, product_id: int, stripes: int):
+    response = client.put(f"/products/{product_id}/stock-stripes", json={"stripes": stripes}, headers=headers)
+    assert response.status_code == 200, response.text
+    return response.json()
+
+def _striped_stock(db, product_id: int) -> int:
+    stripes = select(func.coalesce(func.sum(models.ProductStockStripe.stock), 0)).where(
+        models.ProductStockStripe.product_id == product_id
+    )
+    return db.get(models.Product, product_id).stock + db.scalar(stripes)
+
+def test_stripes_add_up_to_the_stock(client, headers, db):
+    product_id = create_product(client, headers, stock=100)
+    assert _set_stripes(client, headers, product_id, 4)["stock"] == 100
+
+    for quantity in (7, 13, 1, 30):
+        assert sell(client, headers, (product_id, quantity)).status_code == 201
+    # More than any one stripe holds, less than all of them
+    assert sell(client, headers, (product_id, 40)).status_code == 201
+
+    assert stock_of(client, headers, product_id) == 9
+    assert _striped_stock(db, product_id) == 9
+    assert sell(client, headers, (product_id, 10)).status_code == 400
+
+    response = client.put(f"/products/{product_id}", json={"stock": 50}, headers=headers)
+    assert response.json()["stock"] == 50
+
+    assert _set_stripes(client, headers, product_id, 0)["stock"] == 50
+    db.expire_all()
+    assert db.get(models.Product, product_id).stock == 50
+    assert db.scalar(select(func.count()).select_from(models.ProductStockStripe)) == 0
+
+def test_stripes_count_their_slow_paths_for_the_route(client, headers, db):
+    product_id = create_product(client, headers, stock=8)
+    _set_stripes(client, headers, product_id, 4)
+    admin_id = db.query(models.User.id).filter(models.User.username == "admin").scalar()
+
+    # Every stripe holds 2, so the picked one is short and the product is rebalanced
+    checkout.create_sale(db, schemas.SaleCreate(items=[{"product_id": product_id, "quantity": 3}]), admin_id)
+    db.rollback()
+
+    assert db.info[stock_stripes.STRIPED_TAKES] == 1
+    assert db.info[stock_stripes.REBALANCES] == 1
+    assert stock_stripes.RESPREADS not in db.info
+
+def test_ledger_stock_survives_compaction(client, headers, db, monkeypatch):
+    monkeypatch.setattr(inventory, "INVENTORY_MODE", "ledger")
+    product_id = create_product(client, headers, stock=20)
+    other_id = create_product(client, headers, name="Other", stock=5)
+
+    sales = [sell(client, headers, (product_id, 3), (other_id, 1)).json()["id"] for _ in range(3)]
+    assert client.delete(f"/sales/{sales[0]}", headers=headers).status_code == 204
+    assert stock_of(client, headers, product_id) == 14
+    assert stock_of(client, headers, other_id) == 3
+
+    response = client.put(f"/products/{product_id}", json={"stock": 25}, headers=headers)
+    assert response.json()["stock"] == 25
+    assert sell(client, headers, (other_id, 4)).status_code == 400
+
+    levels = inventory.stock_levels(db, [product_id, other_id])
+    assert levels == {product_id: 25, other_id: 3}
+
+    assert inventory.run_compaction(0) == 2
+
+    db.expire_all()
+    assert db.get(models.Product, product_id).stock == 25
+    assert db.get(models.Product, other_id).stock == 3
+    assert inventory.stock_levels(db, [product_id, other_id]) == levels
+    # Movements after the snapshot still count
+    assert sell(client, headers, (product_id, 5)).status_code == 201
+    assert stock_of(client, headers, product_id) == 20
+
+def test_products_with_stock_movements_are_kept(client, headers, db, monkeypatch):
+    monkeypatch.setattr(inventory, "INVENTORY_MODE", "ledger")
+    received = create_product(client, headers, name="Received", stock=5)
+    empty = create_product(client, headers, name="Empty", stock=0)
+
+    response = client.delete(f"/products/{received}", headers=headers)
+
+    assert (response.status_code, response.json()["detail"]) == (400, "Cannot delete product with stock movements")
+    assert db.scalar(select(func.count()).where(models.StockMovement.product_id == received)) == 1
+    assert stock_of(client, headers, received) == 5
+    assert client.delete(f"/products/{empty}", headers=headers).status_code == 204
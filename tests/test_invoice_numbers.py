@@ -0,0 +1,63 @@
+from datetime import datetime, timedelta
+
+from backend import models
+from backend.utils import invoice_numbers
+from backend.utils.invoice_numbers import InvoiceNumberAllocator
+from conftest import create_product, sell
+
+def _counter(db, day):
+    db.expire_all()
+    return db.get(models.InvoiceCounter, day).last_value
+
+def test_numbers_come_from_a_reserved_block(fresh_state, db):
+    now = datetime(2026, 3, 1, 12)
+    allocator = InvoiceNumberAllocator(block_size=3)
+
+    assert allocator.allocate(2, now) == ["INV-20260301-000001", "INV-20260301-000002"]
+    assert _counter(db, now.date()) == 3
+    # The third number is still in the block; the fourth reserves another
+    assert allocator.allocate(2, now) == ["INV-20260301-000003", "INV-20260301-000004"]
+    assert _counter(db, now.date()) == 6
+
+def test_allocators_in_different_processes_never_share_numbers(fresh_state):
+    now = datetime(2026, 3, 1, 12)
+    first, second = InvoiceNumberAllocator(block_size=5), InvoiceNumberAllocator(block_size=5)
+
+    numbers = first.allocate(3, now) + second.allocate(4, now) + first.allocate(4, now)
+
+    assert len(set(numbers)) == len(numbers) == 11
+    assert second.allocate(1, now) == ["INV-20260301-000010"]
+
+def test_a_large_request_reserves_one_block_for_all_of_it(fresh_state, db):
+    now = datetime(2026, 3, 1, 12)
+
+    numbers = InvoiceNumberAllocator(block_size=2).allocate(7, now)
+
+    assert numbers[-1] == "INV-20260301-000007"
+    assert _counter(db, now.date()) == 7
+
+def test_numbering_starts_again_each_day(fresh_state):
+    allocator = InvoiceNumberAllocator(block_size=10)
+    today = datetime(2026, 3, 1, 23, 59)
+
+    assert allocator.allocate(1, today) == ["INV-20260301-000001"]
+    assert allocator.allocate(1, today + timedelta(minutes=2)) == ["INV-20260302-000001"]
+
+def test_invoice_numbers_use_the_utc_day(client, headers, monkeypatch):
+    class LateEvening(datetime):
+        # Local time a day behind UTC, as west of Greenwich around midnight
+        @classmethod
+        def now(cls, tz=None):
+            return datetime(2026, 3, 1, 23, 30)
+
+        @classmethod
+        def utcnow(cls):
+            return datetime(2026, 3, 2, 5, 30)
+
+    monkeypatch.setattr(invoice_numbers, "datetime", LateEvening)
+    sale_id = sell(client, headers, (create_product(client, headers), 1)).json()["id"]
+
+    response = client.post(f"/invoices/from-sale/{sale_id}", headers=headers)
+
+    assert response.status_code == 201, response.text
+    assert response.json()["invoice_number"] == "INV-20260302-000001"
@@ -0,0 +1,105 @@
+import asyncio
+
+import httpx
+
+from backend.utils import invoicing
+from conftest import create_product, sell
+
+def _sale(client, headers, *items):
+    response = sell(client, headers, *items)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+def test_invoice_from_sale_copies_its_lines(client, headers):
+    first = create_product(client, headers, name="First", price=2.5)
+    second = create_product(client, headers, name="Second", price=4.0)
+    sale_id = _sale(client, headers, (first, 2), (second, 3))
+
+    response = client.post(f"/invoices/from-sale/{sale_id}", json={"tax_amount": 1.7, "discount_amount": 0.2},
+                           headers=headers)
+
+    assert response.status_code == 201, response.text
+    invoice = response.json()
+    assert invoice["sale_id"] == sale_id
+    assert float(invoice["total_amount"]) == 18.5
+    assert sorted((item["product_id"], item["quantity"], float(item["unit_price"])) for item in invoice["items"]) == [
+        (first, 2, 2.5), (second, 3, 4.0)
+    ]
+
+def test_a_sale_is_invoiced_once_until_its_invoice_is_cancelled(client, headers):
+    sale_id = _sale(client, headers, (create_product(client, headers), 1))
+    invoice = client.post(f"/invoices/from-sale/{sale_id}", headers=headers).json()
+
+    again = client.post(f"/invoices/from-sale/{sale_id}", headers=headers)
+    assert (again.status_code, again.json()["detail"]) == (400, "Sale already invoiced")
+
+    client.put(f"/invoices/{invoice['id']}/status", params={"status": "cancelled"}, headers=headers)
+    assert client.post(f"/invoices/from-sale/{sale_id}", headers=headers).status_code == 201
+
+def test_invoice_from_missing_or_cancelled_sale(client, headers):
+    sale_id = _sale(client, headers, (create_product(client, headers), 1))
+    client.put(f"/sales/{sale_id}/status", params={"status": "cancelled"}, headers=headers)
+
+    assert client.post("/invoices/from-sale/9999", headers=headers).status_code == 404
+    response = client.post(f"/invoices/from-sale/{sale_id}", headers=headers)
+    assert (response.status_code, response.json()["detail"]) == (400, "Cannot invoice a cancelled sale")
+
+def test_batch_reports_each_sale(client, headers):
+    product_id = create_product(client, headers, price=10.0)
+    sales = [_sale(client, headers, (product_id, n + 1)) for n in range(3)]
+    client.post(f"/invoices/from-sale/{sales[0]}", headers=headers)
+
+    response = client.post("/invoices/batch", json={"sale_ids": sales + [sales[1], 9999], "tax_rate": 0.1},
+                           headers=headers)
+
+    body = response.json()
+    assert (body["created"], body["failed"]) == (2, 3)
+    assert [result["error"] for result in body["results"]] == [
+        "Sale already invoiced", None, None, "Duplicate sale in batch", "Sale not found"
+    ]
+    invoice = client.get(f"/invoices/{body['results'][2]['invoice_id']}", headers=headers).json()
+    assert (float(invoice["tax_amount"]), float(invoice["total_amount"])) == (3.0, 33.0)
+    assert len({result["invoice_number"] for result in body["results"][1:3]}) == 2
+
+def test_sale_invoiced_after_the_check_is_rejected(client, headers, monkeypatch):
+    sale_id = _sale(client, headers, (create_product(client, headers), 1))
+    assert client.post(f"/invoices/from-sale/{sale_id}", headers=headers).status_code == 201
+    # As if another request committed its invoice between our check and insert
+    monkeypatch.setattr(invoicing, "_invoiced_sale_ids", lambda db, sale_ids: set())
+
+    response = client.post(f"/invoices/from-sale/{sale_id}", headers=headers)
+
+    assert (response.status_code, response.json()["detail"]) == (400, "Sale already invoiced")
+
+def test_batch_checks_again_when_a_sale_was_invoiced_meanwhile(client, headers, monkeypatch):
+    product_id = create_product(client, headers)
+    sales = [_sale(client, headers, (product_id, 1)) for _ in range(2)]
+    assert client.post(f"/invoices/from-sale/{sales[0]}", headers=headers).status_code == 201
+    invoiced_sale_ids = invoicing._invoiced_sale_ids
+    calls = []
+
+    def stale_first(db, sale_ids):
+        calls.append(sale_ids)
+        return set() if len(calls) == 1 else invoiced_sale_ids(db, sale_ids)
+
+    monkeypatch.setattr(invoicing, "_invoiced_sale_ids", stale_first)
+
+    body = client.post("/invoices/batch", json={"sale_ids": sales}, headers=headers).json()
+
+    assert len(calls) == 2
+    assert [result["success"] for result in body["results"]] == [False, True]
+    assert body["results"][0]["error"] == "Sale already invoiced"
+
+def test_concurrent_invoices_of_one_sale(client, headers):
+    sale_id = _sale(client, headers, (create_product(client, headers), 1))
+
+    async def run():
+        transport = httpx.ASGITransport(app=client.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as concurrent:
+            return await asyncio.gather(*(
+                concurrent.post(f"/invoices/from-sale/{sale_id}", headers=headers) for _ in range(6)
+            ))
+
+    statuses = sorted(response.status_code for response in client.portal.call(run))
+
+    assert statuses == [201] + [400] * 5
@@ -0,0 +1,82 @@
+import pytest
+from fastapi.responses import PlainTextResponse
+from fastapi.testclient import TestClient
+
+from backend.database import async_engine, engine
+from backend.utils import metrics
+from conftest import build_app, create_product
+
+@pytest.fixture
+def client(fresh_state):
+    # The test app with the middleware and endpoint of backend.main
+    app = build_app()
+    for bind in (engine, async_engine.sync_engine):
+        metrics.instrument_engine(bind)
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.add_api_route("/metrics", lambda: PlainTextResponse(metrics.render_metrics()))
+    with TestClient(app) as test_client:
+        yield test_client
+        test_client.portal.call(async_engine.dispose)
+
+def _count(histogram, labels):
+    entry = histogram.values.get(labels)
+    return (sum(entry[0]), entry[1][0]) if entry else (0, 0.0)
+
+def test_histogram_samples_are_cumulative():
+    histogram = metrics.Histogram("size", "Sizes", ("kind",), buckets=(1, 5))
+    for value in (0.5, 1, 3, 7):
+        histogram.observe(('a "b"',), value)
+
+    assert histogram.samples() == [
+        'size_bucket{kind="a \\"b\\"",le="1"} 2',
+        'size_bucket{kind="a \\"b\\"",le="5"} 3',
+        'size_bucket{kind="a \\"b\\"",le="+Inf"} 4',
+        'size_sum{kind="a \\"b\\""} 11.5',
+        'size_count{kind="a \\"b\\""} 4',
+    ]
+
+def test_requests_are_labelled_with_the_route_template(client, headers):
+    product_id = create_product(client, headers)
+    labels = ("GET", "/products/{product_id}")
+    requests_before = metrics.REQUESTS.values.get(labels + ("200",), 0)
+    missing_before = metrics.REQUESTS.values.get(labels + ("404",), 0)
+    latency_before = _count(metrics.LATENCY, labels)[0]
+
+    client.get(f"/products/{product_id}", headers=headers)
+    client.get("/products/9999", headers=headers)
+
+    assert metrics.REQUESTS.values[labels + ("200",)] == requests_before + 1
+    assert metrics.REQUESTS.values[labels + ("404",)] == missing_before + 1
+    assert _count(metrics.LATENCY, labels)[0] == latency_before + 2
+    assert metrics.IN_FLIGHT.values[("GET",)] == 0
+
+def test_unmatched_paths_share_one_label(client):
+    before = metrics.REQUESTS.values.get(("GET", "unmatched", "404"), 0)
+
+    client.get("/no/such/path/1")
+    client.get("/no/such/path/2")
+
+    assert metrics.REQUESTS.values[("GET", "unmatched", "404")] == before + 2
+
+def test_sql_statements_are_counted_per_request(client, headers):
+    labels = ("GET", "/products/{product_id}")
+    product_id = create_product(client, headers)
+    before = _count(metrics.SQL_STATEMENTS, labels)
+
+    client.get(f"/products/{product_id}", headers=headers)
+    once = _count(metrics.SQL_STATEMENTS, labels)
+    client.get(f"/products/{product_id}", headers=headers)
+    twice = _count(metrics.SQL_STATEMENTS, labels)
+
+    # One observation per request, of the statements that request ran
+    assert (once[0], twice[0]) == (before[0] + 1, before[0] + 2)
+    assert once[1] - before[1] >= 1
+
+def test_metrics_endpoint_renders_every_metric(client, headers):
+    client.get("/products/", headers=headers)
+
+    body = client.get("/metrics").text
+
+    for metric in metrics.METRICS:
+        assert f"# TYPE {metric.name} {metric.kind}" in body
+    assert 'http_requests_total{method="GET",route="/products/",status="200"}' in body
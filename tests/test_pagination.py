@@ -0,0 +1,49 @@
+import re
+
+def _customers(client, headers, count: int) -> list:
+    ids = []
+    for n in range(count):
+        response = client.post("/customers/", json={"name": f"Customer {n}", "email": f"c{n}@example.com"},
+                               headers=headers)
+        assert response.status_code == 200, response.text
+        ids.append(response.json()["id"])
+    return ids
+
+def _links(response) -> dict:
+    return {rel: url for url, rel in re.findall(r'<([^>]+)>; rel="(\w+)"', response.headers.get("link", ""))}
+
+def test_link_header_walks_every_page_forwards_and_back(client, headers):
+    ids = _customers(client, headers, 5)
+
+    pages, response = [], client.get("/customers/", params={"limit": 2}, headers=headers)
+    while True:
+        assert response.status_code == 200, response.text
+        pages.append([customer["id"] for customer in response.json()])
+        if "next" not in _links(response):
+            break
+        response = client.get(_links(response)["next"], headers=headers)
+
+    assert pages == [ids[0:2], ids[2:4], ids[4:5]]
+    assert _links(response).keys() == {"prev"}
+    back = client.get(_links(response)["prev"], headers=headers)
+    assert [customer["id"] for customer in back.json()] == ids[2:4]
+    assert _links(back).keys() == {"next", "prev"}
+    first = client.get(_links(back)["prev"], headers=headers)
+    assert [customer["id"] for customer in first.json()] == ids[0:2]
+    assert _links(first).keys() == {"next"}
+
+def test_offset_paging_still_works_on_the_first_page(client, headers):
+    ids = _customers(client, headers, 4)
+
+    response = client.get("/customers/", params={"skip": 1, "limit": 2}, headers=headers)
+
+    assert [customer["id"] for customer in response.json()] == ids[1:3]
+    # The next page is located by key; skip is not carried over
+    assert "skip=" not in _links(response)["next"]
+    following = client.get(_links(response)["next"], headers=headers)
+    assert [customer["id"] for customer in following.json()] == ids[3:4]
+
+def test_invalid_cursor(client, headers):
+    for cursor in ("not-a-cursor", "eyJrIjoiMSIsImQiOiJuZXh0In0"):
+        response = client.get("/customers/", params={"cursor": cursor}, headers=headers)
+        assert (response.status_code, response.json()["detail"]) == (400, "Invalid cursor")
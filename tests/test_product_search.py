@@ -0,0 +1,57 @@
+from backend.utils import product_search
+
+def _product(client, headers, name, description=None) -> int:
+    response = client.post("/products/", json={"name": name, "description": description, "price": 1.0, "stock": 5},
+                           headers=headers)
+    assert response.status_code == 201, response.text
+    return response.json()["id"]
+
+def _search(client, headers, q, **params):
+    response = client.get("/products/search", params={"q": q, **params}, headers=headers)
+    assert response.status_code == 200, response.text
+    return [product["id"] for product in response.json()]
+
+def test_search_terms_keep_only_words():
+    assert product_search.search_terms('Green "tea" OR te* & !cake') == ["green", "tea", "or", "te", "cake"]
+
+def test_every_term_matches_as_a_prefix(client, headers):
+    green_tea = _product(client, headers, "Green tea", "Loose leaf")
+    black_tea = _product(client, headers, "Black tea")
+    _product(client, headers, "Coffee")
+
+    assert sorted(_search(client, headers, "te")) == [green_tea, black_tea]
+    assert _search(client, headers, "gree te") == [green_tea]
+    assert _search(client, headers, "lea") == [green_tea]
+    assert _search(client, headers, "juice") == []
+
+def test_name_matches_rank_before_description_matches(client, headers):
+    in_description = _product(client, headers, "Mug", "Fits a tea bag")
+    in_name = _product(client, headers, "Tea cup")
+
+    assert _search(client, headers, "tea") == [in_name, in_description]
+
+def test_operators_in_the_query_are_ignored(client, headers):
+    tea = _product(client, headers, "Tea")
+
+    assert _search(client, headers, '"tea*" OR') == []
+    assert _search(client, headers, 'tea)" -') == [tea]
+    assert _search(client, headers, "**") == []
+
+def test_search_follows_renames_and_deletes(client, headers):
+    product_id = _product(client, headers, "Tea")
+    assert _search(client, headers, "tea") == [product_id]
+
+    client.put(f"/products/{product_id}", json={"name": "Coffee"}, headers=headers)
+    assert _search(client, headers, "tea") == []
+    assert _search(client, headers, "coffee") == [product_id]
+
+    client.delete(f"/products/{product_id}", headers=headers)
+    assert _search(client, headers, "coffee") == []
+
+def test_broad_queries_come_back_in_id_order(client, headers, monkeypatch):
+    in_description = _product(client, headers, "Mug", "Fits a tea bag")
+    in_name = _product(client, headers, "Tea cup")
+    monkeypatch.setattr(product_search, "SEARCH_RANK_MAX_MATCHES", 1)
+
+    assert _search(client, headers, "tea") == [in_description, in_name]
+    assert _search(client, headers, "tea", limit=1) == [in_description]
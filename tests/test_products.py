@@ -0,0 +1,109 @@
+from sqlalchemy import event, insert, update
+
+from backend import models
+from backend.database import AsyncSessionLocal, async_engine, engine
+from backend.utils import versions
+from conftest import create_product, sell
+
+def _commit_elsewhere(statement, topic: str):
+    # As another worker would: its sessions' commits are not seen by this process
+    with engine.begin() as connection:
+        connection.execute(statement)
+        connection.execute(insert(models.ChangeEvent).values(topic=topic))
+
+def _statements_run(client, *args, **kwargs):
+    statements = []
+
+    def count(*_):
+        statements.append(1)
+
+    event.listen(async_engine.sync_engine, "after_cursor_execute", count)
+    try:
+        response = client.get(*args, **kwargs)
+    finally:
+        event.remove(async_engine.sync_engine, "after_cursor_execute", count)
+    return response, len(statements)
+
+def test_product_list_revalidates_with_etag(client, headers):
+    product_id = create_product(client, headers, stock=10)
+
+    first = client.get("/products/", headers=headers)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    unchanged = client.get("/products/", headers={**headers, "If-None-Match": etag})
+    assert unchanged.status_code == 304
+    assert unchanged.headers["etag"] == etag
+
+    assert sell(client, headers, (product_id, 3)).status_code == 201
+    changed = client.get("/products/", headers={**headers, "If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
+    assert changed.json()[0]["stock"] == 7
+
+def test_product_etag_changes_with_each_item(client, headers):
+    first = create_product(client, headers, name="First")
+    second = create_product(client, headers, name="Second")
+
+    etags = {client.get(f"/products/{product_id}", headers=headers).headers["etag"]
+             for product_id in (first, second)}
+
+    assert len(etags) == 2
+
+def test_change_committed_by_another_process_invalidates_the_cache(client, headers, monkeypatch):
+    product_id = create_product(client, headers, stock=10)
+    etag = client.get(f"/products/{product_id}", headers=headers).headers["etag"]
+
+    _commit_elsewhere(update(models.Product).where(models.Product.id == product_id).values(stock=42),
+                      versions.STOCK)
+    # Seen once the versions read are older than VERSION_CACHE_SECONDS
+    assert client.get(f"/products/{product_id}", headers={**headers, "If-None-Match": etag}).status_code == 304
+    monkeypatch.setattr(versions, "VERSION_CACHE_SECONDS", 0)
+
+    response = client.get(f"/products/{product_id}", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["stock"] == 42
+
+def test_revalidation_reads_nothing_from_the_database(client, headers):
+    create_product(client, headers)
+    etag = client.get("/products/", headers=headers).headers["etag"]
+
+    response, statements = _statements_run(client, "/products/", headers={**headers, "If-None-Match": etag})
+
+    assert response.status_code == 304
+    assert statements == 0
+
+def test_checkouts_move_the_stock_version_only(client, headers):
+    product_id = create_product(client, headers, stock=10)
+
+    async def current():
+        async with AsyncSessionLocal() as session:
+            return await versions.current_versions(session, [versions.CATALOG, versions.STOCK])
+
+    catalog, stock = client.portal.call(current)
+    assert sell(client, headers, (product_id, 1)).status_code == 201
+
+    assert client.portal.call(current) == (catalog, stock + 1)
+    assert client.put(f"/products/{product_id}", json={"price": 3.0}, headers=headers).status_code == 200
+    assert client.portal.call(current) == (catalog + 1, stock + 1)
+
+def test_versions_survive_the_fold(client, headers, db):
+    create_product(client, headers)
+    etag = client.get("/products/", headers=headers).headers["etag"]
+
+    assert versions.run_fold() > 0
+
+    response = client.get("/products/", headers={**headers, "If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_customer_lookup_rebuilds_after_another_process_writes(client, headers, monkeypatch):
+    response = client.post("/customers/", json={"name": "Ada Lovelace", "email": "ada@example.com"}, headers=headers)
+    assert response.status_code == 200, response.text
+    assert [c["name"] for c in client.get("/customers/lookup", params={"q": "ada"}, headers=headers).json()] == ["Ada Lovelace"]
+
+    _commit_elsewhere(insert(models.Customer).values(name="Adam Smith", email="adam@example.com"),
+                      versions.CUSTOMERS)
+    monkeypatch.setattr(versions, "VERSION_CACHE_SECONDS", 0)
+
+    names = {c["name"] for c in client.get("/customers/lookup", params={"q": "ada"}, headers=headers).json()}
+    assert names == {"Ada Lovelace", "Adam Smith"}
@@ -0,0 +1,95 @@
+import pytest
+from fastapi import Depends, FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend.database import async_engine, engine, get_db
+from backend.utils import query_budget
+from backend.utils.query_budget import QueryBudgetExceeded
+
+@pytest.fixture
+def budget_client():
+    app = FastAPI()
+    query_budget.instrument_engine(async_engine.sync_engine)
+    app.add_middleware(query_budget.QueryBudgetMiddleware, mode="raise")
+
+    @app.get("/statements/{count}", dependencies=[query_budget.query_budget(2)])
+    async def run_statements(count: int, db: AsyncSession = Depends(get_db)):
+        for number in range(count):
+            await db.execute(text(f"SELECT {number}"))
+        return {"ran": count}
+
+    @app.get("/repeated/{count}")
+    async def repeat_statement(count: int, db: AsyncSession = Depends(get_db)):
+        for number in range(count):
+            await db.execute(text("SELECT CAST(:number AS INTEGER)"), {"number": number})
+        return {"ran": count}
+
+    @app.get("/chunked/{count}")
+    async def chunked(count: int, db: AsyncSession = Depends(get_db)):
+        query_budget.allow_repeats(2)
+        for number in range(count):
+            await db.execute(text("SELECT CAST(:number AS INTEGER)"), {"number": number})
+        return {}
+
+    @app.get("/keyset", dependencies=[query_budget.repeats_ok()])
+    async def keyset(db: AsyncSession = Depends(get_db)):
+        for number in range(query_budget.N_PLUS_ONE_THRESHOLD * 3):
+            await db.execute(text("SELECT CAST(:number AS INTEGER)"), {"number": number})
+        return {}
+
+    @app.get("/extended", dependencies=[query_budget.query_budget(1)])
+    async def extended(db: AsyncSession = Depends(get_db)):
+        query_budget.extend_budget(1)
+        await db.execute(text("SELECT 1"))
+        await db.execute(text("SELECT 2"))
+        return {}
+
+    with TestClient(app) as client:
+        yield client
+        client.portal.call(async_engine.dispose)
+
+def test_request_within_budget_passes(budget_client):
+    assert budget_client.get("/statements/2").json() == {"ran": 2}
+
+def test_request_over_budget_raises(budget_client):
+    with pytest.raises(QueryBudgetExceeded, match="3 statements, budget is 2"):
+        budget_client.get("/statements/3")
+
+def test_repeated_statement_is_reported_as_n_plus_one(budget_client):
+    assert budget_client.get(f"/repeated/{query_budget.N_PLUS_ONE_THRESHOLD - 1}").status_code == 200
+    with pytest.raises(QueryBudgetExceeded, match="possible N\\+1"):
+        budget_client.get(f"/repeated/{query_budget.N_PLUS_ONE_THRESHOLD}")
+
+def test_allow_repeats_raises_the_n_plus_one_threshold(budget_client):
+    assert budget_client.get(f"/chunked/{query_budget.N_PLUS_ONE_THRESHOLD + 1}").status_code == 200
+    with pytest.raises(QueryBudgetExceeded, match="possible N\\+1"):
+        budget_client.get(f"/chunked/{query_budget.N_PLUS_ONE_THRESHOLD + 2}")
+
+def test_repeats_ok_exempts_a_route(budget_client):
+    assert budget_client.get("/keyset").status_code == 200
+
+def test_extend_budget_allows_a_slow_path(budget_client):
+    assert budget_client.get("/extended").status_code == 200
+
+def test_track_queries_counts_sync_statements():
+    query_budget.instrument_engine(engine)
+    with engine.connect() as connection:
+        with query_budget.track_queries("block", budget=5, mode="raise") as tracker:
+            connection.execute(text("SELECT 1"))
+            connection.execute(text("SELECT 2"))
+        assert tracker.statements == 2
+
+        with pytest.raises(QueryBudgetExceeded, match="block: 2 statements, budget is 1"):
+            with query_budget.track_queries("block", budget=1, mode="raise"):
+                connection.execute(text("SELECT 1"))
+                connection.execute(text("SELECT 2"))
+
+def test_log_mode_only_warns(caplog):
+    tracker = query_budget.QueryTracker("request", budget=0)
+    tracker.record("SELECT 1")
+
+    tracker.check(mode="log")
+
+    assert "1 statements, budget is 0" in caplog.text
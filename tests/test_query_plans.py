@@ -0,0 +1,25 @@
+from sqlalchemy import create_engine, text
+
+from backend.database import Base
+from backend.utils.query_plans import HOT_QUERIES, check_query_plans
+
+def _scratch_engine():
+    # Plans are checked on SQLite whatever database the suite runs against
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(bind=engine)
+    return engine
+
+def test_hot_queries_use_their_indexes():
+    assert check_query_plans(_scratch_engine()) == []
+
+def test_a_query_scanning_its_table_fails():
+    engine = _scratch_engine()
+    with engine.begin() as connection:
+        connection.execute(text("DROP INDEX ix_sales_customer_id_id"))
+
+    failures = check_query_plans(engine)
+
+    names = [query.name for query in HOT_QUERIES if query.index == "ix_sales_customer_id_id"]
+    assert len(failures) == len(names) == 2
+    assert all(failure.startswith(f"{name}: expected ix_sales_customer_id_id")
+               for name, failure in zip(names, failures))
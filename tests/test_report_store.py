@@ -0,0 +1,59 @@
+import json
+from datetime import datetime, timedelta
+
+from sqlalchemy import event, insert, select
+
+from backend import models
+from backend.database import engine
+from backend.utils import report_store
+
+NOW = datetime(2026, 3, 10, 12)
+
+def _statements(db, call):
+    statements = []
+
+    def count(*_):
+        statements.append(1)
+
+    event.listen(engine, "after_cursor_execute", count)
+    try:
+        result = call(db)
+    finally:
+        event.remove(engine, "after_cursor_execute", count)
+    return result, len(statements)
+
+def test_latest_snapshot_is_served_from_the_cache_until_another_process_saves(fresh_state, db):
+    report_store.save_snapshot(db, "daily_sales", "daily", {"total": 1}, generated_at=NOW)
+
+    snapshot, statements = _statements(db, lambda db: report_store.latest_snapshot(db, "daily_sales", "daily"))
+    assert (snapshot.data, statements) == ({"total": 1}, 1)
+
+    # As another worker would: its save is not in this process's cache
+    with engine.begin() as connection:
+        connection.execute(insert(models.ReportSnapshot).values(
+            report_type="daily_sales", period="daily", generated_at=NOW + timedelta(minutes=5),
+            data=json.dumps({"total": 2})
+        ))
+    assert report_store.latest_snapshot(db, "daily_sales", "daily").data == {"total": 2}
+    assert report_store.latest_snapshot(db, "weekly_sales", "weekly") is None
+
+def test_cache_keeps_the_most_recently_used_reports(fresh_state, db, monkeypatch):
+    monkeypatch.setattr(report_store, "REPORT_CACHE_SIZE", 2)
+    for period in ("a", "b", "c"):
+        report_store.save_snapshot(db, "sales", period, {"period": period}, generated_at=NOW)
+    report_store.latest_snapshot(db, "sales", "b")
+
+    assert list(report_store._cache) == [("sales", "c"), ("sales", "b")]
+    assert report_store.latest_snapshot(db, "sales", "a").data == {"period": "a"}
+
+def test_compaction_thins_out_old_snapshots_and_applies_retention(fresh_state, db):
+    ages = [timedelta(hours=hours) for hours in (1, 2, 30, 31, 54)] + [timedelta(days=100)]
+    for age in ages:
+        db.add(models.ReportSnapshot(report_type="daily_sales", period="daily", generated_at=NOW - age, data="{}"))
+    db.commit()
+
+    report_store.compact_snapshots(db, NOW)
+
+    kept = db.scalars(select(models.ReportSnapshot.generated_at).order_by(models.ReportSnapshot.generated_at.desc()))
+    # All of the last day, then the newest of each older day, none past retention
+    assert list(kept) == [NOW - timedelta(hours=hours) for hours in (1, 2, 30, 54)]
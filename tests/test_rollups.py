@@ -0,0 +1,73 @@
+from datetime import datetime
+
+from sqlalchemy import func, select
+
+from backend import models
+from backend.utils import reports, rollups
+from conftest import create_product, sell
+
+def _summary(db):
+    db.expire_all()
+    today = datetime.utcnow().date()
+    return reports.summarize_sales(db, today, today)
+
+def _from_sales(db):
+    db.expire_all()
+    counted = models.Sale.status.notin_(rollups.EXCLUDED_STATUSES)
+    total, count = db.execute(select(func.sum(models.Sale.total_amount), func.count()).where(counted)).one()
+    products = dict(db.execute(
+        select(models.SaleItem.product_id, func.sum(models.SaleItem.quantity))
+        .join(models.Sale, models.Sale.id == models.SaleItem.sale_id)
+        .where(counted)
+        .group_by(models.SaleItem.product_id)
+    ).all())
+    return total, count, products
+
+def _check(db):
+    summary = _summary(db)
+    total, count, products = _from_sales(db)
+    [(_, day_total, day_count)] = summary["days"]
+    assert (round(day_total, 2), day_count) == (round(total, 2), count)
+    assert {product_id: quantity for product_id, (_, quantity, _) in summary["products"].items() if quantity} \
+        == products
+    return summary
+
+def _sales(client, headers):
+    tea = create_product(client, headers, name="Tea", price=2.0)
+    cake = create_product(client, headers, name="Cake", price=3.5)
+    sale_ids = [sell(client, headers, (tea, n + 1), (cake, 1)).json()["id"] for n in range(4)]
+    assert client.put(f"/sales/{sale_ids[0]}/status", params={"status": "cancelled"}, headers=headers).status_code == 200
+    assert client.delete(f"/sales/{sale_ids[1]}", headers=headers).status_code == 204
+    return tea, cake, sale_ids
+
+def test_reports_add_the_deltas_not_folded_yet(client, headers, db):
+    _sales(client, headers)
+    assert db.scalar(select(func.count()).select_from(models.DailySalesRollup)) == 0
+
+    before = _check(db)
+    assert rollups.run_fold() > 0
+
+    assert db.scalar(select(func.count()).select_from(models.SalesRollupDelta)) == 0
+    assert _check(db) == before
+
+def test_status_changes_after_the_fold_move_the_rollups(client, headers, db):
+    tea, _, sale_ids = _sales(client, headers)
+    rollups.run_fold()
+
+    assert client.put(f"/sales/{sale_ids[0]}/status", params={"status": "completed"}, headers=headers).status_code == 200
+    assert client.put(f"/sales/{sale_ids[2]}/status", params={"status": "cancelled"}, headers=headers).status_code == 200
+    assert sell(client, headers, (tea, 5)).status_code == 201
+
+    _check(db)
+    rollups.run_fold()
+    _check(db)
+
+def test_rebuild_matches_the_folded_rollups(client, headers, db):
+    _sales(client, headers)
+    rollups.run_fold()
+    folded = _check(db)
+
+    rollups.rebuild_rollups(db)
+    db.commit()
+
+    assert _check(db) == folded
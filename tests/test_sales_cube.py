@@ -0,0 +1,187 @@
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+
+import numpy as np
+import pytest
+from sqlalchemy import func, select
+
+from backend import models
+from backend.utils import sales_cube
+from backend.utils.sales_cube import DAY, SalesCube, epoch_seconds
+from conftest import create_product, sell
+
+COLUMNS = {
+    "product": models.SaleItem.product_id,
+    "customer": func.coalesce(models.Sale.customer_id, 0),
+    "user": models.Sale.user_id,
+}
+
+def _from_sql(db, group_by=(), product_ids=(), customer_ids=()):
+    keys = [COLUMNS[dimension] for dimension in group_by]
+    statement = (
+        select(*keys, func.sum(models.SaleItem.quantity), func.sum(models.SaleItem.quantity * models.SaleItem.price),
+               func.count())
+        .join(models.Sale, models.Sale.id == models.SaleItem.sale_id)
+        .where(models.Sale.status != "cancelled")
+        .group_by(*keys)
+    )
+    if product_ids:
+        statement = statement.where(models.SaleItem.product_id.in_(product_ids))
+    if customer_ids:
+        statement = statement.where(func.coalesce(models.Sale.customer_id, 0).in_(customer_ids))
+    db.expire_all()
+    return {tuple(row[:len(keys)]): (row[-3], pytest.approx(row[-2]), row[-1])
+            for row in db.execute(statement) if row[-1]}
+
+def _from_cube(client, headers, group_by=(), product_ids=(), customer_ids=()):
+    response = client.get("/reports/query", params={
+        "group_by": list(group_by), "product_id": list(product_ids), "customer_id": list(customer_ids),
+    }, headers=headers)
+    assert response.status_code == 200, response.text
+    body = response.json()
+    if not group_by:
+        totals = body["totals"]
+        return {(): (totals["quantity"], totals["revenue"], totals["line_items"])} if totals["line_items"] else {}
+    # Sales without a customer come back with customer_id None
+    return {tuple(group[f"{dimension}_id"] or 0 for dimension in group_by):
+            (group["quantity"], group["revenue"], group["line_items"]) for group in body["groups"]}
+
+def _check_all(client, headers, db, products, customers):
+    queries = [
+        {},
+        {"group_by": ["product"]},
+        {"group_by": ["customer"]},
+        {"group_by": ["product", "customer"]},
+        {"group_by": ["user"]},
+        {"group_by": ["customer"], "product_ids": products[:2]},
+        {"group_by": ["product"], "customer_ids": [0, customers[0]]},
+    ]
+    for query in queries:
+        assert _from_cube(client, headers, **query) == _from_sql(db, **query), query
+
+@pytest.mark.parametrize("grace_seconds", [60, 0])
+def test_cube_matches_sql(client, headers, db, monkeypatch, grace_seconds):
+    # With no grace period the sales are settled at once, and the questions
+    # with no customer or cashier are summed from the day x product blocks
+    monkeypatch.setattr(sales_cube, "SALES_CUBE_GRACE_SECONDS", grace_seconds)
+    products = [create_product(client, headers, name=f"Product {n}", price=1.25 * (n + 1), stock=1000)
+                for n in range(3)]
+    customers = []
+    for n in range(2):
+        response = client.post("/customers/", json={"name": f"Customer {n}", "email": f"c{n}@example.com"},
+                               headers=headers)
+        customers.append(response.json()["id"])
+
+    sale_ids = []
+    for n in range(12):
+        items = [(products[n % 3], 1 + n % 4)] + ([(products[(n + 1) % 3], 2)] if n % 2 else [])
+        customer_id = customers[n % 2] if n % 3 else None
+        response = sell(client, headers, *items, customer_id=customer_id)
+        assert response.status_code == 201, response.text
+        sale_ids.append(response.json()["id"])
+    assert client.put(f"/sales/{sale_ids[0]}/status", params={"status": "cancelled"}, headers=headers).status_code == 200
+    assert client.delete(f"/sales/{sale_ids[1]}", headers=headers).status_code == 204
+
+    _check_all(client, headers, db, products, customers)
+
+    # Changes after the cube is loaded are caught up by the next query
+    assert sell(client, headers, (products[2], 5), customer_id=customers[1]).status_code == 201
+    assert client.put(f"/sales/{sale_ids[2]}/status", params={"status": "cancelled"}, headers=headers).status_code == 200
+    assert client.put(f"/sales/{sale_ids[0]}/status", params={"status": "completed"}, headers=headers).status_code == 200
+    assert client.delete(f"/sales/{sale_ids[3]}", headers=headers).status_code == 204
+
+    _check_all(client, headers, db, products, customers)
+
+FIRST_DAY = datetime(2026, 3, 1)
+
+def _synthetic_rows(count: int, days: int, products: int):
+    rng = np.random.default_rng(7)
+    ts = np.sort(epoch_seconds(FIRST_DAY) + rng.integers(0, days * DAY, count))
+    product_ids = rng.integers(1, products + 1, count).astype(np.int32)
+    quantity = rng.integers(1, 4, count).astype(np.float64)
+    return {
+        "ts": ts,
+        "hour": (ts // 3600 % 24).astype(np.int8),
+        "product_id": product_ids,
+        "customer_id": np.zeros(count, np.int32),
+        "user_id": np.ones(count, np.int32),
+        "quantity": quantity,
+        "amount": quantity * 1.5 * product_ids,
+        "sale_id": np.arange(count, dtype=np.int64) // 2 + 1,
+        "excluded": rng.random(count) < 0.1,
+    }
+
+def _expected(rows, group_by, start=None, end=None, product_ids=()):
+    groups = defaultdict(lambda: [0, 0.0, 0])
+    for ts, product_id, quantity, amount, excluded in zip(
+        rows["ts"].tolist(), rows["product_id"].tolist(), rows["quantity"].tolist(), rows["amount"].tolist(),
+        rows["excluded"].tolist()
+    ):
+        if excluded or (start and ts < epoch_seconds(start)) or (end and ts > epoch_seconds(end)):
+            continue
+        if product_ids and product_id not in product_ids:
+            continue
+        values = {"day": date(1970, 1, 1) + timedelta(days=ts // DAY), "product": product_id}
+        group = groups[tuple(values[dimension] for dimension in group_by)]
+        group[0] += quantity
+        group[1] += amount
+        group[2] += 1
+    return {key: (quantity, pytest.approx(amount), line_items) for key, (quantity, amount, line_items) in groups.items()}
+
+def _answer(cube, db, group_by, **filters):
+    result = cube.query(db, group_by=group_by, limit=1000, **filters)
+    names = {"day": "day", "product": "product_id"}
+    return {tuple(group[names[dimension]] for dimension in group_by):
+            (group["quantity"], group["revenue"], group["line_items"]) for group in result["groups"]}
+
+def test_whole_day_questions_are_summed_from_blocks(fresh_state, db):
+    rows = _synthetic_rows(3000, days=10, products=12)
+    cube = SalesCube()
+    cube.load(db)
+    cube.append(rows)
+    # Far fewer blocks than rows: one per day and product sold that day
+    assert len(cube._blocks) <= 10 * 12
+
+    week = {"start": FIRST_DAY + timedelta(days=2), "end": FIRST_DAY + timedelta(days=8, seconds=-1)}
+    questions = [
+        ((), {}),
+        (("product",), {}),
+        (("day",), {}),
+        (("day", "product"), {}),
+        (("product",), {"product_ids": [2, 3, 5], **week}),
+        (("day",), week),
+    ]
+
+    def check():
+        for group_by, filters in questions:
+            cube_filters = {"start_date": filters.get("start"), "end_date": filters.get("end"),
+                            "product_ids": filters.get("product_ids", ())}
+            assert _answer(cube, db, group_by, **cube_filters) == _expected(rows, group_by, **filters), group_by
+
+    check()
+    # Cancelling and restoring sales moves their lines out of and into the blocks
+    cancelled, restored = [1, 2, 700], rows["sale_id"][rows["excluded"]][:5].tolist()
+    cube._apply_changes({**{sale_id: True for sale_id in cancelled}, **{sale_id: False for sale_id in restored}})
+    rows["excluded"][np.isin(rows["sale_id"], cancelled)] = True
+    rows["excluded"][np.isin(rows["sale_id"], restored)] = False
+    check()
+    # A backdated line of a new product is a new block among the first day's
+    late = {name: column[:1].copy() for name, column in _synthetic_rows(1, days=1, products=12).items()}
+    late["product_id"][:], late["excluded"][:] = 13, False
+    cube.append(late)
+    rows = {name: np.concatenate([rows[name], late[name]]) for name in rows}
+    check()
+
+def test_route_allows_for_a_burst_read_in_chunks(client, headers, monkeypatch):
+    product_id = create_product(client, headers, stock=100)
+    assert client.get("/reports/query", headers=headers).status_code == 200
+    monkeypatch.setattr(sales_cube, "LOAD_CHUNK_SIZE", 2)
+    sale_ids = [sell(client, headers, (product_id, 1)).json()["id"] for _ in range(7)]
+    for sale_id in sale_ids[:5]:
+        client.put(f"/sales/{sale_id}/status", params={"status": "cancelled"}, headers=headers)
+
+    # The test app raises if the chunked reads of the burst exceed the route's budget
+    response = client.get("/reports/query", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json()["totals"]["line_items"] == 2
@@ -0,0 +1,100 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from backend.utils import analytics_pool, report_store, scheduler
+from backend.utils.scheduler import CronSchedule
+from conftest import create_product, sell
+
+@pytest.fixture
+def jobs(client):
+    yield client
+    # The worker runs on the client's event loop
+    client.portal.call(scheduler.stop)
+
+def _wait(client, job):
+    async def done():
+        await asyncio.wait_for(job.done.wait(), 10)
+    client.portal.call(done)
+
+def test_cron_fields_and_longest_gap():
+    assert scheduler.parse_field("*/15", 60) == {0, 15, 30, 45}
+    assert scheduler.parse_field("1,5", 24) == {1, 5}
+    with pytest.raises(ValueError):
+        scheduler.parse_field("61", 60)
+    assert CronSchedule("*/5 *").longest_gap() == timedelta(minutes=5)
+    # From 18:00 to 06:00 the next day
+    assert CronSchedule("0 6,12,18").longest_gap() == timedelta(hours=12)
+    assert CronSchedule("0 6,12,18").matches(datetime(2026, 3, 1, 12, 0))
+    assert not CronSchedule("0 6,12,18").matches(datetime(2026, 3, 1, 12, 5))
+
+def test_max_age_follows_the_schedule(monkeypatch):
+    monkeypatch.setitem(scheduler.REPORT_SCHEDULES, ("daily_sales", "daily"), "*/10 *")
+    timeout = timedelta(seconds=analytics_pool.ANALYTICS_TIMEOUT_SECONDS)
+
+    assert scheduler.max_age("daily_sales", "daily") == timedelta(minutes=10) + timeout
+    monkeypatch.setattr(scheduler, "REPORT_MAX_AGE_SECONDS", "30")
+    assert scheduler.max_age("daily_sales", "daily") == timedelta(seconds=30)
+
+def test_first_request_waits_for_the_report(jobs, headers):
+    product_id = create_product(jobs, headers, price=4.0)
+    assert sell(jobs, headers, (product_id, 3)).status_code == 201
+
+    response = jobs.get("/reports/daily", headers=headers)
+
+    assert response.status_code == 200, response.text
+    assert response.json()["summary"] == {"total_sales": 12.0, "num_transactions": 1, "average_transaction": 12.0}
+    assert response.headers["x-report-stale"] == "false"
+
+def test_a_report_runs_one_job_at_a_time(jobs):
+    async def enqueue_twice():
+        first, again = scheduler.enqueue("weekly_sales", "weekly"), scheduler.enqueue("weekly_sales", "weekly")
+        await asyncio.wait_for(first.done.wait(), 10)
+        return first, again, scheduler.enqueue("weekly_sales", "weekly")
+
+    first, again, after = jobs.portal.call(enqueue_twice)
+
+    assert again is first
+    assert first.status == "succeeded"
+    assert after is not first
+
+def test_refresh_answers_with_the_job(jobs, headers):
+    response = jobs.get("/reports/weekly", params={"refresh": True}, headers=headers)
+
+    assert response.status_code == 202
+    job_id = response.json()["id"]
+    assert response.headers["location"] == f"/reports/jobs/{job_id}"
+    _wait(jobs, scheduler.get_job(job_id))
+    assert jobs.get(f"/reports/jobs/{job_id}", headers=headers).json()["status"] == "succeeded"
+    assert jobs.get("/reports/jobs/missing", headers=headers).status_code == 404
+    assert jobs.delete("/reports/jobs/missing", headers=headers).status_code == 404
+
+def test_a_queued_job_can_be_cancelled(jobs, headers):
+    async def enqueue_two():
+        # Nothing runs until this coroutine awaits, so the second job is still queued
+        running, queued = scheduler.enqueue("daily_sales", "daily"), scheduler.enqueue("weekly_sales", "weekly")
+        scheduler.cancel(queued)
+        await asyncio.wait_for(running.done.wait(), 10)
+        return running, queued
+
+    running, queued = jobs.portal.call(enqueue_two)
+
+    assert (running.status, queued.status) == ("succeeded", "cancelled")
+    response = jobs.delete(f"/reports/jobs/{queued.id}", headers=headers)
+    assert response.json()["status"] == "cancelled"
+
+def test_a_stale_report_is_served_and_regenerated(jobs, headers, db, monkeypatch):
+    monkeypatch.setattr(scheduler, "REPORT_MAX_AGE_SECONDS", "60")
+    report_store.save_snapshot(db, "monthly_sales", "monthly", {"old": True},
+                               generated_at=datetime.utcnow() - timedelta(minutes=5))
+
+    response = jobs.get("/reports/monthly", headers=headers)
+
+    assert response.json() == {"old": True}
+    assert response.headers["x-report-stale"] == "true"
+    job = scheduler._pending[("monthly_sales", "monthly")]
+    _wait(jobs, job)
+    fresh = jobs.get("/reports/monthly", headers=headers)
+    assert fresh.headers["x-report-stale"] == "false"
+    assert "summary" in fresh.json()